@@ -3,12 +3,47 @@ from shapes import (
     EllipseShape,
     SquareShape,
     LineShape,
+    PolylineShape,
     PolygonWithLines,
+    ShapeBase,
 )
+from document import Document, pivot_runs, shape_from_entry
 from view import DragGraphicsView
+from profiling import Instrumentation, instrumented
+from memory import memory_report
+from history import (
+    DEFAULT_MEMORY_BUDGET,
+    ITEM_REF_BYTES,
+    RETAINED_ITEM_BYTES,
+    AddItems,
+    History,
+    Move,
+    RemoveItems,
+    Resize,
+    Rotate,
+    SetFill,
+    SetGroups,
+)
+from storage import (
+    BinaryDocument,
+    is_binary,
+    is_ndjson,
+    iter_entries,
+    json_entries,
+    write_entries,
+)
+from journal import Journal
+from freehand import STROKE_COLOR, shape_path
+from snapping import SnapIndex
+from tasks import EntryLoader, LoadTask, OpenTask, SaveTask
+from virtual import Virtualizer, VirtualItem, style_item
 
+import os
 import sys
 import json
+import tracemalloc
+from array import array
+from contextlib import contextmanager
 from PyQt5.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -16,33 +51,93 @@ from PyQt5.QtWidgets import (
     QGraphicsRectItem,
     QGraphicsEllipseItem,
     QGraphicsLineItem,
+    QGraphicsPathItem,
     QGraphicsItem,
     QToolBar,
     QAction,
     QColorDialog,
     QFileDialog,
     QInputDialog,
-    QGraphicsPolygonItem,
+    QMessageBox,
+    QProgressDialog,
+)
+from PyQt5.QtCore import QRectF, QThread, QTimer, Qt, pyqtSignal
+from PyQt5.QtGui import QKeySequence
+
+FILE_FILTER = (
+    "JSON Files (*.json);;Binary Drawing Files (*.drwb);;"
+    "Streaming JSON Files (*.ndjson *.ndjson.gz)"
 )
-from PyQt5.QtCore import QRectF, QPointF
-from PyQt5.QtGui import QPen, QBrush, QColor, QPolygonF
+
+# How often the edit journal of the open document is synced to disk and
+# checked for compaction.
+AUTOSAVE_MS = 1000
+
+# A transaction switches the scene index off once it has added or removed
+# at least this many items, and at least 1/BULK_INDEX_SHARE of the scene.
+# Smaller batches are cheaper to index item by item than to rebuild for.
+BULK_INDEX_ITEMS = 1000
+BULK_INDEX_SHARE = 20
 
 
 class DrawingApp(QMainWindow):
-    def __init__(self):
+    # Emitted once the first screenful of a document being opened has been
+    # added (it is painted on the next event-loop iteration).
+    firstScreenfulAdded = pyqtSignal()
+    # Emitted with the file name when a background load has added every shape.
+    documentLoaded = pyqtSignal(str)
+
+    def __init__(self, history_budget=DEFAULT_MEMORY_BUDGET, virtualized=None):
         super().__init__()
         self.setWindowTitle("Drawing App")
         self.resize(800, 600)
         self.scene = QGraphicsScene()
-        self.view = DragGraphicsView(self.scene)
+        # The app is a view of this document: its items are the members.
+        self.document = Document()
+        self.store = self.document.store
+        self.items = self.document.items
+        self.groups = self.document.groups
+        self.history = History(self, history_budget)
+        self.journal = None
+        self._pending_journal = None
+        self._task = None
+        self._progress = None
+        self._transaction_depth = 0
+        self._transaction_items = 0
+        self._index_method = None
+        self._autosave_timer = QTimer(self)
+        self._autosave_timer.setInterval(AUTOSAVE_MS)
+        self._autosave_timer.timeout.connect(self._autosave)
+        self.instrumentation = Instrumentation()
+        self.instrumentation.gauge("Items", lambda: len(self.items))
+        self.view = DragGraphicsView(
+            self.scene, groups=self.groups, instrumentation=self.instrumentation
+        )
+        self.view.itemsMoved.connect(self._recordMove)
+        if virtualized is None:
+            virtualized = bool(os.environ.get("DRAWING_APP_VIRTUALIZE"))
+        self.virtualizer = None
+        if virtualized:
+            self.virtualizer = Virtualizer(self.view, self.store)
+            self.view.virtualizer = self.virtualizer
+            self.instrumentation.gauge("Live items", lambda: len(self.virtualizer))
         self.setCentralWidget(self.view)
-        self.items = []
         self.initUI()
+        if os.environ.get("DRAWING_APP_PROFILE"):
+            self.instrumentation.enabled = True
+            self.view.setStatsOverlayVisible(True)
+        if os.environ.get("DRAWING_APP_TRACE_MEMORY"):
+            self.instrumentation.enabled = True
+            self.instrumentation.trace_allocations()
+            self.instrumentation.gauge(
+                "Traced MB", lambda: f"{tracemalloc.get_traced_memory()[0] / 2**20:.1f}"
+            )
 
     def initUI(self):
         """Initialize the toolbar and UI actions."""
         toolbar = QToolBar()
         self.addToolBar(toolbar)
+        shortcuts = {"Undo": QKeySequence.Undo, "Redo": QKeySequence.Redo}
 
         for label, handler in [
             ("Rectangle", self.addRectangle),
@@ -58,15 +153,92 @@ class DrawingApp(QMainWindow):
             ("Scale", self.scaleSelected),
             ("Clear All", self.clearAll),
             ("Clear Selected", self.clearSelected),
+            ("Undo", self.undo),
+            ("Redo", self.redo),
+            ("New", self.newDocument),
             ("Save", self.saveToFile),
             ("Load", self.loadFromFile),
         ]:
             action = QAction(label, self)
-            action.triggered.connect(handler)
+            if label in shortcuts:
+                action.setShortcut(shortcuts[label])
+            # Drop the "checked" argument so handlers are called bare.
+            action.triggered.connect(lambda _checked=False, h=handler: h())
             toolbar.addAction(action)
+        self.freehandAction = QAction("Freehand", self)
+        self.freehandAction.setCheckable(True)
+        self.freehandAction.toggled.connect(self.view.setFreehand)
+        # Next to the other shape tools, after "Line".
+        toolbar.insertAction(toolbar.actions()[4], self.freehandAction)
+        self.view.strokeFinished.connect(self.addStroke)
+        self.snapGridAction = QAction("Snap to Grid", self)
+        self.snapGridAction.setCheckable(True)
+        self.snapGridAction.toggled.connect(self.setSnapToGrid)
+        toolbar.addAction(self.snapGridAction)
+        self.snapShapesAction = QAction("Snap to Shapes", self)
+        self.snapShapesAction.setCheckable(True)
+        self.snapShapesAction.toggled.connect(self.setSnapToShapes)
+        toolbar.addAction(self.snapShapesAction)
+
+    def setSnapToGrid(self, enabled):
+        """Snap dragged shapes to a grid of GRID_SIZE scene units."""
+        self.view.snapToGrid = enabled
 
+    def setSnapToShapes(self, enabled):
+        """
+        Snap dragged shapes to the edges and centers of the others, with
+        guides. The edge index is only kept up to date while this is on.
+        """
+        index = self.view.snapIndex
+        if enabled and index is None:
+            self.view.snapIndex = SnapIndex(self.store)
+        elif not enabled and index is not None:
+            index.detach()
+            self.view.snapIndex = None
+
+    @instrumented("add_shape")
     def addShape(self, shape):
         """Add a shape to the scene with graphics and interaction."""
+        if isinstance(shape, ShapeBase):
+            self.store.adopt(shape)
+        item = self._createItem(shape)
+        if item is not None:
+            self._addItem(item)
+            self._record(AddItems([item]))
+            self.instrumentation.touched(1)
+
+    @instrumented("add_shapes")
+    def addShapes(self, shapes):
+        """
+        Add many shapes as one edit (a single undo step) and return their
+        items.
+
+        Rows are moved into the document's store in one batch and the items
+        are added in one transaction, so scripts generating large drawings
+        are not paced by per-shape addShape() calls.
+        """
+        shapes = list(shapes)
+        self.store.adopt_many([shape for shape in shapes if isinstance(shape, ShapeBase)])
+        added = []
+        with self.transaction():
+            for shape in shapes:
+                item = self._createItem(shape)
+                if item is not None:
+                    self._addItem(item)
+                    added.append(item)
+        if added:
+            self._record(AddItems(added))
+        self.instrumentation.touched(len(added))
+        return added
+
+    def _createItem(self, shape):
+        """
+        Build the styled, interactive graphics item for a shape.
+
+        In virtualized mode model-backed shapes get a VirtualItem instead.
+        """
+        if self.virtualizer is not None and isinstance(shape, ShapeBase):
+            return self.virtualizer.createItem(shape)
         if isinstance(shape, RectangleShape):
             item = QGraphicsRectItem(shape.x, shape.y, shape.width, shape.height)
         elif isinstance(shape, EllipseShape):
@@ -75,26 +247,46 @@ class DrawingApp(QMainWindow):
             item = QGraphicsRectItem(shape.x, shape.y, shape.width, shape.width)
         elif isinstance(shape, LineShape):
             item = QGraphicsLineItem(shape.x, shape.y, shape.x2, shape.y2)
+        elif isinstance(shape, PolylineShape):
+            item = QGraphicsPathItem(shape_path(shape))
         elif isinstance(shape, PolygonWithLines):
             item = self.createPolygonItem(
                 shape
             )  # Use PolygonWithLines for the polygon + lines
         else:
-            return
+            return None
         item.shape = shape
         item.setTransformOriginPoint(item.boundingRect().center())
+        if isinstance(shape, ShapeBase):
+            item.setPos(shape.pos_x, shape.pos_y)
+            item.setRotation(shape.rotation)
+            item.setScale(shape.scale)
         item.setFlags(
             QGraphicsItem.ItemIsSelectable
             | QGraphicsItem.ItemIsMovable
             | QGraphicsItem.ItemIsFocusable
         )
-        if isinstance(item, QGraphicsLineItem):
-            item.setPen(QPen(QColor(*shape.fill_color), shape.stroke_width))
+        style_item(item, shape)
+        return item
+
+    def _addItem(self, item):
+        """Put an item in the scene and register it with the app."""
+        if isinstance(item, VirtualItem):
+            self.virtualizer.add(item)
         else:
-            item.setBrush(QBrush(QColor(*shape.fill_color)))
-            item.setPen(QPen(QColor(*shape.border_color), shape.stroke_width))
+            self._bulkChange(1)
+            self.scene.addItem(item)
+        self.document.add(item)
+
+    def _restackItem(self, item):
+        """Move an item to the top of the stacking order and the item order."""
+        self.document.bring_to_front(item)
+        if isinstance(item, VirtualItem):
+            return
+        selected = item.isSelected()
+        self.scene.removeItem(item)
         self.scene.addItem(item)
-        self.items.append(item)
+        item.setSelected(selected)
 
     def addPolygon(self):
         vertices = [(100, 0), (-100, 0), (-40, -40), (70, -40), (100, 0)]
@@ -127,86 +319,314 @@ class DrawingApp(QMainWindow):
         # polygon_item.set_line(1, (-100, 20), (50, 50))
 
     def addRectangle(self):
-        self.addShape(RectangleShape(50, 50, 100, 60))
+        self.addShape(RectangleShape(50, 50, 100, 60, store=self.store))
 
     def addEllipse(self):
-        self.addShape(EllipseShape(60, 60, 100, 60))
+        self.addShape(EllipseShape(60, 60, 100, 60, store=self.store))
 
     def addSquare(self):
-        self.addShape(SquareShape(70, 70, 80))
+        self.addShape(SquareShape(70, 70, 80, store=self.store))
+
+    def addStroke(self, points):
+        """Add a freehand stroke (interleaved x, y scene coordinates)."""
+        self.addShape(PolylineShape(points, STROKE_COLOR, self.store))
 
     def addLine(self):
-        self.addShape(LineShape(100, 100, 200, 200))
+        self.addShape(LineShape(100, 100, 200, 200, store=self.store))
 
+    @instrumented("clear_all")
     def clearAll(self):
         """Remove all items from the scene."""
-        for item in self.items:
-            self.scene.removeItem(item)
-        self.items.clear()
+        items = list(self.items)
+        self.instrumentation.touched(len(items))
+        if self._keepForUndo(items):
+            self._removeRecorded(items)
+            self.store.clear()
+            return
+        self._clearVirtualizer()
+        self.document.clear()
+        self._removeItems(items)
+        self._record(RemoveItems(items), undoable=False)
 
+    @instrumented("clear_selected")
     def clearSelected(self):
         """Remove only the selected shapes from the scene."""
-        for item in self.scene.selectedItems():
-            if item in self.items:
-                self.scene.removeItem(item)
-                self.items.remove(item)
+        items = [item for item in self.selectedItems() if item in self.items]
+        self.instrumentation.touched(len(items))
+        if self._keepForUndo(items):
+            self._removeRecorded(items)
+        else:
+            self._detachItems(items)
+            self._record(RemoveItems(items), undoable=False)
+
+    def _keepForUndo(self, items):
+        """
+        Whether removed items fit in the undo history's memory budget.
+
+        If they do not, the removal cannot be undone, and neither can
+        anything before it, so the history is cleared.
+        """
+        if not items:
+            return False
+        if self.history.fits(len(items) * (RETAINED_ITEM_BYTES + ITEM_REF_BYTES)):
+            return True
+        self.history.clear()
+        return False
+
+    def _removeRecorded(self, items):
+        command = RemoveItems(items)
+        command.redo(self)
+        self._record(command)
+
+    def _record(self, command, undoable=True):
+        """Log an applied edit in the undo history and the document journal."""
+        if undoable:
+            self.history.push(command)
+        self._journalRecord(command)
+
+    def _journalRecord(self, command, undo=False):
+        # A save in progress has its own journal for the new snapshot.
+        for journal in (self.journal, self._pending_journal):
+            if journal is not None:
+                journal.record(command, undo)
+
+    def _detachItems(self, items, archive=None):
+        """
+        Take items out of the scene and the registries.
+
+        Their shapes' model rows move into the ``archive`` store if one is
+        given (so the items can be attached again), otherwise they are
+        released.
+        """
+        self.document.discard(items)
+        shapes = [item.shape for item in items if isinstance(item.shape, ShapeBase)]
+        # Virtual items are looked up by row, so they go before the rows move.
+        self._removeItems(items)
+        if archive is not None:
+            archive.adopt_many(shapes)
+        else:
+            for shape in shapes:
+                shape.store.release(shape.index)
+
+    def _attachItems(self, items):
+        """Put detached items (and their archived rows) back."""
+        self.store.adopt_many(
+            [item.shape for item in items if isinstance(item.shape, ShapeBase)]
+        )
+        with self.transaction():
+            for item in items:
+                self._addItem(item)
+
+    def newDocument(self):
+        """
+        Start an empty drawing that is not tied to any file.
+
+        The open document's journal is synced and left on disk, and the
+        undo history is cleared.
+        """
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+            self._autosave_timer.stop()
+        items = list(self.items)
+        self._clearVirtualizer()
+        self.document.clear()
+        self._removeItems(items)
+        self.history.clear()
+
+    def _clearVirtualizer(self):
+        if self.virtualizer is not None:
+            self.virtualizer.clear()
+
+    def _removeItems(self, items):
+        """
+        Remove items from the scene as one batch (see transaction()).
+        """
+        if not items:
+            return
+        with self.transaction():
+            self._bulkChange(len(items))
+            for item in items:
+                if isinstance(item, VirtualItem):
+                    self.virtualizer.remove(item)
+                else:
+                    self.scene.removeItem(item)
+
+    def selectedItems(self):
+        """
+        The selected items, including ones the view has not materialized.
+        """
+        return self.view.selectedItems()
+
+    def memoryReport(self):
+        """
+        Memory diagnostics of the drawing as plain data: model bytes and
+        live objects per shape type, graphics items left alive outside the
+        scene and the undo history's share (see memory.memory_report()).
+        """
+        return memory_report(self)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Apply a batch of edits with one repaint and one index update.
 
+        The view stops repainting until the outermost transaction ends and
+        then repaints once. Moved, rotated, scaled and recolored items stay
+        in the scene index, which re-indexes them together the next time it
+        is queried. Once a transaction has added or removed many items (see
+        BULK_INDEX_ITEMS) the index is switched off instead and rebuilt in
+        one pass at the end. Transactions nest; the selected-item
+        operations, undo and redo already run in one.
+
+        For scripted bulk edits (each call is still its own undo step):
+
+            with app.transaction():
+                app.moveItemsBy(row, 40, 0)
+                app.scaleItemsBy(column, 1.5)
+                app.setItemsColor(row + column, QColor(200, 30, 30))
+        """
+        self._transaction_depth += 1
+        if self._transaction_depth == 1:
+            self._transaction_items = 0
+            self.view.setUpdatesEnabled(False)
+        try:
+            yield self
+        finally:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                if self._index_method is not None:
+                    self.scene.setItemIndexMethod(self._index_method)
+                    self._index_method = None
+                self.view.setUpdatesEnabled(True)
+                self.view.viewport().update()
+
+    def _bulkChange(self, count):
+        """Note that the open transaction adds or removes ``count`` items."""
+        if not self._transaction_depth or self._index_method is not None:
+            return
+        self._transaction_items += count
+        if (
+            self._transaction_items >= BULK_INDEX_ITEMS
+            and self._transaction_items * BULK_INDEX_SHARE >= len(self.items)
+        ):
+            self._index_method = self.scene.itemIndexMethod()
+            self.scene.setItemIndexMethod(QGraphicsScene.NoIndex)
+
+    @instrumented("group")
     def groupSelected(self):
         """Assign a group ID to selected shapes."""
-        group_id = id(self) + len(self.scene.selectedItems())
-
-        for item in self.scene.selectedItems():
-            if hasattr(item, "shape") and item.shape is not None:
-                shape = item.shape
-                if hasattr(
-                    shape, "group_id"
-                ):  # Ensure the shape has a group_id attribute
-                    shape.group_id = group_id
+        items = [
+            item
+            for item in self.selectedItems()
+            if getattr(item, "shape", None) is not None
+        ]
+        self.instrumentation.touched(len(items))
+        loose = [item for item in items if item.shape.group_id is None]
+        roots = self.groups.roots(items)
+        group_id = self.document.group(items)
+        if group_id is not None:
+            links = [(root, None, group_id) for root in roots]
+            self._record(SetGroups(loose, [None] * len(loose), group_id, links))
 
+    @instrumented("ungroup")
     def ungroupSelected(self):
-        """Remove group ID from selected shapes."""
-        for item in self.scene.selectedItems():
-            if hasattr(item, "shape") and item.shape is not None:
-                shape = item.shape
-                if hasattr(shape, "group_id"):
-                    shape.group_id = None
+        """Dissolve the top-level groups of selected shapes by one level."""
+        items = [
+            item
+            for item in self.selectedItems()
+            if getattr(item, "shape", None) is not None
+        ]
+        self.instrumentation.touched(len(items))
+        members, old_ids, links = [], [], []
+        for root in self.groups.roots(items):
+            direct = self.groups.direct_members(root)
+            members.extend(direct)
+            old_ids.extend([root] * len(direct))
+            links.extend((child, root, None) for child in self.groups.children(root))
+        self.document.ungroup(items)
+        if members or links:
+            self._record(SetGroups(members, old_ids, None, links))
+
+    def _assignGroups(self, items, group_ids, links=()):
+        """Put each item into the group with the matching ID (or none)."""
+        self.document.assign_groups(items, group_ids, links)
 
     def changeColorSelected(self):
         """Change the color of selected shapes (or their groups)."""
         color = QColorDialog.getColor()
         if not color.isValid():
             return
+        self.setColorSelected(color)
 
-        selected = self.scene.selectedItems()
+    def setColorSelected(self, color):
+        """Set the fill color of selected shapes (or their groups)."""
+        self.setItemsColor(self.selectedItems(), color)
 
-        # Get the group_ids of all selected items
-        group_ids = {
-            item.shape.group_id for item in selected if item.shape.group_id is not None
-        }
+    @instrumented("recolor")
+    def setItemsColor(self, items, color):
+        """
+        Set the fill color (a QColor) of the given items and the rest of
+        their groups, as one undo step.
+        """
+        items = self.document.expand(items)
+        self.instrumentation.touched(len(items))
+        if not items:
+            return
+        old_fills = self.document.fills(items)
+        self.document.recolor(items, (color.red(), color.green(), color.blue()))
+        with self.transaction():
+            for item in items:
+                self._styleItem(item)
+        self._record(SetFill(items, old_fills, color.rgb() & 0xFFFFFF))
 
-        for item in self.items:
-            # If the item is selected directly (and not in a group), or it shares a group ID with a selected item
-            if (
-                item in selected and item.shape.group_id is None
-            ) or item.shape.group_id in group_ids:
-                if isinstance(item, QGraphicsLineItem):
-                    item.setPen(QPen(color, item.pen().width()))
-                else:
-                    item.setBrush(QBrush(color))
-                item.shape.fill_color = (color.red(), color.green(), color.blue())
+    def _applyFills(self, items, fills):
+        """Set each item's fill to the matching packed 0xRRGGBB value."""
+        self.document.set_fills(items, fills)
+        with self.transaction():
+            for item in items:
+                self._styleItem(item)
+
+    def _styleItem(self, item):
+        """Update an item's pen and brush after its shape's colors changed."""
+        if isinstance(item, VirtualItem):
+            item.updateStyle()
+        elif isinstance(item.shape, ShapeBase):
+            style_item(item, item.shape)
 
     def rotateSelected(self, angle):
-        """Rotate selected shapes (or their group) by a given angle."""
-        rotated = set()
-        for item in self.scene.selectedItems():
-            gid = getattr(item.shape, "group_id", None)
-            if gid and gid not in rotated:
-                for obj in self.items:
-                    if getattr(obj.shape, "group_id", None) == gid:
-                        obj.setRotation(obj.rotation() + angle)
-                rotated.add(gid)
-            elif not gid:
-                item.setRotation(item.rotation() + angle)
+        """
+        Rotate selected shapes by a given angle; groups turn as a whole
+        about their centers.
+        """
+        self.rotateItemsBy(self.selectedItems(), angle)
+
+    @instrumented("rotate")
+    def rotateItemsBy(self, items, angle):
+        """Rotate the given items like rotateSelected(), as one undo step."""
+        items, pivots = self.document.units(items)
+        self.instrumentation.touched(len(items))
+        if items:
+            pivots = self._pivots(pivots)
+            self._rotateItems(items, angle, pivots)
+            self._record(Rotate(items, angle, pivots))
+
+    @staticmethod
+    def _pivots(pivots):
+        # Only groups need pivots; without any the items turn in place.
+        return pivots if any(pivot is not None for _, pivot in pivots) else None
+
+    def _rotateItems(self, items, angle, pivots=None):
+        if pivots is None:
+            self.document.rotate(items, angle)
+        else:
+            for run, pivot in pivot_runs(items, pivots):
+                self.document.rotate(run, angle, pivot)
+        with self.transaction():
+            for item in items:
+                item.setRotation(item.shape.rotation)
+                if pivots is not None:
+                    item.setPos(item.shape.pos_x, item.shape.pos_y)
 
     def scaleSelected(self):
         """Apply scaling to selected shapes (or their group)."""
@@ -215,165 +635,451 @@ class DrawingApp(QMainWindow):
         )
         if not ok:
             return
-        scaled_groups = set()
-        for item in self.scene.selectedItems():
-            gid = getattr(item.shape, "group_id", None)
-            if gid and gid not in scaled_groups:
-                for obj in self.items:
-                    if getattr(obj.shape, "group_id", None) == gid:
-                        self._applyScale(obj, factor)
-                scaled_groups.add(gid)
-            elif not gid:
-                self._applyScale(item, factor)
-
-    def _applyScale(self, item, factor):
-        """Resize the item's dimensions by a given scale factor."""
-        if isinstance(item, QGraphicsLineItem):
-            # Scale a line item
-            line = item.line()
-            center = line.pointAt(0.5)
-            new_p1 = center + (line.p1() - center) * factor
-            new_p2 = center + (line.p2() - center) * factor
-            item.setLine(new_p1.x(), new_p1.y(), new_p2.x(), new_p2.y())
-        elif isinstance(item, QGraphicsPolygonItem):
-            # Scale a polygon item
-            polygon = item.polygon()
-            center = polygon.boundingRect().center()
+        self.scaleSelectedBy(factor)
 
-            # Scale each vertex of the polygon
-            new_points = []
-            for point in polygon:
-                new_x = center.x() + (point.x() - center.x()) * factor
-                new_y = center.y() + (point.y() - center.y()) * factor
-                new_points.append(QPointF(new_x, new_y))
+    def scaleSelectedBy(self, factor):
+        """
+        Scale selected shapes by a given factor; groups scale as a whole
+        about their centers.
+        """
+        self.scaleItemsBy(self.selectedItems(), factor)
+
+    @instrumented("scale")
+    def scaleItemsBy(self, items, factor):
+        """Scale the given items like scaleSelectedBy(), as one undo step."""
+        items, pivots = self.document.units(items)
+        self.instrumentation.touched(len(items))
+        if items:
+            pivots = self._pivots(pivots)
+            self._resizeItems(items, factor, pivots)
+            self._record(Resize(items, factor, pivots))
 
-            item.setPolygon(QPolygonF(new_points))  # Set the new scaled polygon
+    def _resizeItems(self, items, factor, pivots=None):
+        if pivots is None:
+            self.document.scale(items, factor)
         else:
-            # For other shapes
-            rect = item.rect()
-            center = rect.center()
-            new_width = rect.width() * factor
-            new_height = rect.height() * factor
-            new_rect = QRectF(
-                center.x() - new_width / 2,
-                center.y() - new_height / 2,
-                new_width,
-                new_height,
-            )
-            item.setRect(new_rect)
-            item.setTransformOriginPoint(new_rect.center())
+            for run, pivot in pivot_runs(items, pivots):
+                self.document.scale(run, factor, pivot)
+        with self.transaction():
+            for item in items:
+                self._applyGeometry(item)
+                if pivots is not None:
+                    item.setPos(item.shape.pos_x, item.shape.pos_y)
+
+    @instrumented("move")
+    def moveItemsBy(self, items, dx, dy):
+        """
+        Move the given items and the rest of their groups by (dx, dy), as
+        one undo step.
+        """
+        items = self.document.expand(items)
+        self.instrumentation.touched(len(items))
+        if items and (dx or dy):
+            self._translateItems(items, dx, dy)
+            self._record(Move(items, dx, dy))
+
+    def _translateItems(self, items, dx, dy):
+        self.document.translate(items, dx, dy)
+        with self.transaction():
+            for item in items:
+                item.setPos(item.shape.pos_x, item.shape.pos_y)
+
+    def _recordMove(self, items, dx, dy):
+        """Slot for the view's itemsMoved signal."""
+        if dx or dy:
+            self._record(Move(items, dx, dy))
+
+    @instrumented("undo")
+    def undo(self):
+        """Reverse the most recent edit."""
+        command = self.history.undo()
+        if command is not None:
+            self._journalRecord(command, undo=True)
+            self.instrumentation.touched(len(command.items))
+
+    @instrumented("redo")
+    def redo(self):
+        """Re-apply the most recently undone edit."""
+        command = self.history.redo()
+        if command is not None:
+            self._journalRecord(command)
+            self.instrumentation.touched(len(command.items))
+
+    def _applyGeometry(self, item):
+        """Update the item's rect or line from its shape's geometry."""
+        shape = item.shape
+        if isinstance(item, VirtualItem):
+            item.updateGeometry()
+            return
+        if isinstance(item, QGraphicsLineItem):
+            item.setLine(shape.x, shape.y, shape.x2, shape.y2)
+        elif isinstance(item, QGraphicsPathItem):
+            item.setPath(shape_path(shape))
+        else:
+            item.setRect(shape.x, shape.y, shape.width, shape.height)
+        item.setTransformOriginPoint(item.boundingRect().center())
 
     def saveToFile(self):
-        """Save all shape data to a JSON file."""
+        """Save all shape data to a JSON, binary or NDJSON file."""
         filename, _ = QFileDialog.getSaveFileName(
-            self, "Save File", "", "JSON Files (*.json)"
+            self, "Save File", "", FILE_FILTER
         )
         if not filename:
             return
+        self.saveInBackground(filename)
+
+    @instrumented("save")
+    def saveToPath(self, filename):
+        """
+        Save all shape data to the given file (format chosen by suffix).
+
+        Saving to the document that is already open only syncs its edit
+        journal; other targets get a full snapshot and become the open
+        document.
+        """
+        journal = self.journal
+        if journal is not None and journal.document == os.path.abspath(filename):
+            journal.sync()
+            if journal.needsCompaction():
+                journal.compact()
+            return
+        self.instrumentation.touched(len(self.items))
+        write_entries(filename, self._shapeEntries(), self.store.styles.colors())
+        self._openJournal(filename)
+
+    def _openJournal(self, filename, loaded=None):
+        """
+        Make ``filename`` the open document and start journaling edits.
+
+        With ``loaded`` (the items just read from the document), a journal
+        left next to it is replayed first. Returns the number of replayed
+        records.
+        """
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = Journal(self, filename)
+        replayed = 0
+        if loaded is None:
+            self.journal.start()
+        else:
+            with self.transaction():
+                replayed = self.journal.resume(loaded)
+        self._autosave_timer.start()
+        return replayed
+
+    def _autosave(self):
+        """Sync the journal and compact it once it has grown large."""
+        if self.journal is None:
+            return
+        self.journal.sync()
+        if self._task is None and self.journal.needsCompaction():
+            self.saveInBackground(self.journal.document, snapshot=True)
+
+    def closeEvent(self, event):
+        if isinstance(self._task, QThread):
+            self._task.cancel()
+            self._task.wait()
+        elif self._task is not None:
+            self._task.cancel()
+        if self._pending_journal is not None:
+            self._pending_journal.discard()
+            self._pending_journal = None
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+            self._autosave_timer.stop()
+        super().closeEvent(event)
+
+    def saveInBackground(self, filename, snapshot=False):
+        """
+        Save on a worker thread with a progress dialog; returns the task.
+
+        Editing can go on while the save runs: the worker writes a copy of
+        the model taken when the save starts, and edits made meanwhile are
+        journaled for the new snapshot. Saving to the open document only
+        syncs its journal (and returns None) unless ``snapshot`` is set.
+        """
+        journal = self.journal
+        if (
+            not snapshot
+            and journal is not None
+            and journal.document == os.path.abspath(filename)
+        ):
+            journal.sync()
+            return None
+        if self._task is not None:
+            self.statusBar().showMessage("A save or load is still running", 3000)
+            return None
+        items = [item for item in self.items if isinstance(item.shape, ShapeBase)]
+        rows = array("q", (item.shape.index for item in items))
+        pending = journal.follower(filename) if journal else Journal(self, filename)
+        pending.begin(items)
+        self._pending_journal = pending
+        groups = self.groups
+        parents = {group_id: groups.ancestors(group_id) for group_id in groups.links()}
+        task = SaveTask(filename, self.store.copy(), rows, self, parents)
+        task.succeeded.connect(self._saveFinished)
+        task.failed.connect(lambda message: self._saveFailed("Save failed", message))
+        task.cancelled.connect(lambda: self._saveFailed())
+        self._startTask(task, "Saving drawing...")
+        return task
+
+    def _saveFinished(self, filename):
+        pending, self._pending_journal = self._pending_journal, None
+        pending.start()
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = pending
+        self._autosave_timer.start()
+        self._taskDone()
+
+    def _saveFailed(self, title=None, message=None):
+        self._pending_journal.discard()
+        self._pending_journal = None
+        self._taskDone()
+        if message is not None:
+            QMessageBox.warning(self, title, message)
+
+    def loadInBackground(self, filename):
+        """
+        Read and parse a file on a worker thread, then add its shapes to
+        the scene in chunks, with a progress dialog. Returns the task.
+        """
+        if self._task is not None:
+            self.statusBar().showMessage("A save or load is still running", 3000)
+            return None
+        task = LoadTask(filename, self)
+        self._connectLoad(
+            task, "Load failed", lambda entries: self._addLoaded(filename, entries)
+        )
+        self._startTask(task, "Loading drawing...")
+        return task
+
+    def openInBackground(self, filename):
+        """
+        Like loadInBackground(), but the shapes of the first screenful are
+        added before the rest so they show up right away. Meant for opening
+        a file into an empty window; the view starts at the top-left corner
+        of the drawing. Returns the task.
+        """
+        if self._task is not None:
+            self.statusBar().showMessage("A save or load is still running", 3000)
+            return None
+        visible = self.view.mapToScene(self.view.viewport().rect()).boundingRect()
+        task = OpenTask(filename, visible.width(), visible.height(), self)
+        self._connectLoad(
+            task, "Open failed", lambda opening: self._addOpened(filename, opening)
+        )
+        self._startTask(task, "Opening drawing...")
+        return task
+
+    def _connectLoad(self, task, title, handOver):
+        """
+        Pass a load task's result to ``handOver`` when it succeeds, or as
+        soon as it starts streaming (see LoadTask). Once it has handed over
+        to a loader, its own end signals are ignored: the loader reports
+        how the load ends.
+        """
+
+        def whileCurrent(slot):
+            return lambda *args: slot(*args) if self._task is task else None
+
+        task.streaming.connect(whileCurrent(handOver))
+        task.succeeded.connect(whileCurrent(handOver))
+        task.failed.connect(
+            whileCurrent(lambda message: self._loadFailed(title, message))
+        )
+        task.cancelled.connect(whileCurrent(lambda: self._loadFailed()))
+
+    def _addOpened(self, filename, opening):
+        """Size the scene for an opened document, then add its shapes."""
+        if opening.bounds is None:
+            self._addLoaded(filename, opening.entries)
+            return
+        x0, y0, x1, y1 = opening.bounds
+        # Fix the scene rect while the shapes stream in so the scroll
+        # position does not move as it grows.
+        self.scene.setSceneRect(
+            self.scene.sceneRect().united(QRectF(x0, y0, x1 - x0, y1 - y0))
+        )
+        visible = self.view.mapToScene(self.view.viewport().rect()).boundingRect()
+        self.view.centerOn(x0 + visible.width() / 2, y0 + visible.height() / 2)
+        loader = self._addLoaded(filename, opening.entries, opening.first)
+        if self.virtualizer is None:
+            # Let the scene rect follow the items again afterwards.
+            loader.finished.connect(lambda _added: self.scene.setSceneRect(QRectF()))
+            loader.cancelled.connect(lambda: self.scene.setSceneRect(QRectF()))
+
+    def _addLoaded(self, filename, entries, first=()):
+        """
+        Add entries parsed by a LoadTask on the GUI thread, in chunks
+        (``first`` as in EntryLoader). Returns the loader.
+        """
+        opening = self.journal is None and not len(self.items)
+        loader = EntryLoader(self, entries, self, first)
+        loader.progress.connect(self._showProgress)
+        loader.firstAdded.connect(self.firstScreenfulAdded)
+        loader.finished.connect(
+            lambda added: self._loadFinished(filename, added, opening)
+        )
+        loader.failed.connect(lambda message: self._loadFailed("Load failed", message))
+        loader.cancelled.connect(self._taskDone)
+        self._progress.canceled.disconnect()
+        self._progress.canceled.connect(loader.cancel)
+        self._progress.setLabelText("Adding shapes...")
+        self._task = loader
+        loader.start()
+        return loader
+
+    def _loadFinished(self, filename, added, opening):
+        self._finishLoad(filename, added, opening)
+        self._taskDone()
+        self.documentLoaded.emit(filename)
+
+    def _loadFailed(self, title=None, message=None):
+        self._taskDone()
+        if message is not None:
+            QMessageBox.warning(self, title, message)
+
+    def _startTask(self, task, label):
+        progress = QProgressDialog(label, "Cancel", 0, 0, self)
+        progress.setWindowModality(Qt.NonModal)
+        progress.setMinimumDuration(500)
+        progress.setAutoReset(False)
+        progress.canceled.connect(task.cancel)
+        task.progress.connect(self._showProgress)
+        task.finished.connect(lambda: self._taskFinished(task))
+        task.finished.connect(task.deleteLater)
+        self._progress = progress
+        self._task = task
+        task.start()
+
+    def _taskFinished(self, task):
+        # Its result has been handled (and a load has handed over to its
+        # EntryLoader) by now; if the task is still current, nothing did,
+        # so make sure it does not block later saves and loads.
+        if self._task is task:
+            self._taskDone()
+
+    def _showProgress(self, done, total):
+        if self._progress is not None:
+            self._progress.setMaximum(total)
+            self._progress.setValue(done)
+
+    def _taskDone(self):
+        if self._progress is not None:
+            self._progress.canceled.disconnect()
+            self._progress.close()
+            self._progress.deleteLater()
+            self._progress = None
+        self._task = None
 
-        data = []
+    def _shapeEntries(self):
+        """Yield a saved entry (JSON schema dict) for each item."""
         for item in self.items:
-            shape = item.shape
-
-            # Gather the shape's transformation and state
-            entry = {
-                "type": type(shape).__name__,
-                "x": item.pos().x(),
-                "y": item.pos().y(),
-                "rotation": item.rotation(),
-                "scale_x": item.scale(),
-                "fill_color": shape.fill_color,
-                "border_color": shape.border_color,
-                "group_id": shape.group_id if shape.group_id else None,
-            }
-
-            # Add shape-specific attributes
-            if isinstance(shape, RectangleShape):
-                entry["width"] = shape.width
-                entry["height"] = shape.height
-            elif isinstance(shape, EllipseShape):
-                entry["width"] = shape.width
-                entry["height"] = shape.height
-            elif isinstance(shape, SquareShape):
-                entry["width"] = shape.width
-            elif isinstance(shape, LineShape):
-                entry["x2"] = shape.x2
-                entry["y2"] = shape.y2
-            elif isinstance(shape, PolygonWithLines):
-                # Restore the polygon with the scaled vertices
-                polygon = item.polygon()
-                center = polygon.boundingRect().center()
-                scaled_vertices = []
-                for point in polygon:
-                    new_x = center.x() + (point.x() - center.x()) * item.scale()
-                    new_y = center.y() + (point.y() - center.y()) * item.scale()
-                    scaled_vertices.append((new_x, new_y))
-                entry["vertices"] = scaled_vertices  # Save the scaled vertices
-
-            data.append(entry)
-
-        with open(filename, "w") as f:
-            json.dump(data, f, indent=2)
+            yield self._shapeEntry(item)
+
+    def _shapeEntry(self, item):
+        """Return the saved entry (JSON schema dict) of one item."""
+        entry = self.document.entry(item)
+        if entry is not None:
+            return entry
+        shape = item.shape
+        entry = {
+            "type": type(shape).__name__,
+            "rotation": item.rotation(),
+            "scale_x": item.scale(),
+            "fill_color": shape.fill_color,
+            "border_color": shape.border_color,
+            "group_id": shape.group_id if shape.group_id else None,
+        }
+        if isinstance(shape, PolygonWithLines):
+            # Restore the polygon with the scaled vertices
+            polygon = item.polygon()
+            center = polygon.boundingRect().center()
+            scaled_vertices = []
+            for point in polygon:
+                new_x = center.x() + (point.x() - center.x()) * item.scale()
+                new_y = center.y() + (point.y() - center.y()) * item.scale()
+                scaled_vertices.append((new_x, new_y))
+            entry["vertices"] = scaled_vertices  # Save the scaled vertices
+
+        return entry
 
     def loadFromFile(self):
-        """Load shape data from a JSON file and add it to the scene."""
+        """Load shape data from a JSON or binary file and add it to the scene."""
         filename, _ = QFileDialog.getOpenFileName(
-            self, "Open File", "", "JSON Files (*.json)"
+            self, "Open File", "", FILE_FILTER
         )
         if not filename:
             return
+        if self.journal is None and not len(self.items):
+            self.openInBackground(filename)
+        else:
+            self.loadInBackground(filename)
 
-        with open(filename, "r") as f:
-            data = json.load(f)
-
-        for entry in data:
-            shape_type = entry["type"]
-            fill_color = tuple(entry["fill_color"])
-            border_color = tuple(entry["border_color"])
-
-            # Create the shape based on the type
-            shape = None
-            if shape_type == "RectangleShape":
-                shape = RectangleShape(
-                    entry["x"], entry["y"], entry["width"], entry["height"], fill_color
-                )
-            elif shape_type == "EllipseShape":
-                shape = EllipseShape(
-                    entry["x"], entry["y"], entry["width"], entry["height"], fill_color
-                )
-            elif shape_type == "PolygonShape":
-                # Restore the polygon with the scaled vertices
-                scaled_vertices = entry["vertices"]
-                shape = PolygonWithLines(scaled_vertices, fill_color)
-            elif shape_type == "SquareShape":
-                shape = SquareShape(entry["x"], entry["y"], entry["width"], fill_color)
-            elif shape_type == "LineShape":
-                shape = LineShape(
-                    entry["x"], entry["y"], entry["x2"], entry["y2"], fill_color
-                )
-
-            if shape:
-                shape.group_id = entry.get("group_id")  # Restore the group ID
-
-                # Add shape to the scene
-                self.addShape(shape)
-
-                # Set the position of the shape as per the saved data
-                shape_item = self.scene.items()[-1]
-                shape_item.setPos(entry["x"], entry["y"])
-
-                # Apply rotation and scale
-                shape_item.setRotation(entry["rotation"])
-                shape_item.setScale(entry["scale_x"])
-
-                if isinstance(shape_item, QGraphicsLineItem):
-                    # For lines, use setPen to apply the color
-                    shape_item.setPen(QPen(QColor(*border_color)))
-                    shape_item.setPen(QPen(QColor(*fill_color)))
-                else:
-                    # For other shapes, use setBrush for the fill color
-                    shape_item.setBrush(QBrush(QColor(*fill_color)))
-                    shape_item.setPen(QPen(QColor(*border_color)))
+    @instrumented("load")
+    def loadFromPath(self, filename):
+        """
+        Load shape data from the given file and add it to the scene.
+
+        Loading into an empty window opens the file as the document: edits
+        left in its journal are replayed and new edits are journaled.
+        """
+        opening = self.journal is None and not len(self.items)
+        if is_binary(filename):
+            with BinaryDocument(filename) as doc:
+                added = self._loadEntries(doc)
+        elif is_ndjson(filename):
+            added = self._loadEntries(iter_entries(filename))
+        else:
+            with open(filename, "r") as f:
+                data = json.load(f)
+            added = self._loadEntries(json_entries(data))
+        self._finishLoad(filename, added, opening)
+
+    def _finishLoad(self, filename, added, opening):
+        """Record loaded items for undo and, if opening, attach the journal."""
+        if added:
+            self._record(AddItems(added))
+        if opening and self._openJournal(filename, added):
+            # Replayed edits are not in the undo history.
+            self.history.clear()
+
+    def _loadEntries(self, entries):
+        """
+        Create items for saved shape entries and add them in one batch.
+
+        Items are built directly from each entry (no scene lookups), so
+        loading is linear in the number of entries.
+        """
+        added = []
+        with self.transaction():
+            for entry in entries:
+                item = self._itemFromEntry(entry)
+                if item is not None:
+                    added.append(item)
+        self.instrumentation.touched(len(added))
+        return added
+
+    def _itemFromEntry(self, entry):
+        """Create and add the item for one saved entry (None if unknown)."""
+        shape = self._shapeFromEntry(entry)
+        if shape is None:
+            return None
+        item = self._createItem(shape)
+        if item is not None:
+            self._addItem(item)
+            if "group_parents" in entry:
+                self.groups.link_path(shape.group_id, entry["group_parents"])
+        return item
+
+    def _shapeFromEntry(self, entry):
+        """Build the shape described by a saved entry, or None if unknown."""
+        if entry["type"] == "PolygonShape":
+            # Restore the polygon with the scaled vertices
+            return PolygonWithLines(entry["vertices"], tuple(entry["fill_color"]))
+        return shape_from_entry(entry, self.store)
 
 
 def main():
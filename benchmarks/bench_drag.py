@@ -0,0 +1,100 @@
+"""
+Measure drag frame time in DragGraphicsView on a large scene.
+
+Builds a scene of N rectangles (100k by default), groups a handful of
+them and replays a press / move / release sequence against the view,
+timing each frame: the mouse-move event and the repaint of the viewport
+it causes. Exits non-zero if the median frame is slower than
+DRAG_FRAME_BUDGET_MS. With --snap the drag snaps to the
+grid and to the other shapes' edges and centers.
+
+    python benchmarks/bench_drag.py [--items 100000] [--group-size 50] [--snap]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtCore import QEvent, QPoint, QPointF, Qt
+from PyQt5.QtGui import QMouseEvent
+from PyQt5.QtWidgets import QApplication
+
+from app import DrawingApp
+from shapes import RectangleShape
+from view import DRAG_FRAME_BUDGET_MS
+
+
+def mouse_event(kind, pos, buttons=Qt.LeftButton):
+    button = Qt.NoButton if kind == QEvent.MouseMove else Qt.LeftButton
+    return QMouseEvent(kind, QPointF(pos), button, buttons, Qt.NoModifier)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=100_000)
+    parser.add_argument("--group-size", type=int, default=50)
+    parser.add_argument("--moves", type=int, default=200)
+    parser.add_argument("--snap", action="store_true", help="snap to grid and shapes")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    window = DrawingApp()
+    window.resize(800, 600)
+    window.show()
+
+    for i in range(args.items):
+        window.addShape(RectangleShape((i % 400) * 12, (i // 400) * 12, 10, 10))
+    items = list(window.items)
+    for item in items[: args.group_size]:
+        item.setSelected(True)
+    window.groupSelected()
+    window.scene.clearSelection()
+    if args.snap:
+        window.snapGridAction.setChecked(True)
+        window.snapShapesAction.setChecked(True)
+
+    view = window.view
+    target = items[0]
+    view.centerOn(target)
+    app.processEvents()
+    start = view.mapFromScene(target.sceneBoundingRect().center())
+
+    viewport = view.viewport()
+    # The group can end a snapped drag where it started, so count the
+    # steps that moved it instead of checking where it ended up.
+    steps = []
+    view.itemsMoved.connect(lambda items, dx, dy: steps.append((dx, dy)))
+    QApplication.sendEvent(viewport, mouse_event(QEvent.MouseButtonPress, start))
+    timings = []
+    for step in range(1, args.moves + 1):
+        pos = start + QPoint(1 + step % 40, 1 + step % 25)
+        began = time.perf_counter()
+        QApplication.sendEvent(viewport, mouse_event(QEvent.MouseMove, pos))
+        # Paint the frame the move produced, so the step is a whole frame.
+        viewport.repaint()
+        timings.append((time.perf_counter() - began) * 1000)
+    QApplication.sendEvent(
+        viewport, mouse_event(QEvent.MouseButtonRelease, pos, Qt.NoButton)
+    )
+
+    if not any(dx or dy for dx, dy in steps):
+        print("group did not move", file=sys.stderr)
+        return 1
+
+    median = statistics.median(timings)
+    p95 = sorted(timings)[int(len(timings) * 0.95) - 1]
+    print(
+        f"items={args.items} group={args.group_size} moves={args.moves} "
+        f"snap={'on' if args.snap else 'off'} "
+        f"median={median:.3f}ms p95={p95:.3f}ms budget={DRAG_FRAME_BUDGET_MS}ms"
+    )
+    return 0 if median <= DRAG_FRAME_BUDGET_MS else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Stress the load/clear cycle of DrawingApp and fail if it leaks memory.
+
+Saves a synthetic drawing of N shapes (10k by default), then loads it
+into the app and clears it again, over and over. After every cycle the
+memory still traced by tracemalloc and the live shapes and graphics
+items are sampled (see memory.leak_cycles()). Exits non-zero if they keep
+growing once the first cycles have warmed the caches, or if graphics
+items are left alive outside the scene. The undo history is given no
+budget by default, because shapes it keeps for undo are not a leak.
+
+    python benchmarks/bench_memory.py [--items 10000] [--cycles 10] [--format drwb]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication
+
+from app import DrawingApp
+from document import Document
+from memory import LEAK_TOLERANCE_BYTES, leak_cycles, stray_items
+from suite import generate_shapes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=10_000)
+    parser.add_argument("--cycles", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--format", choices=("json", "drwb", "ndjson"), default="json")
+    parser.add_argument(
+        "--tolerance-kb",
+        type=int,
+        default=LEAK_TOLERANCE_BYTES // 1024,
+        help="growth of retained memory allowed over the run",
+    )
+    parser.add_argument(
+        "--history-budget",
+        type=int,
+        default=0,
+        help="undo history budget in bytes (shapes it keeps count as growth)",
+    )
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, f"drawing.{args.format}")
+        document = Document()
+        document.add_shapes(generate_shapes(args.items, 5, 0.3, 1, document.store))
+        document.save(filename)
+        del document
+
+        window = DrawingApp(history_budget=args.history_budget)
+        window.instrumentation.enabled = True
+        window.instrumentation.trace_allocations()
+
+        def cycle():
+            window.loadFromPath(filename)
+            app.processEvents()
+            window.clearAll()
+            app.processEvents()
+
+        samples, problems = leak_cycles(
+            cycle, args.cycles, args.warmup, args.tolerance_kb * 1024
+        )
+        stray = stray_items(window.history.items())
+        counters = window.instrumentation.snapshot()["counters"]
+        window.instrumentation.trace_allocations(False)
+        window.close()
+
+    for sample in samples:
+        objects = sum(sample.objects.values())
+        print(
+            f"cycle {sample.cycle}: retained={sample.retained_bytes / 2**20:.2f}MB "
+            f"objects={objects}"
+        )
+    for name in ("load", "clear_all"):
+        counter = counters.get(name)
+        if counter is not None:
+            print(
+                f"{name}: {counter['count']} runs, "
+                f"allocated={counter['allocated_bytes'] / counter['count'] / 2**20:.2f}MB/run "
+                f"peak={counter['max_peak_bytes'] / 2**20:.2f}MB"
+            )
+    if stray:
+        problems.append(f"graphics items alive outside the scene: {stray}")
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    print(
+        f"items={args.items} cycles={args.cycles} format={args.format} "
+        f"{'LEAK' if problems else 'ok'}"
+    )
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
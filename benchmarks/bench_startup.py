@@ -0,0 +1,80 @@
+"""
+Measure startup time of main.py opening a large drawing.
+
+Writes a synthetic drawing of N shapes (100k by default), then launches
+``main.py <drawing> --exit-after-open`` several times under Qt's offscreen
+platform and prints the median of each startup metric: import time, first
+paint, first screenful and fully loaded. With --budget-ms it exits non-zero
+if the median time to the first screenful is over the budget.
+
+    python benchmarks/bench_startup.py [--items 100000] [--runs 5] [--binary]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from main import STAGES
+from shapes import ShapeStore
+from storage import write_entries
+from suite import generate_shapes
+
+
+def write_drawing(filename, count):
+    store = ShapeStore()
+    shapes = list(generate_shapes(count, 10, 0.2, seed=1, store=store))
+    write_entries(filename, (store.entry(shape.index) for shape in shapes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--items", type=int, default=100_000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--binary", action="store_true", help="open a .drwb file")
+    parser.add_argument("--budget-ms", type=float, help="first screenful budget")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        drawing = os.path.join(workdir, "drawing.drwb" if args.binary else "drawing.json")
+        write_drawing(drawing, args.items)
+        metrics = os.path.join(workdir, "metrics.json")
+        runs = {stage: [] for stage in STAGES}
+        for _ in range(args.runs):
+            subprocess.run(
+                [
+                    sys.executable,
+                    os.path.join(ROOT, "main.py"),
+                    drawing,
+                    "--exit-after-open",
+                    "--metrics-json",
+                    metrics,
+                ],
+                check=True,
+                cwd=workdir,
+            )
+            with open(metrics) as f:
+                values = json.load(f)
+            for stage in STAGES:
+                if stage in values:
+                    runs[stage].append(values[stage] * 1000)
+
+    medians = {stage: statistics.median(v) for stage, v in runs.items() if v}
+    print(
+        f"items={args.items} runs={args.runs} "
+        + " ".join(f"{stage}={ms:.1f}ms" for stage, ms in medians.items())
+    )
+    if args.budget_ms is None:
+        return 0
+    return 0 if medians.get("first_screenful", 0) <= args.budget_ms else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
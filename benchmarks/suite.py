@@ -0,0 +1,324 @@
+"""
+Headless benchmark suite for the drawing app's hot paths.
+
+Generates synthetic drawings and times the main operations of DrawingApp
+and DragGraphicsView under Qt's offscreen platform: adding shapes, JSON
+and binary save/load, grouping, group rotate/scale/recolor, drag
+press/move/release sequences and clearing, and re-saving an open
+document through its edit journal. Results are written as JSON
+so runs can be compared across commits.
+
+    python benchmarks/suite.py --sizes 1000,10000 --output results.json
+    python benchmarks/suite.py --compare old.json new.json
+"""
+
+import argparse
+import functools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PyQt5.QtCore import QEvent, QPoint, Qt, PYQT_VERSION_STR, QT_VERSION_STR
+from PyQt5.QtGui import QColor
+from PyQt5.QtWidgets import QApplication
+
+from app import DrawingApp
+from bench_drag import mouse_event
+from shapes import EllipseShape, LineShape, RectangleShape, SquareShape
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+
+def generate_shapes(count, group_size, grouped_fraction, seed, store=None):
+    """
+    Yield ``count`` random shapes laid out on a grid.
+
+    Runs of ``group_size`` consecutive shapes share a group ID, for roughly
+    ``grouped_fraction`` of all shapes.
+    """
+    rng = random.Random(seed)
+    columns = max(1, int(count**0.5))
+    group_id = None
+    for i in range(count):
+        x = (i % columns) * 20.0
+        y = (i // columns) * 20.0
+        kind = i % 4
+        fill = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        if kind == 0:
+            shape = RectangleShape(x, y, 15, 10, fill, store)
+        elif kind == 1:
+            shape = EllipseShape(x, y, 15, 10, fill, store)
+        elif kind == 2:
+            shape = SquareShape(x, y, 12, fill, store)
+        else:
+            shape = LineShape(x, y, x + 15, y + 15, fill, store)
+        if group_size > 1 and i % group_size == 0:
+            grouped = rng.random() < grouped_fraction
+            group_id = i // group_size + 1 if grouped else None
+        shape.group_id = group_id if group_size > 1 else None
+        yield shape
+
+
+class Timer:
+    """Collects timings for one drawing size."""
+
+    def __init__(self, app, size):
+        self.app = app
+        self.size = size
+        self.results = []
+
+    def measure(self, operation, func, touched=None):
+        """Run ``func``, let Qt process the resulting events, record time."""
+        began = time.perf_counter()
+        func()
+        self.app.processEvents()
+        elapsed = time.perf_counter() - began
+        self.results.append(
+            {
+                "size": self.size,
+                "operation": operation,
+                "seconds": elapsed,
+                "items_touched": touched,
+            }
+        )
+        return elapsed
+
+
+def clear_selection(window):
+    for item in window.selectedItems():
+        item.setSelected(False)
+
+
+def select_group(window, group_id):
+    clear_selection(window)
+    members = window.groups.members(group_id)
+    if members:
+        members[0].setSelected(True)
+    return members
+
+
+def run_drag(window, timer, group_id, moves):
+    """Replay a press / move / release drag on one member of a group."""
+    view = window.view
+    app = timer.app
+    members = select_group(window, group_id)
+    if not members:
+        return
+    target = members[0]
+    view.centerOn(target.sceneBoundingRect().center())
+    app.processEvents()
+    start = view.mapFromScene(target.sceneBoundingRect().center())
+    viewport = view.viewport()
+
+    timer.measure(
+        "drag_press",
+        lambda: QApplication.sendEvent(
+            viewport, mouse_event(QEvent.MouseButtonPress, start)
+        ),
+        len(members),
+    )
+    timings = []
+    pos = start
+    for step in range(1, moves + 1):
+        pos = start + QPoint(1 + step % 40, 1 + step % 25)
+        began = time.perf_counter()
+        QApplication.sendEvent(viewport, mouse_event(QEvent.MouseMove, pos))
+        timings.append(time.perf_counter() - began)
+    timer.results.append(
+        {
+            "size": timer.size,
+            "operation": "drag_move",
+            "seconds": statistics.median(timings),
+            "p95_seconds": sorted(timings)[max(0, int(len(timings) * 0.95) - 1)],
+            "samples": len(timings),
+            "items_touched": len(members),
+        }
+    )
+    timer.measure(
+        "drag_release",
+        lambda: QApplication.sendEvent(
+            viewport, mouse_event(QEvent.MouseButtonRelease, pos, Qt.NoButton)
+        ),
+        len(members),
+    )
+
+
+def run_size(app, size, args, workdir):
+    """Run every benchmark against a drawing of ``size`` shapes."""
+    timer = Timer(app, size)
+    window = DrawingApp(virtualized=args.virtualized)
+    window.resize(800, 600)
+    window.instrumentation.enabled = args.instrument
+    window.show()
+    app.processEvents()
+
+    def add_all(shapes):
+        for shape in shapes:
+            window.addShape(shape)
+
+    # Only the timed call holds the generated list, so it is freed after.
+    shapes = generate_shapes(
+        size, args.group_size, args.grouped_fraction, args.seed, window.store
+    )
+    timer.measure("add_shapes", functools.partial(add_all, list(shapes)), size)
+
+    group_id = next(
+        (item.shape.group_id for item in window.items if item.shape.group_id),
+        None,
+    )
+    if group_id is not None:
+        touched = len(window.groups.members(group_id))
+        select_group(window, group_id)
+        timer.measure("rotate_group", lambda: window.rotateSelected(15), touched)
+        timer.measure("scale_group", lambda: window.scaleSelectedBy(1.1), touched)
+        timer.measure(
+            "recolor_group",
+            lambda: window.setColorSelected(QColor(200, 30, 30)),
+            touched,
+        )
+        run_drag(window, timer, group_id, args.moves)
+
+    selection = list(window.items)[: args.selection]
+    clear_selection(window)
+    for item in selection:
+        item.setSelected(True)
+    timer.measure("group_selection", window.groupSelected, len(selection))
+    timer.measure("ungroup_selection", window.ungroupSelected, len(selection))
+    clear_selection(window)
+
+    for suffix in (".json", ".drwb"):
+        path = os.path.join(workdir, f"bench-{size}{suffix}")
+        fmt = suffix.lstrip(".")
+        timer.measure(f"save_{fmt}", lambda: window.saveToPath(path), size)
+        window.newDocument()
+        timer.measure(f"load_{fmt}", lambda: window.loadFromPath(path), size)
+        # Saving the open document again only writes its edit journal.
+        window.addRectangle()
+        timer.measure(f"resave_{fmt}", lambda: window.saveToPath(path), 1)
+        # Detach the document (and its journal) before deleting it.
+        window.newDocument()
+        os.remove(path)
+
+    for item in list(window.items)[: args.selection]:
+        item.setSelected(True)
+    timer.measure("clear_selected", window.clearSelected, args.selection)
+    timer.measure("clear_all", window.clearAll, len(window.items))
+
+    counters = window.instrumentation.snapshot()["counters"]
+    window.close()
+    window.deleteLater()
+    app.processEvents()
+    return timer.results, counters
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, new_path):
+    """Print the relative change of each operation between two result files."""
+    with open(old_path) as f:
+        old = {(r["size"], r["operation"]): r["seconds"] for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    for result in new:
+        key = (result["size"], result["operation"])
+        if key not in old or not old[key]:
+            continue
+        change = (result["seconds"] - old[key]) / old[key] * 100
+        print(
+            f"{key[0]:>9} {key[1]:<20} {old[key]:10.4f}s -> "
+            f"{result['seconds']:10.4f}s  {change:+7.1f}%"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in DEFAULT_SIZES),
+        help="comma-separated drawing sizes (default: 1k,10k,100k,1M)",
+    )
+    parser.add_argument("--group-size", type=int, default=20)
+    parser.add_argument("--grouped-fraction", type=float, default=0.5)
+    parser.add_argument("--selection", type=int, default=1000)
+    parser.add_argument("--moves", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--instrument",
+        action="store_true",
+        help="enable DrawingApp instrumentation and include its counters",
+    )
+    parser.add_argument(
+        "--virtualized",
+        action="store_true",
+        help="run DrawingApp with viewport virtualization",
+    )
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    app = QApplication(sys.argv[:1])
+    results = []
+    instrumentation = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in (int(s) for s in args.sizes.split(",")):
+            size_results, counters = run_size(app, size, args, workdir)
+            results.extend(size_results)
+            if args.instrument:
+                instrumentation[size] = counters
+            print(f"finished {size} shapes", file=sys.stderr)
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "qt": QT_VERSION_STR,
+        "pyqt": PYQT_VERSION_STR,
+        "platform": platform.platform(),
+        "parameters": {
+            "group_size": args.group_size,
+            "grouped_fraction": args.grouped_fraction,
+            "selection": args.selection,
+            "moves": args.moves,
+            "seed": args.seed,
+            "virtualized": args.virtualized,
+        },
+        "results": results,
+    }
+    if args.instrument:
+        report["instrumentation"] = instrumentation
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""
+Packed polyline vertices in saved entries.
+
+A polyline entry's "points" holds the shape's float32 x, y offsets. In
+text formats (JSON, NDJSON, the journal) it is base64 of the little-endian
+values; entries read from a binary document carry an ``array("f")``
+instead, so the vertices are not encoded only to be decoded again.
+Everything that takes an entry accepts either form.
+"""
+
+import base64
+import sys
+from array import array
+
+
+def encode_points(points):
+    """Text form of packed float32 offsets (an array, buffer or text)."""
+    if isinstance(points, str):
+        return points
+    if sys.byteorder != "little":
+        points = array("f", points)
+        points.byteswap()
+    return base64.b64encode(points).decode("ascii")
+
+
+def decode_points(points):
+    """
+    The ``array("f")`` of an entry's "points": decoded from text, or the
+    array itself (other buffers are copied into one).
+    """
+    if isinstance(points, str):
+        decoded = array("f", base64.b64decode(points))
+        if sys.byteorder != "little":
+            decoded.byteswap()
+        return decoded
+    if isinstance(points, array) and points.typecode == "f":
+        return points
+    decoded = array("f")
+    decoded.frombytes(memoryview(points).cast("B"))
+    return decoded
+
+
+def points_bytes(points):
+    """Little-endian float32 bytes of an entry's "points" (either form)."""
+    if isinstance(points, str):
+        return base64.b64decode(points)
+    if sys.byteorder != "little":
+        points = array("f", points)
+        points.byteswap()
+    return memoryview(points).cast("B")
+
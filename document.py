@@ -0,0 +1,308 @@
+"""
+The drawing as a model: shapes, their stacking order and their groups.
+
+A Document needs no window and no dialogs, so scripts, batch jobs and
+tests can build, edit, save and load drawings with it directly. Every
+edit takes its arguments explicitly and works on a whole batch of shapes
+at once through the columnar ShapeStore:
+
+    doc = Document()
+    shapes = doc.add_shapes(
+        RectangleShape(x, 0, 8, 8, store=doc.store) for x in range(0, 80000, 10)
+    )
+    doc.rotate(shapes, 45)
+    doc.recolor(shapes[::2], (255, 0, 0))
+    doc.group(shapes[:10])
+    doc.group(shapes[:20])  # nests the first group in a new one
+    doc.rotate_units(shapes[:1], 90)  # the whole outer group, about its center
+    doc.save("drawing.drwb")
+
+The members of a document are objects with a ``shape`` attribute. In a
+headless document they are the shapes themselves (a shape's ``shape`` is
+the shape); DrawingApp keeps a Document whose members are its graphics
+items, sends every edit through it and then brings the items up to date.
+"""
+
+import json
+
+from codec import decode_points
+from registry import GroupRegistry, ItemRegistry
+from shapes import (
+    EllipseShape,
+    LineShape,
+    NO_GROUP,
+    PolylineShape,
+    RectangleShape,
+    ShapeBase,
+    ShapeStore,
+    SquareShape,
+)
+from storage import (
+    BinaryDocument,
+    is_binary,
+    is_ndjson,
+    iter_entries,
+    json_entries,
+    write_entries,
+)
+
+
+def shape_from_entry(entry, store):
+    """
+    Build the model-backed shape of a saved entry in ``store``, or return
+    None if the entry is not one (unknown types, and polygons, which are
+    graphics items only).
+    """
+    shape_type = entry["type"]
+    fill_color = tuple(entry["fill_color"])
+    x, y = entry["x"], entry["y"]
+    if shape_type == "RectangleShape":
+        shape = RectangleShape(x, y, entry["width"], entry["height"], fill_color, store)
+    elif shape_type == "EllipseShape":
+        shape = EllipseShape(x, y, entry["width"], entry["height"], fill_color, store)
+    elif shape_type == "SquareShape":
+        shape = SquareShape(x, y, entry["width"], fill_color, store)
+    elif shape_type == "LineShape":
+        shape = LineShape(x, y, entry["x2"], entry["y2"], fill_color, store)
+    elif shape_type == "PolylineShape":
+        shape = PolylineShape.packed(
+            x,
+            y,
+            entry["width"],
+            entry["height"],
+            decode_points(entry["points"]),
+            fill_color,
+            store,
+        )
+    else:
+        return None
+    shape.style = store.styles.for_colors(entry["fill_color"], entry["border_color"])
+    shape.group_id = entry.get("group_id")
+    store.set_transform(shape.index, 0.0, 0.0, entry["rotation"], entry["scale_x"])
+    return shape
+
+
+def _indices(items):
+    return [item.shape.index for item in items]
+
+
+def pivot_runs(items, pivots):
+    """(items, pivot) for each (count, pivot) run over ``items``."""
+    start = 0
+    for count, pivot in pivots:
+        yield items[start : start + count], pivot
+        start += count
+
+
+class Document:
+    """
+    Shapes in stacking order, their groups and the store holding their data.
+
+    ``items`` is the ordered registry of members (first is bottom-most) and
+    ``groups`` the group registry; both are shared with the app when a
+    DrawingApp shows the document.
+    """
+
+    def __init__(self, store=None):
+        self.store = ShapeStore() if store is None else store
+        self.items = ItemRegistry()
+        self.groups = GroupRegistry()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def add(self, item):
+        """Put a member (whose row is in this store) on top of the drawing."""
+        self.items.add(item)
+        if item.shape.group_id is not None:
+            self.groups.add(item, item.shape.group_id)
+
+    def add_shapes(self, shapes):
+        """
+        Add shapes on top of the drawing in one batch and return them as a
+        list. Shapes whose rows are in another store (such as the default
+        one) are moved into this document's store a column at a time.
+        """
+        shapes = list(shapes)
+        self.store.adopt_many(shapes)
+        for shape in shapes:
+            self.add(shape)
+        return shapes
+
+    def add_entries(self, entries):
+        """Add the shapes of saved entries; entries of other types are skipped."""
+        store = self.store
+        added = []
+        for entry in entries:
+            shape = shape_from_entry(entry, store)
+            if shape is not None:
+                self.add(shape)
+                self.groups.link_path(shape.group_id, entry.get("group_parents"))
+                added.append(shape)
+        return added
+
+    def discard(self, items):
+        """Take members out of the drawing and their groups, keeping their rows."""
+        for item in items:
+            self.items.discard(item)
+            self.groups.discard(item)
+
+    def remove(self, items):
+        """Take members out of the drawing and free their rows."""
+        items = list(items)
+        self.discard(items)
+        for item in items:
+            shape = item.shape
+            if isinstance(shape, ShapeBase):
+                shape.store.release(shape.index)
+
+    def bring_to_front(self, item):
+        """Move a member to the top of the stacking order."""
+        self.items.discard(item)
+        self.items.add(item)
+
+    def clear(self):
+        """Remove every shape and group."""
+        self.items.clear()
+        self.groups.clear()
+        self.store.clear()
+
+    def translate(self, items, dx, dy):
+        """Move members by (dx, dy)."""
+        self.store.translate(_indices(items), dx, dy)
+        self.groups.invalidate(items)
+
+    def rotate(self, items, angle, pivot=None):
+        """
+        Rotate members by ``angle`` degrees, each about its own center, or
+        together about ``pivot`` (x, y) if given.
+        """
+        self.store.rotate(_indices(items), angle, pivot)
+        self.groups.invalidate(items)
+
+    def scale(self, items, factor, pivot=None):
+        """
+        Resize members' geometry by ``factor``, each about its own center,
+        or together about ``pivot`` (x, y) if given.
+        """
+        self.store.resize(_indices(items), factor, pivot)
+        self.groups.invalidate(items)
+
+    def units(self, items):
+        """
+        Members expanded to whole top-level groups, and the (count, pivot)
+        runs that transform as one (see GroupRegistry.units()).
+        """
+        return self.groups.units(items)
+
+    def rotate_units(self, items, angle):
+        """
+        Rotate members by ``angle`` degrees: ungrouped ones about their own
+        centers, each top-level group they touch as a whole about its
+        center. Returns (items, pivots) as units() does.
+        """
+        items, pivots = self.units(items)
+        for run, pivot in pivot_runs(items, pivots):
+            self.rotate(run, angle, pivot)
+        return items, pivots
+
+    def scale_units(self, items, factor):
+        """Scale members like rotate_units() rotates them."""
+        items, pivots = self.units(items)
+        for run, pivot in pivot_runs(items, pivots):
+            self.scale(run, factor, pivot)
+        return items, pivots
+
+    def recolor(self, items, color):
+        """Set members' fill to an (r, g, b) color."""
+        self.store.set_fill(_indices(items), color)
+
+    def fills(self, items):
+        """Members' fills as packed 0xRRGGBB values."""
+        return self.store.fills(_indices(items))
+
+    def set_fills(self, items, fills):
+        """Set each member's fill to the matching packed 0xRRGGBB value."""
+        self.store.set_fills(_indices(items), fills)
+
+    def group(self, items):
+        """
+        Put members into a new group and return its ID (None if nothing
+        changed). Members that are already grouped bring their top-level
+        group along, nested in the new one.
+        """
+        return self.groups.create(items)
+
+    def ungroup(self, items):
+        """Dissolve the top-level groups of the members by one level."""
+        self.groups.ungroup(items)
+
+    def assign_groups(self, items, group_ids, links=()):
+        """
+        Put each member into the group with the matching ID (NO_GROUP for
+        none), then set the parent of each (group ID, parent ID) in
+        ``links`` (a parent of NO_GROUP makes the group top-level).
+        """
+        for item, group_id in zip(items, group_ids):
+            self.groups.set_group(item, None if group_id == NO_GROUP else group_id)
+        for group_id, parent_id in links:
+            self.groups.set_parent(group_id, None if parent_id == NO_GROUP else parent_id)
+
+    def group_bounds(self, group_id):
+        """Cached scene bounding box (x0, y0, x1, y1) of a group, or None."""
+        return self.groups.bounds(group_id)
+
+    def group_at(self, x, y):
+        """The top-level group whose bounding box holds scene point (x, y)."""
+        return self.groups.group_at(x, y)
+
+    def expand(self, items):
+        """Members plus every member of the groups they belong to."""
+        return self.groups.expand(items)
+
+    def entry(self, item):
+        """Saved entry (JSON schema dict) of a model-backed member, else None."""
+        shape = item.shape
+        if not isinstance(shape, ShapeBase):
+            return None
+        entry = shape.store.entry(shape.index)
+        group_id = entry["group_id"]
+        if group_id is not None:
+            parents = self.groups.ancestors(group_id)
+            if parents:
+                entry["group_parents"] = parents
+        return entry
+
+    def entries(self):
+        """Yield the saved entry of each model-backed member, bottom first."""
+        for item in self.items:
+            entry = self.entry(item)
+            if entry is not None:
+                yield entry
+
+    def save(self, filename):
+        """Write the drawing to a JSON, binary or NDJSON file (chosen by suffix)."""
+        write_entries(filename, self.entries(), self.store.styles.colors())
+
+    def load(self, filename):
+        """Add the shapes of a JSON, binary or NDJSON file on top; returns them."""
+        if is_binary(filename):
+            with BinaryDocument(filename) as doc:
+                return self.add_entries(doc)
+        if is_ndjson(filename):
+            return self.add_entries(iter_entries(filename))
+        with open(filename, "r") as f:
+            return self.add_entries(json_entries(json.load(f)))
+
+    @classmethod
+    def open(cls, filename):
+        """A new document holding the shapes of a file."""
+        document = cls()
+        document.load(filename)
+        return document
@@ -0,0 +1,210 @@
+"""
+Freehand strokes: capture, simplification and drawing of polylines.
+
+A stroke's vertices are kept packed in an ``array("f")`` of interleaved
+x, y values. While the user draws, a StrokeRecorder simplifies the points
+with the Ramer-Douglas-Peucker algorithm; the tolerance is given in
+device pixels and converted to scene units at the current zoom, so a
+stroke drawn zoomed out keeps fewer vertices than one drawn zoomed in. Only
+the most recent points are simplified on each step, so capture cost stays
+flat however long the stroke gets.
+
+Polylines are drawn as one path (or polyline) built straight from the
+packed vertices rather than from per-point Python objects. The stroke being
+drawn is previewed with a path that is extended point by point; only its
+unsimplified tail is redrawn when part of it is simplified.
+"""
+
+from array import array
+
+from PyQt5.QtGui import QPainterPath, QPolygonF
+
+from shapes import numpy
+
+# Largest distance, in device pixels, a dropped point may be from the
+# simplified stroke.
+SIMPLIFY_PIXELS = 0.5
+
+# Recent points kept unsimplified while drawing; once there are more they
+# are simplified and all but the last kept point become final.
+TAIL_POINTS = 128
+
+# Color of new strokes.
+STROKE_COLOR = (0, 0, 0)
+
+
+def simplify(coords, tolerance):
+    """
+    Ramer-Douglas-Peucker simplification of interleaved x, y values.
+
+    Returns an ``array("f")`` holding the kept points (always including the
+    first and the last one).
+    """
+    count = len(coords) // 2
+    if count <= 2:
+        return array("f", coords)
+    if numpy is not None:
+        points = numpy.asarray(coords, dtype=numpy.float64).reshape(count, 2)
+        keep = _kept_numpy(points, tolerance)
+        return array("f", points[keep].astype(numpy.float32).tobytes())
+    keep = _kept(coords, count, tolerance)
+    kept = array("f")
+    for i in range(count):
+        if keep[i]:
+            kept.append(coords[2 * i])
+            kept.append(coords[2 * i + 1])
+    return kept
+
+
+def _kept_numpy(points, tolerance):
+    keep = numpy.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = points[first], points[last]
+        inner = points[first + 1 : last]
+        dx, dy = end - start
+        length = dx * dx + dy * dy
+        if length == 0:
+            distances = numpy.hypot(*(inner - start).T)
+        else:
+            # Distance to the segment (not the infinite line), so strokes
+            # that double back are not flattened.
+            t = numpy.clip(((inner - start) @ (dx, dy)) / length, 0.0, 1.0)
+            nearest = start + t[:, None] * (dx, dy)
+            distances = numpy.hypot(*(inner - nearest).T)
+        farthest = int(distances.argmax())
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+def _kept(coords, count, tolerance):
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        x0, y0 = coords[2 * first], coords[2 * first + 1]
+        dx, dy = coords[2 * last] - x0, coords[2 * last + 1] - y0
+        length = dx * dx + dy * dy
+        farthest, worst = -1, tolerance * tolerance
+        for i in range(first + 1, last):
+            px, py = coords[2 * i] - x0, coords[2 * i + 1] - y0
+            if length:
+                t = min(max((px * dx + py * dy) / length, 0.0), 1.0)
+                px -= t * dx
+                py -= t * dy
+            distance = px * px + py * py
+            if distance > worst:
+                farthest, worst = i, distance
+        if farthest >= 0:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return keep
+
+
+class StrokeRecorder:
+    """Collects the points of a stroke being drawn, simplifying as it goes."""
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self._final = array("f")
+        self._tail = array("f")
+
+    def add(self, x, y):
+        """
+        Append a point (scene coordinates). Returns False if it repeats the
+        last point and was dropped.
+        """
+        tail = self._tail
+        if len(tail) >= 2 and tail[-2] == x and tail[-1] == y:
+            return False
+        tail.append(x)
+        tail.append(y)
+        if len(tail) > 2 * TAIL_POINTS:
+            kept = simplify(tail, self.tolerance)
+            # The last kept point stays in the tail, so the next segment
+            # is simplified from it.
+            self._final.extend(kept[:-2])
+            self._tail = kept[-2:]
+        return True
+
+    @property
+    def final(self):
+        """Points that simplification will no longer change."""
+        return self._final
+
+    @property
+    def tail(self):
+        """The recent points, not simplified yet; they follow ``final``."""
+        return self._tail
+
+    def points(self):
+        """The stroke so far: its final points followed by the recent ones."""
+        return self._final + self._tail
+
+    def finish(self):
+        """Simplify the remaining points and return the whole stroke."""
+        return self._final + simplify(self._tail, self.tolerance)
+
+
+def polyline_polygon(x, y, offsets):
+    """
+    QPolygonF of a polyline whose packed ``offsets`` are relative to
+    (x, y). The points are written straight into the polygon's memory.
+    """
+    count = len(offsets) // 2
+    if numpy is not None:
+        values = numpy.frombuffer(offsets, dtype=numpy.float32).astype(numpy.float64)
+        values[0::2] += x
+        values[1::2] += y
+    else:
+        values = array("d", offsets)
+        for i in range(0, len(values), 2):
+            values[i] += x
+            values[i + 1] += y
+    # A QPointF is two native doubles.
+    data = values.tobytes()
+    polygon = QPolygonF(count)
+    if count:
+        pointer = polygon.data()
+        pointer.setsize(len(data))
+        memoryview(pointer)[:] = data
+    return polygon
+
+
+def polyline_path(x, y, offsets):
+    """Open QPainterPath through the points of a polyline (see above)."""
+    path = QPainterPath()
+    path.addPolygon(polyline_polygon(x, y, offsets))
+    return path
+
+
+def extend_path(path, coords):
+    """
+    Append interleaved x, y values to ``path`` with lineTo() (starting it
+    with moveTo() if it is empty), so a growing stroke is not rebuilt.
+    """
+    start = 0
+    if not path.elementCount() and coords:
+        path.moveTo(coords[0], coords[1])
+        start = 2
+    line_to = path.lineTo
+    for i in range(start, len(coords), 2):
+        line_to(coords[i], coords[i + 1])
+    return path
+
+
+def shape_path(shape):
+    """Path of a PolylineShape, in its local (unpositioned) frame."""
+    return polyline_path(shape.x, shape.y, shape.points)
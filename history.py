@@ -0,0 +1,324 @@
+"""
+Undo/redo history for the drawing app.
+
+Every edit is recorded as a small command that holds only what is needed
+to reverse it: the affected items plus a delta (an angle and the group
+centers it turned about, a scale factor, a drag offset, or the previous
+fill colors / group IDs and parents packed into typed arrays). Removed
+shapes keep their graphics item and have their model row moved into a
+private ShapeStore so they can be put back unchanged.
+
+The mouse-move steps of one drag are merged into a single entry. The
+history has a memory budget; when the estimated size of the recorded
+commands exceeds it, the oldest entries are dropped first.
+
+Commands are applied through a small set of DrawingApp primitives
+(``_detachItems``, ``_attachItems``, ``_assignGroups``, ``_applyFills``,
+``_rotateItems``, ``_resizeItems`` and ``_translateItems``), which do not
+record history themselves.
+"""
+
+from abc import ABC, abstractmethod
+from array import array
+from collections import deque
+from itertools import repeat
+
+from shapes import NO_GROUP, ShapeStore
+
+# Default memory budget for the recorded history, in bytes.
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+
+# Rough costs used by the size estimates: a command object, a reference to
+# an item, and a removed item kept alive for undo (its graphics item, the
+# Python wrappers and its archived model row).
+COMMAND_BYTES = 200
+ITEM_REF_BYTES = 8
+RETAINED_ITEM_BYTES = 512
+# One (count, pivot) run of a group rotation or scaling.
+PIVOT_BYTES = 120
+
+
+class Command(ABC):
+    """One undoable edit on a list of items."""
+
+    label = ""
+
+    def __init__(self, items):
+        self.items = items
+
+    @abstractmethod
+    def undo(self, app):
+        """Reverse the edit."""
+
+    @abstractmethod
+    def redo(self, app):
+        """Apply the edit again."""
+
+    def merge(self, other):
+        """Fold a following command into this one; return True if merged."""
+        return False
+
+    def nbytes(self):
+        """Estimated memory held by this command."""
+        return COMMAND_BYTES + ITEM_REF_BYTES * len(self.items)
+
+
+class _ItemsPresence(Command):
+    """Base for commands that add or remove whole items."""
+
+    def __init__(self, items, archive=None):
+        super().__init__(items)
+        # Holds the removed shapes' rows while the items are out of the scene.
+        self.archive = archive
+
+    def _remove(self, app):
+        self.archive = ShapeStore()
+        app._detachItems(self.items, self.archive)
+
+    def _restore(self, app):
+        app._attachItems(self.items)
+        self.archive = None
+
+    def nbytes(self):
+        size = super().nbytes()
+        if self.archive is not None:
+            size += RETAINED_ITEM_BYTES * len(self.items)
+        return size
+
+
+class AddItems(_ItemsPresence):
+    label = "Add"
+
+    def undo(self, app):
+        self._remove(app)
+
+    def redo(self, app):
+        self._restore(app)
+
+
+class RemoveItems(_ItemsPresence):
+    label = "Remove"
+
+    def undo(self, app):
+        self._restore(app)
+
+    def redo(self, app):
+        self._remove(app)
+
+
+class SetGroups(Command):
+    """
+    Group or ungroup: previous group IDs per item, one new ID for all, and
+    the groups that were nested or un-nested, as (group ID, old parent,
+    new parent) triples.
+    """
+
+    label = "Group"
+
+    def __init__(self, items, old_ids, new_id, links=()):
+        super().__init__(items)
+        self.old_ids = array("q", (NO_GROUP if g is None else g for g in old_ids))
+        self.new_id = NO_GROUP if new_id is None else new_id
+        self.links = array(
+            "q",
+            (NO_GROUP if g is None else g for link in links for g in link),
+        )
+
+    def parents(self, undo=False):
+        """(group ID, parent ID) of each relinked group after redo (or undo)."""
+        links = self.links
+        column = 1 if undo else 2
+        return [(links[i], links[i + column]) for i in range(0, len(links), 3)]
+
+    def undo(self, app):
+        app._assignGroups(self.items, self.old_ids, self.parents(undo=True))
+
+    def redo(self, app):
+        app._assignGroups(
+            self.items, repeat(self.new_id, len(self.items)), self.parents()
+        )
+
+    def nbytes(self):
+        size = super().nbytes() + self.old_ids.itemsize * len(self.old_ids)
+        return size + self.links.itemsize * len(self.links)
+
+
+class SetFill(Command):
+    """Recolor: previous packed fill per item, one new fill for all."""
+
+    label = "Color"
+
+    def __init__(self, items, old_fills, new_fill):
+        super().__init__(items)
+        self.old_fills = array("I", old_fills)
+        self.new_fill = new_fill
+
+    def undo(self, app):
+        app._applyFills(self.items, self.old_fills)
+
+    def redo(self, app):
+        app._applyFills(self.items, repeat(self.new_fill, len(self.items)))
+
+    def nbytes(self):
+        return super().nbytes() + self.old_fills.itemsize * len(self.old_fills)
+
+
+class Rotate(Command):
+    """
+    Rotate by an angle. ``pivots`` holds (count, pivot) runs over the items
+    when groups turned about their centers (see GroupRegistry.units()).
+    """
+
+    label = "Rotate"
+
+    def __init__(self, items, angle, pivots=None):
+        super().__init__(items)
+        self.angle = angle
+        self.pivots = pivots
+
+    def undo(self, app):
+        app._rotateItems(self.items, -self.angle, self.pivots)
+
+    def redo(self, app):
+        app._rotateItems(self.items, self.angle, self.pivots)
+
+    def nbytes(self):
+        return super().nbytes() + PIVOT_BYTES * len(self.pivots or ())
+
+
+class Resize(Command):
+    """Scale by a factor, about pivots like Rotate."""
+
+    label = "Scale"
+
+    def __init__(self, items, factor, pivots=None):
+        super().__init__(items)
+        self.factor = factor
+        self.pivots = pivots
+
+    def undo(self, app):
+        app._resizeItems(self.items, 1 / self.factor, self.pivots)
+
+    def redo(self, app):
+        app._resizeItems(self.items, self.factor, self.pivots)
+
+    def nbytes(self):
+        return super().nbytes() + PIVOT_BYTES * len(self.pivots or ())
+
+
+class Move(Command):
+    """
+    Move by an offset.
+
+    Steps reported for the same list of items (one drag) merge into a
+    single entry holding the total offset.
+    """
+
+    label = "Move"
+
+    def __init__(self, items, dx, dy):
+        super().__init__(items)
+        self.dx = dx
+        self.dy = dy
+
+    def undo(self, app):
+        app._translateItems(self.items, -self.dx, -self.dy)
+
+    def redo(self, app):
+        app._translateItems(self.items, self.dx, self.dy)
+
+    def merge(self, other):
+        if type(other) is not Move or other.items is not self.items:
+            return False
+        self.dx += other.dx
+        self.dy += other.dy
+        return True
+
+
+class History:
+    """Undo and redo stacks of commands with a memory budget."""
+
+    def __init__(self, app, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.app = app
+        self.memory_budget = memory_budget
+        self._undo = deque()
+        self._redo = []
+        self._nbytes = 0
+
+    def __len__(self):
+        return len(self._undo) + len(self._redo)
+
+    @property
+    def nbytes(self):
+        """Estimated memory held by all recorded commands."""
+        return self._nbytes
+
+    def canUndo(self):
+        return bool(self._undo)
+
+    def canRedo(self):
+        return bool(self._redo)
+
+    def fits(self, nbytes):
+        """Whether a command of ``nbytes`` can be kept within the budget."""
+        return nbytes <= self.memory_budget
+
+    def push(self, command):
+        """Record a command that has already been applied."""
+        for dropped in self._redo:
+            self._nbytes -= dropped.nbytes()
+        self._redo.clear()
+        if self._undo:
+            top = self._undo[-1]
+            before = top.nbytes()
+            if top.merge(command):
+                self._nbytes += top.nbytes() - before
+                return
+        self._undo.append(command)
+        self._nbytes += command.nbytes()
+        self._trim()
+
+    def undo(self):
+        """Reverse the latest command; return it, or None if there is none."""
+        if not self._undo:
+            return None
+        command = self._undo.pop()
+        self._nbytes -= command.nbytes()
+        command.undo(self.app)
+        self._redo.append(command)
+        self._nbytes += command.nbytes()
+        self._trim()
+        return command
+
+    def redo(self):
+        """Re-apply the latest undone command; return it, or None."""
+        if not self._redo:
+            return None
+        command = self._redo.pop()
+        self._nbytes -= command.nbytes()
+        command.redo(self.app)
+        self._undo.append(command)
+        self._nbytes += command.nbytes()
+        self._trim()
+        return command
+
+    def items(self):
+        """Yield the items referenced by recorded commands (with repeats)."""
+        for command in self._undo:
+            yield from command.items
+        for command in self._redo:
+            yield from command.items
+
+    def clear(self):
+        """Forget every recorded command."""
+        self._undo.clear()
+        self._redo.clear()
+        self._nbytes = 0
+
+    def _trim(self):
+        """Drop the oldest history until the estimate fits the budget."""
+        while self._nbytes > self.memory_budget and self._undo:
+            self._nbytes -= self._undo.popleft().nbytes()
+        # The redo entry furthest from the present goes next.
+        while self._nbytes > self.memory_budget and self._redo:
+            self._nbytes -= self._redo.pop(0).nbytes()
@@ -0,0 +1,340 @@
+"""
+Append-only edit journal kept next to a document.
+
+While a document is open, every edit (add, remove, move, rotate, scale,
+recolor, group) is appended to ``<document>.journal`` as one small JSON
+line. The document on disk plus its journal is the current drawing, so
+saving only has to flush the journal, and the cost is proportional to the
+edits made rather than to the size of the document. Writes are fsynced in
+batches.
+
+When a document is opened, a journal left behind by an earlier session
+(for example after a crash) is replayed onto it. Once the journal grows
+large relative to the document it is compacted: the document is rewritten
+as a full snapshot and the journal starts over.
+
+Shapes are referred to by journal IDs: shapes of the snapshot are numbered
+in document order and new shapes take the next free number, stored on the
+item (as ``journal_id``, or ``journal_id_next`` for the journal of a
+snapshot that is still being written while the previous journal keeps
+recording). The first line of a journal names the snapshot it
+belongs to (its size and modification time), so a journal whose edits were
+already folded into the document is ignored.
+
+Records are produced from the same commands as the undo history; replay
+goes through the DrawingApp primitives the commands use.
+"""
+
+import io
+import json
+import os
+
+from history import AddItems, Move, RemoveItems, Resize, Rotate, SetFill, SetGroups
+from shapes import NO_GROUP
+from storage import write_entries
+
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_VERSION = 1
+
+# Records written between fsyncs (the app also syncs on a timer).
+SYNC_BATCH = 256
+
+# Compact once the journal is larger than this and than COMPACT_RATIO
+# times the document.
+COMPACT_MIN_BYTES = 1 << 20
+COMPACT_RATIO = 0.5
+
+# Item attributes holding journal IDs; consecutive journals alternate.
+ID_ATTRIBUTES = ("journal_id", "journal_id_next")
+
+
+def journal_path(document):
+    """Path of the journal that belongs to a document."""
+    return document + JOURNAL_SUFFIX
+
+
+def _transform(op, ids, value, pivots):
+    # Pivot runs are written as [count, [x, y] or null] pairs.
+    record = [op, ids, value]
+    if pivots is not None:
+        record.append([[count, None if p is None else list(p)] for count, p in pivots])
+    return record
+
+
+def _pivots(record):
+    if len(record) < 4:
+        return None
+    return [(count, None if p is None else tuple(p)) for count, p in record[3]]
+
+
+def _snapshot_stamp(document):
+    stat = os.stat(document)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _group_value(group_id):
+    return None if group_id == NO_GROUP else group_id
+
+
+class Journal:
+    """The edit journal of one document."""
+
+    def __init__(self, app, document, attribute=ID_ATTRIBUTES[0]):
+        self.app = app
+        self.document = os.path.abspath(document)
+        self.path = journal_path(self.document)
+        self.attribute = attribute
+        self._file = None
+        self._next_id = 0
+        self._unsynced = 0
+        self._pending_move = None
+
+    def follower(self, document):
+        """A new journal for ``document`` that can run alongside this one."""
+        other = ID_ATTRIBUTES[self.attribute == ID_ATTRIBUTES[0]]
+        return Journal(self.app, document, other)
+
+    def begin(self, items):
+        """
+        Number the items of a snapshot that is still being written and
+        keep records in memory until start() is called.
+        """
+        self._number(items)
+        self._file = io.StringIO()
+
+    def isBuffering(self):
+        return isinstance(self._file, io.StringIO)
+
+    def start(self):
+        """
+        Begin the journal of the snapshot now on disk.
+
+        After begin(), the records buffered since then are written out;
+        otherwise the app's current items are numbered and the journal
+        starts empty.
+        """
+        if self.isBuffering():
+            self._flushMove()
+            buffered = self._file.getvalue()
+        else:
+            self._number(self.app.items)
+            buffered = ""
+        header = {"journal": JOURNAL_VERSION, "snapshot": _snapshot_stamp(self.document)}
+        temp = self.path + ".tmp"
+        with open(temp, "w") as f:
+            f.write(json.dumps(header) + "\n")
+            f.write(buffered)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.path)
+        self._file = open(self.path, "a")
+        self._unsynced = 0
+
+    def resume(self, items):
+        """
+        Number the document's freshly loaded items, replay the journal
+        found next to it, and keep appending to it.
+
+        Returns the number of records replayed. A missing or stale journal
+        is replaced by an empty one.
+        """
+        by_id = self._number(items)
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            self.start()
+            return 0
+        with f:
+            try:
+                header = json.loads(f.readline())
+            except ValueError:
+                header = None
+            if (
+                not isinstance(header, dict)
+                or header.get("journal") != JOURNAL_VERSION
+                or header.get("snapshot") != _snapshot_stamp(self.document)
+            ):
+                f.close()
+                self.start()
+                return 0
+            end = f.tell()
+            count = 0
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last write: everything after it is dropped.
+                    break
+                self._apply(record, by_id)
+                end += len(line)
+                count += 1
+        self._file = open(self.path, "a")
+        self._file.truncate(end)
+        return count
+
+    def _number(self, items):
+        by_id = {}
+        attribute = self.attribute
+        for journal_id, item in enumerate(items):
+            setattr(item, attribute, journal_id)
+            by_id[journal_id] = item
+        self._next_id = len(by_id)
+        return by_id
+
+    def _apply(self, record, by_id):
+        app = self.app
+        op = record[0]
+        if op == "add":
+            for entry in record[1]:
+                item = app._itemFromEntry(entry)
+                if item is None:
+                    continue
+                journal_id = entry["id"]
+                setattr(item, self.attribute, journal_id)
+                by_id[journal_id] = item
+                self._next_id = max(self._next_id, journal_id + 1)
+            return
+        items = [by_id[journal_id] for journal_id in record[1]]
+        if op == "remove":
+            app._detachItems(items)
+            for journal_id in record[1]:
+                del by_id[journal_id]
+        elif op == "move":
+            app._translateItems(items, record[2], record[3])
+        elif op == "rotate":
+            app._rotateItems(items, record[2], _pivots(record))
+        elif op == "scale":
+            app._resizeItems(items, record[2], _pivots(record))
+        elif op == "fill":
+            fills = record[2]
+            if not isinstance(fills, list):
+                fills = [fills] * len(items)
+            app._applyFills(items, fills)
+        elif op == "group":
+            group_ids = record[2]
+            if not isinstance(group_ids, list):
+                group_ids = [group_ids] * len(items)
+            links = record[3] if len(record) > 3 else ()
+            app._assignGroups(
+                items,
+                [NO_GROUP if g is None else g for g in group_ids],
+                [(g, NO_GROUP if p is None else p) for g, p in links],
+            )
+        else:
+            raise ValueError(f"unknown journal record {op!r}")
+
+    def record(self, command, undo=False):
+        """Append the effect of an applied (or, with ``undo``, undone) command."""
+        if self._file is None:
+            return
+        if isinstance(command, Move):
+            sign = -1 if undo else 1
+            pending = self._pending_move
+            if pending is not None and pending[0] is command.items:
+                # Steps of one drag are written as a single record.
+                pending[1] += sign * command.dx
+                pending[2] += sign * command.dy
+            else:
+                self._flushMove()
+                self._pending_move = [command.items, sign * command.dx, sign * command.dy]
+            return
+        self._flushMove()
+        items = command.items
+        if isinstance(command, (AddItems, RemoveItems)):
+            if isinstance(command, AddItems) != undo:
+                self._write(["add", self._entries(items)])
+            else:
+                self._write(["remove", self._ids(items)])
+        elif isinstance(command, SetGroups):
+            if undo:
+                value = [_group_value(g) for g in command.old_ids]
+            else:
+                value = _group_value(command.new_id)
+            record = ["group", self._ids(items), value]
+            links = command.parents(undo)
+            if links:
+                record.append([[g, _group_value(p)] for g, p in links])
+            self._write(record)
+        elif isinstance(command, SetFill):
+            value = list(command.old_fills) if undo else command.new_fill
+            self._write(["fill", self._ids(items), value])
+        elif isinstance(command, Rotate):
+            angle = -command.angle if undo else command.angle
+            self._write(_transform("rotate", self._ids(items), angle, command.pivots))
+        elif isinstance(command, Resize):
+            factor = 1 / command.factor if undo else command.factor
+            self._write(_transform("scale", self._ids(items), factor, command.pivots))
+
+    def _entries(self, items):
+        entries = []
+        for item in items:
+            setattr(item, self.attribute, self._next_id)
+            entry = self.app._shapeEntry(item)
+            entry["id"] = self._next_id
+            entries.append(entry)
+            self._next_id += 1
+        return entries
+
+    def _ids(self, items):
+        attribute = self.attribute
+        return [getattr(item, attribute) for item in items]
+
+    def _flushMove(self):
+        pending, self._pending_move = self._pending_move, None
+        if pending is not None and (pending[1] or pending[2]):
+            self._write(["move", self._ids(pending[0]), pending[1], pending[2]])
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._unsynced += 1
+        if self._unsynced >= SYNC_BATCH:
+            self.sync()
+
+    def sync(self):
+        """Write out pending records and fsync the journal."""
+        if self._file is None:
+            return
+        self._flushMove()
+        if self._unsynced and not self.isBuffering():
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def size(self):
+        """Bytes written to the journal so far."""
+        return self._file.tell() if self._file is not None else 0
+
+    def needsCompaction(self):
+        if self.isBuffering():
+            return False
+        size = self.size()
+        if size < COMPACT_MIN_BYTES:
+            return False
+        try:
+            document = os.path.getsize(self.document)
+        except OSError:
+            # Moved or deleted behind our back: leave it to the next save.
+            return False
+        return size > COMPACT_RATIO * document
+
+    def compact(self):
+        """Rewrite the document as a full snapshot and start a new journal."""
+        self._pending_move = None
+        self._file.close()
+        self._file = None
+        styles = self.app.store.styles.colors()
+        write_entries(self.document, self.app._shapeEntries(), styles)
+        self.start()
+
+    def close(self):
+        """Sync and close the journal; it stays on disk next to the document."""
+        if self._file is None:
+            return
+        self.sync()
+        self._file.close()
+        self._file = None
+
+    def discard(self):
+        """Drop a journal that was begun but never started."""
+        self._pending_move = None
+        self._file = None
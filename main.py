@@ -1,14 +1,123 @@
+"""
+Start the drawing app, optionally opening a drawing.
+
+    python main.py [drawing.json] [--startup-metrics] [--metrics-json FILE]
+
+The window is shown before the drawing is read. The shapes of the first
+screenful are added first and the rest stream in over later event-loop
+iterations, so the app stays responsive while a large drawing opens.
+
+Startup metrics are the seconds, counted from when this module started
+running, taken to import the app, to paint the first frame, to paint the
+first screenful of the drawing and to finish loading it. They are printed
+to stderr with --startup-metrics (or when DRAWING_APP_PROFILE is set) and
+written as JSON with --metrics-json.
+"""
+
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import json
+import os
 import sys
+
+from PyQt5.QtCore import QEvent, QObject, QTimer, pyqtSignal
 from PyQt5.QtWidgets import QApplication
+
 from app import DrawingApp
 
+IMPORTED = time.perf_counter()
+
+STAGES = ("import", "first_paint", "first_screenful", "document_loaded")
+
+
+class StartupMetrics(QObject):
+    """Times the stages of startup as the window paints and loads."""
 
-def main():
-    app = QApplication(sys.argv)
+    reached = pyqtSignal(str)
+
+    def __init__(self, window):
+        super().__init__(window)
+        self.window = window
+        self.values = {}
+        self._waiting = []
+        self._viewport = window.view.viewport()
+        self._viewport.installEventFilter(self)
+        self.mark("import", IMPORTED)
+        self.markAfterPaint("first_paint")
+        window.firstScreenfulAdded.connect(
+            lambda: self.markAfterPaint("first_screenful")
+        )
+        window.documentLoaded.connect(lambda _filename: self.mark("document_loaded"))
+
+    def mark(self, name, when=None):
+        """Record that stage ``name`` was reached (now, by default)."""
+        if when is None:
+            when = time.perf_counter()
+        seconds = when - STARTED
+        self.values[name] = seconds
+        self.window.instrumentation.record(f"startup_{name}", seconds)
+        self.reached.emit(name)
+
+    def markAfterPaint(self, name):
+        """Record stage ``name`` once the view has painted again."""
+        self._waiting.append(name)
+        self._viewport.update()
+
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Paint and self._waiting:
+            names, self._waiting = self._waiting, []
+            # The paint event is delivered after this filter returns.
+            QTimer.singleShot(0, lambda: [self.mark(name) for name in names])
+        return False
+
+    def report(self, stream=sys.stderr):
+        parts = [
+            f"{name.replace('_', ' ')} {self.values[name]:.3f}s"
+            for name in STAGES
+            if name in self.values
+        ]
+        print("startup: " + ", ".join(parts), file=stream)
+
+
+def main(argv=None):
+    """Entry point: launch the drawing application."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("file", nargs="?", help="JSON or binary drawing to open")
+    parser.add_argument(
+        "--startup-metrics", action="store_true", help="print startup times to stderr"
+    )
+    parser.add_argument("--metrics-json", help="write startup times to this file")
+    parser.add_argument(
+        "--exit-after-open",
+        action="store_true",
+        help="quit once the drawing has loaded (for benchmarks)",
+    )
+    args = parser.parse_args(argv)
+
+    app = QApplication(sys.argv[:1])
     window = DrawingApp()
+    metrics = StartupMetrics(window)
     window.show()
-    sys.exit(app.exec_())
+
+    def finished():
+        if args.startup_metrics or os.environ.get("DRAWING_APP_PROFILE"):
+            metrics.report()
+        if args.metrics_json:
+            with open(args.metrics_json, "w") as f:
+                json.dump(metrics.values, f, indent=2)
+        if args.exit_after_open:
+            app.quit()
+
+    last = "document_loaded" if args.file else "first_paint"
+    metrics.reached.connect(lambda name: finished() if name == last else None)
+    if args.file:
+        # Open once the event loop runs, so the empty window paints first.
+        QTimer.singleShot(0, lambda: window.openInBackground(args.file))
+    return app.exec_()
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
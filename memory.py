@@ -0,0 +1,205 @@
+"""
+Memory diagnostics for the drawing app.
+
+Reports what a drawing costs and what is still alive after it is gone:
+
+- ``store_usage()``: rows and column bytes of a ShapeStore per shape type;
+- ``live_objects()``: live shape objects, stand-ins and graphics items per
+  type, with their Python-side size (Qt's C++ memory is not included);
+- ``stray_items()``: graphics items that are still alive but in no scene
+  and not kept by the undo history, which is what a leak after a clear
+  looks like;
+- ``memory_report()``: all of the above for a DrawingApp, plus the
+  history's estimate and tracemalloc's totals when tracing.
+
+``leak_cycles()`` repeats an operation (such as loading a drawing and
+clearing it) and fails if the memory retained after each cycle, or the
+number of objects left alive, keeps growing once the caches are warm.
+See ``benchmarks/bench_memory.py``. Allocations per operation are
+recorded by ``Instrumentation.trace_allocations()`` in profiling.py.
+"""
+
+import gc
+import sys
+import tracemalloc
+from array import array
+from collections import namedtuple
+
+from PyQt5 import sip
+from PyQt5.QtWidgets import QGraphicsItem
+
+from shapes import KIND_NAMES, ShapeBase, ShapeStore
+from virtual import VirtualItem
+
+# Model bytes of one row (every column of ShapeStore).
+ROW_BYTES = sum(array(code).itemsize for _, code in ShapeStore._COLUMNS)
+
+# Memory retained after a load/clear cycle may grow by this much in total
+# before leak_cycles() calls it a leak (allocator and cache noise).
+LEAK_TOLERANCE_BYTES = 512 * 1024
+
+CycleSample = namedtuple("CycleSample", "cycle retained_bytes objects")
+
+
+def store_usage(store):
+    """
+    Rows in use and model bytes per shape type of a ShapeStore, as
+    {type name: {"rows": n, "bytes": n}}. Polyline vertex arrays count
+    towards their row; free rows (kept for reuse) are reported as "free".
+    """
+    usage = {}
+    kind, points = store.kind, store.points
+    for row in store.rows():
+        name = KIND_NAMES.get(kind[row], "unknown")
+        entry = usage.get(name)
+        if entry is None:
+            entry = usage[name] = {"rows": 0, "bytes": 0}
+        entry["rows"] += 1
+        entry["bytes"] += ROW_BYTES
+        vertices = points.get(int(row))
+        if vertices is not None:
+            entry["bytes"] += vertices.itemsize * len(vertices)
+    free = len(kind) - len(store)
+    if free:
+        usage["free"] = {"rows": free, "bytes": free * ROW_BYTES}
+    return usage
+
+
+def _tracked_objects():
+    for obj in gc.get_objects():
+        if isinstance(obj, QGraphicsItem):
+            # Wrappers whose C++ item Qt has already deleted hold nothing.
+            if not sip.isdeleted(obj):
+                yield obj
+        elif isinstance(obj, (ShapeBase, VirtualItem)):
+            yield obj
+
+
+def _python_size(obj):
+    size = sys.getsizeof(obj)
+    attributes = getattr(obj, "__dict__", None)
+    if attributes is not None:
+        size += sys.getsizeof(attributes)
+    return size
+
+
+def live_objects():
+    """
+    Live shapes, virtual stand-ins and graphics items per type, as
+    {type name: {"count": n, "bytes": n}}. Bytes are the Python objects and
+    their attribute dicts; shapes' rows are in store_usage().
+    """
+    objects = {}
+    for obj in _tracked_objects():
+        name = type(obj).__name__
+        entry = objects.get(name)
+        if entry is None:
+            entry = objects[name] = {"count": 0, "bytes": 0}
+        entry["count"] += 1
+        entry["bytes"] += _python_size(obj)
+    return objects
+
+
+def stray_items(retained=()):
+    """
+    Graphics items per type that are alive but in no scene (items of other
+    windows are not stray) and are not in ``retained``, as {type name:
+    count}. Only top-level items are counted: the children of a stray
+    group (such as the lines of a PolygonWithLines) go with it.
+    """
+    retained = {id(item) for item in retained}
+    stray = {}
+    for obj in _tracked_objects():
+        if not isinstance(obj, QGraphicsItem) or id(obj) in retained:
+            continue
+        if obj.parentItem() is not None or obj.scene() is not None:
+            continue
+        name = type(obj).__name__
+        stray[name] = stray.get(name, 0) + 1
+    return stray
+
+
+def memory_report(app):
+    """
+    Memory diagnostics of a DrawingApp as plain data: model usage, live
+    objects, stray items (items kept for undo are not stray), the undo
+    history's estimate and, while tracemalloc is tracing, its totals.
+    """
+    gc.collect()
+    report = {
+        "store": store_usage(app.store),
+        "objects": live_objects(),
+        "stray_items": stray_items(app.history.items()),
+        "history_bytes": app.history.nbytes,
+    }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        report["traced_bytes"] = current
+        report["traced_peak_bytes"] = peak
+    return report
+
+
+def _count_objects():
+    counts = {}
+    for obj in _tracked_objects():
+        name = type(obj).__name__
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def leak_cycles(cycle, cycles=10, warmup=2, tolerance=LEAK_TOLERANCE_BYTES):
+    """
+    Call ``cycle()`` ``cycles`` times and check that it does not leak.
+
+    After each call garbage is collected and the memory tracemalloc still
+    traces and the live tracked objects (see live_objects()) are sampled.
+    Once ``warmup`` cycles have filled caches, the run leaks if the last
+    cycle leaves more tracked objects alive than the first one after the
+    warm-up did, or if every cycle in the second half retains more than
+    ``tolerance`` bytes over the least an earlier cycle retained. Retained
+    memory goes up and down as the journal is compacted and caches are
+    reused, so only steady growth counts.
+
+    Returns (samples, problems): a CycleSample per cycle and a list of
+    messages, empty if nothing leaked.
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    samples = []
+    try:
+        for number in range(cycles):
+            cycle()
+            gc.collect()
+            retained = tracemalloc.get_traced_memory()[0]
+            samples.append(CycleSample(number, retained, _count_objects()))
+    finally:
+        if started:
+            tracemalloc.stop()
+    return samples, _leaks(samples[warmup:], tolerance)
+
+
+def _leaks(samples, tolerance):
+    problems = []
+    if len(samples) < 2:
+        return problems
+    baseline = samples[0].objects
+    last = samples[-1]
+    for name, count in sorted(last.objects.items()):
+        extra = count - baseline.get(name, 0)
+        if extra > 0:
+            problems.append(
+                f"{extra} more {name} alive after cycle {last.cycle} "
+                f"than after cycle {samples[0].cycle}"
+            )
+    lowest = min(sample.retained_bytes for sample in samples[:-1])
+    growth = last.retained_bytes - lowest
+    if growth > tolerance and all(
+        later.retained_bytes - lowest > tolerance
+        for later in samples[len(samples) // 2 :]
+    ):
+        problems.append(
+            f"retained memory grew by {growth} bytes "
+            f"(tolerance {tolerance}) by cycle {last.cycle}"
+        )
+    return problems
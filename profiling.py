@@ -0,0 +1,161 @@
+"""
+Opt-in performance instrumentation for the drawing app.
+
+An Instrumentation object keeps a rolling log of timed samples (operation
+name, wall time, items touched) plus per-operation counters, and the frame
+times of the view's paint events. It is disabled by default; when disabled
+every hook returns immediately.
+
+With ``trace_allocations()`` each measured operation also records how
+much memory it left allocated and its peak allocation, from tracemalloc
+(only Python-level allocations are seen; Qt's own memory is not).
+
+Set the DRAWING_APP_PROFILE environment variable to start the app with
+instrumentation and the on-canvas stats overlay switched on, and
+DRAWING_APP_TRACE_MEMORY to trace allocations as well.
+"""
+
+import functools
+import time
+import tracemalloc
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+Sample = namedtuple("Sample", "name seconds items timestamp")
+
+
+class Instrumentation:
+    """Rolling log and counters of operation and frame timings."""
+
+    def __init__(self, history=2000):
+        self.enabled = False
+        self.samples = deque(maxlen=history)
+        self.frames = deque(maxlen=history)
+        self.counters = {}
+        self.gauges = {}
+        self.tracing = False
+        # Whether trace_allocations() started tracemalloc (and so stops it).
+        self._started_tracing = False
+        self._active = []
+
+    def reset(self):
+        """Forget all samples, frames and counters."""
+        self.samples.clear()
+        self.frames.clear()
+        self.counters.clear()
+
+    def trace_allocations(self, enabled=True):
+        """
+        Start (or stop) recording the memory each measured operation
+        allocates. Tracing slows every allocation down noticeably.
+
+        tracemalloc is started if it is not tracing yet, and stopped again
+        only if it was started here; tracing begun elsewhere is left on.
+        """
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        elif not enabled and self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        self.tracing = enabled
+
+    @contextmanager
+    def measure(self, name):
+        """Time the block as one sample of ``name``."""
+        if not self.enabled:
+            yield
+            return
+        tracing = self.tracing and tracemalloc.is_tracing()
+        if tracing:
+            before = tracemalloc.get_traced_memory()[0]
+            # The peak is global, so only the outermost operation resets it.
+            if not self._active:
+                tracemalloc.reset_peak()
+        self._active.append(0)
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - began
+            items = self._active.pop()
+            self.record(name, elapsed, items)
+            if tracing:
+                current, peak = tracemalloc.get_traced_memory()
+                self._allocated(name, current - before, peak - before)
+
+    def _allocated(self, name, retained, peak):
+        counter = self.counters[name]
+        counter["allocated_bytes"] = counter.get("allocated_bytes", 0) + retained
+        counter["last_allocated_bytes"] = retained
+        counter["max_peak_bytes"] = max(counter.get("max_peak_bytes", 0), peak)
+
+    def touched(self, count):
+        """Add ``count`` items to the operation currently being measured."""
+        if self._active:
+            self._active[-1] += count
+
+    def record(self, name, seconds, items=0):
+        """Add a sample to the log and update its counters."""
+        if not self.enabled:
+            return
+        self.samples.append(Sample(name, seconds, items, time.time()))
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters[name] = {
+                "count": 0,
+                "total_seconds": 0.0,
+                "max_seconds": 0.0,
+                "items": 0,
+            }
+        counter["count"] += 1
+        counter["total_seconds"] += seconds
+        counter["max_seconds"] = max(counter["max_seconds"], seconds)
+        counter["items"] += items
+
+    def frame(self, seconds):
+        """Record the duration of one paint event."""
+        if self.enabled:
+            self.frames.append((time.perf_counter(), seconds))
+
+    def gauge(self, name, func):
+        """Register a callable whose value is reported in snapshots."""
+        self.gauges[name] = func
+
+    def fps(self, window=1.0):
+        """Frames painted during the last ``window`` seconds, per second."""
+        if not self.frames:
+            return 0.0
+        cutoff = time.perf_counter() - window
+        count = sum(1 for stamp, _ in reversed(self.frames) if stamp >= cutoff)
+        return count / window
+
+    def last_frame_ms(self):
+        return self.frames[-1][1] * 1000 if self.frames else 0.0
+
+    def snapshot(self):
+        """Return counters, frame stats and gauges as plain data."""
+        return {
+            "counters": {name: dict(c) for name, c in self.counters.items()},
+            "fps": self.fps(),
+            "last_frame_ms": self.last_frame_ms(),
+            "frames": len(self.frames),
+            "gauges": {name: func() for name, func in self.gauges.items()},
+        }
+
+
+def instrumented(name):
+    """Measure a method as ``name`` through ``self.instrumentation``."""
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            instrumentation = self.instrumentation
+            if not instrumentation.enabled:
+                return method(self, *args, **kwargs)
+            with instrumentation.measure(name):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
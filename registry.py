@@ -0,0 +1,404 @@
+class _GroupNode:
+    """One group: direct members, child groups, parent and cached extent."""
+
+    __slots__ = ("members", "children", "parent", "items", "bounds")
+
+    def __init__(self):
+        self.members = {}
+        self.children = {}
+        self.parent = None
+        # Every item in the subtree, and their combined scene bounding box
+        # (x0, y0, x1, y1); None until asked for again after a change.
+        self.items = None
+        self.bounds = None
+
+    def isEmpty(self):
+        return not self.members and not self.children and self.parent is None
+
+
+class GroupRegistry:
+    """
+    Tree of groups and their members.
+
+    A shape's group ID names the innermost group it belongs to; groups can
+    themselves be children of other groups. Each node keeps its direct
+    members and child groups (in insertion order) and caches the list of
+    every item below it and their combined bounding box, so whole-group
+    operations do not rediscover the group item by item. Membership and
+    parent changes drop the caches of the node and its ancestors; geometry
+    changes are reported with invalidate() (or shift() for a whole group
+    moved by an offset). A cached ancestor implies cached descendants, so
+    invalidation stops at the first node that has nothing cached.
+
+    Parent links outlive a group's members, so a group whose shapes are
+    removed and later put back (undo) is nested where it was. Group IDs
+    come from a counter and are never reused within a session.
+    """
+
+    def __init__(self):
+        self._nodes = {}
+        self._next_id = 1
+
+    def __len__(self):
+        return sum(1 for node in self._nodes.values() if node.members or node.children)
+
+    def __contains__(self, group_id):
+        node = self._nodes.get(group_id)
+        return node is not None and bool(node.members or node.children)
+
+    def new_id(self):
+        """Return a fresh group ID that no existing group uses."""
+        group_id = self._next_id
+        self._next_id += 1
+        return group_id
+
+    def _node(self, group_id):
+        node = self._nodes.get(group_id)
+        if node is None:
+            node = self._nodes[group_id] = _GroupNode()
+            if isinstance(group_id, int) and group_id >= self._next_id:
+                # Keep IDs loaded from files from colliding with new ones.
+                self._next_id = group_id + 1
+        return node
+
+    def _prune(self, group_id):
+        node = self._nodes.get(group_id)
+        if node is not None and node.isEmpty():
+            del self._nodes[group_id]
+
+    def _changed(self, group_id, membership=True):
+        """Drop the caches of a group and its ancestors."""
+        node = self._nodes.get(group_id)
+        while node is not None and (
+            node.bounds is not None or (membership and node.items is not None)
+        ):
+            node.bounds = None
+            if membership:
+                node.items = None
+            node = self._nodes.get(node.parent)
+
+    def create(self, items):
+        """
+        Put the given items into a new group and return its ID.
+
+        Ungrouped items become members of the new group; grouped items
+        bring their top-level group along as a child, so grouping groups
+        nests them. Returns None if nothing would change.
+        """
+        items = [item for item in items if getattr(item, "shape", None) is not None]
+        loose = [item for item in items if item.shape.group_id is None]
+        roots = self.roots(items)
+        if not loose and len(roots) < 2:
+            return None
+        group_id = self.new_id()
+        for item in loose:
+            self.add(item, group_id)
+        for root in roots:
+            self.set_parent(root, group_id)
+        return group_id
+
+    def add(self, item, group_id):
+        """Register an item as a direct member of the group with the given ID."""
+        self.discard(item)
+        item.shape.group_id = group_id
+        self._changed(group_id)
+        self._node(group_id).members[item] = None
+
+    def set_group(self, item, group_id):
+        """Make an item a direct member of a group, or of none with None."""
+        if group_id is None:
+            self.discard(item)
+            item.shape.group_id = None
+        else:
+            self.add(item, group_id)
+
+    def discard(self, item):
+        """Forget an item's membership without touching its shape."""
+        group_id = item.shape.group_id
+        node = self._nodes.get(group_id)
+        if node is None or item not in node.members:
+            return
+        self._changed(group_id)
+        del node.members[item]
+        self._prune(group_id)
+
+    def set_parent(self, group_id, parent_id):
+        """Nest a group in another one, or make it top-level with None."""
+        node = self._node(group_id)
+        if node.parent == parent_id:
+            return
+        ancestor = parent_id
+        while ancestor is not None:
+            if ancestor == group_id:
+                raise ValueError(f"group {group_id} cannot be nested in itself")
+            ancestor = self.parent(ancestor)
+        self._changed(group_id)
+        old_parent = node.parent
+        if old_parent is not None:
+            del self._nodes[old_parent].children[group_id]
+            node.parent = None
+            self._prune(old_parent)
+        if parent_id is not None:
+            self._changed(parent_id)
+            self._node(parent_id).children[group_id] = None
+            node.parent = parent_id
+        self._prune(group_id)
+
+    def link_path(self, group_id, parents):
+        """Restore a chain of parents (innermost first) read from a file."""
+        for parent_id in parents or ():
+            if self.parent(group_id) != parent_id:
+                self.set_parent(group_id, parent_id)
+            group_id = parent_id
+
+    def parent(self, group_id):
+        node = self._nodes.get(group_id)
+        return None if node is None else node.parent
+
+    def ancestors(self, group_id):
+        """Parent, grandparent, ... of a group (innermost first)."""
+        chain = []
+        parent_id = self.parent(group_id)
+        while parent_id is not None:
+            chain.append(parent_id)
+            parent_id = self.parent(parent_id)
+        return chain
+
+    def root(self, group_id):
+        """The top-level group that contains a group (itself if top-level)."""
+        parent_id = self.parent(group_id)
+        while parent_id is not None:
+            group_id = parent_id
+            parent_id = self.parent(group_id)
+        return group_id
+
+    def roots(self, items):
+        """IDs of the top-level groups the given items belong to, in order."""
+        roots = {}
+        for item in items:
+            shape = getattr(item, "shape", None)
+            if shape is not None and shape.group_id is not None:
+                roots[self.root(shape.group_id)] = None
+        return list(roots)
+
+    def children(self, group_id):
+        """IDs of the groups nested directly in a group."""
+        node = self._nodes.get(group_id)
+        return [] if node is None else list(node.children)
+
+    def direct_members(self, group_id):
+        """Items that belong to a group itself rather than to a child group."""
+        node = self._nodes.get(group_id)
+        return [] if node is None else list(node.members)
+
+    def links(self):
+        """Parent of every nested group, as a {group ID: parent ID} dict."""
+        return {
+            group_id: node.parent
+            for group_id, node in self._nodes.items()
+            if node.parent is not None
+        }
+
+    def ungroup(self, items):
+        """
+        Dissolve the top-level groups of the given items, one level: their
+        direct members become ungrouped and their child groups top-level.
+        """
+        for root in self.roots(items):
+            node = self._nodes.get(root)
+            if node is None:
+                continue
+            for item in list(node.members):
+                self.set_group(item, None)
+            for child in list(node.children):
+                self.set_parent(child, None)
+
+    def members(self, group_id):
+        """
+        Every item in a group and the groups nested in it (empty if the
+        group does not exist). The list is cached; do not modify it.
+        """
+        node = self._nodes.get(group_id)
+        if node is None:
+            return []
+        if node.items is None:
+            items = list(node.members)
+            for child in node.children:
+                items.extend(self.members(child))
+            node.items = items
+        return node.items
+
+    def bounds(self, group_id):
+        """
+        Cached scene bounding box (x0, y0, x1, y1) of everything in a group,
+        or None if it has no model-backed shapes.
+        """
+        node = self._nodes.get(group_id)
+        if node is None:
+            return None
+        if node.bounds is None:
+            x0 = y0 = float("inf")
+            x1 = y1 = float("-inf")
+            for item in node.members:
+                shape = item.shape
+                store = getattr(shape, "store", None)
+                if store is None:
+                    continue
+                bx0, by0, bx1, by1 = store.row_bounds(shape.index)
+                x0, y0 = min(x0, bx0), min(y0, by0)
+                x1, y1 = max(x1, bx1), max(y1, by1)
+            for child in node.children:
+                box = self.bounds(child)
+                if box is not None:
+                    x0, y0 = min(x0, box[0]), min(y0, box[1])
+                    x1, y1 = max(x1, box[2]), max(y1, box[3])
+            # An empty tuple caches "no bounds", so a cached parent always
+            # has cached children.
+            node.bounds = (x0, y0, x1, y1) if x0 <= x1 else ()
+        return node.bounds or None
+
+    def center(self, group_id):
+        """Center of a group's bounding box, or None (see bounds())."""
+        box = self.bounds(group_id)
+        if box is None:
+            return None
+        return (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+
+    def group_at(self, x, y):
+        """
+        The most recently created top-level group whose bounding box
+        contains the scene point (x, y), or None.
+        """
+        found = None
+        for group_id, node in self._nodes.items():
+            if node.parent is not None or not (node.members or node.children):
+                continue
+            box = self.bounds(group_id)
+            if box is not None and box[0] <= x <= box[2] and box[1] <= y <= box[3]:
+                if found is None or group_id > found:
+                    found = group_id
+        return found
+
+    def invalidate(self, items):
+        """Drop the cached bounds of the groups whose items changed shape or place."""
+        changed = self._changed
+        for item in items:
+            group_id = item.shape.group_id
+            if group_id is not None:
+                changed(group_id, membership=False)
+
+    def shift(self, group_id, dx, dy):
+        """
+        Move the cached bounds of a whole top-level group (and the groups
+        in it) by an offset, after all of its items were moved by it.
+        """
+        node = self._nodes.get(group_id)
+        if node is None:
+            return
+        if node.parent is not None:
+            # Ancestors only moved in part.
+            self._changed(node.parent, membership=False)
+        stack = [group_id]
+        while stack:
+            node = self._nodes[stack.pop()]
+            if node.bounds:
+                x0, y0, x1, y1 = node.bounds
+                node.bounds = (x0 + dx, y0 + dy, x1 + dx, y1 + dy)
+            # Inner groups may be cached when this one is not.
+            stack.extend(node.children)
+
+    def expand(self, items):
+        """
+        Return the given items with every group they touch expanded to all
+        the items of its top-level group, without duplicates.
+        """
+        expanded = {}
+        seen_groups = set()
+        for item in items:
+            shape = getattr(item, "shape", None)
+            if shape is None:
+                continue
+            group_id = shape.group_id
+            if group_id is not None and group_id in self._nodes:
+                root = self.root(group_id)
+                if root not in seen_groups:
+                    seen_groups.add(root)
+                    expanded.update(dict.fromkeys(self.members(root)))
+            else:
+                expanded[item] = None
+        return list(expanded)
+
+    def units(self, items):
+        """
+        Split a selection into the parts that transform as one: returns
+        (items, pivots), where items is expand(items) and pivots is a list
+        of (count, pivot) runs over it. Each top-level group is one run
+        whose pivot is the center of its bounds; runs of ungrouped items
+        have pivot None (each turns about its own center).
+        """
+        expanded = []
+        pivots = []
+        loose = 0
+        seen_items = set()
+        seen_groups = set()
+        for item in items:
+            shape = getattr(item, "shape", None)
+            if shape is None:
+                continue
+            group_id = shape.group_id
+            if group_id is None or group_id not in self._nodes:
+                if item not in seen_items:
+                    seen_items.add(item)
+                    expanded.append(item)
+                    loose += 1
+                continue
+            root = self.root(group_id)
+            if root in seen_groups:
+                continue
+            seen_groups.add(root)
+            if loose:
+                pivots.append((loose, None))
+                loose = 0
+            members = self.members(root)
+            expanded.extend(members)
+            pivots.append((len(members), self.center(root)))
+        if loose:
+            pivots.append((loose, None))
+        return expanded, pivots
+
+    def clear(self):
+        """Drop all groups. IDs keep counting up so old ones stay unique."""
+        self._nodes.clear()
+
+
+class ItemRegistry:
+    """
+    Insertion-ordered set of the graphics items owned by the app.
+
+    Backed by a dict, so membership tests and removals are O(1) while
+    iteration still follows the order items were added in.
+    """
+
+    def __init__(self):
+        self._items = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def add(self, item):
+        """Register an item (no-op if it is already registered)."""
+        self._items[item] = None
+
+    def discard(self, item):
+        """Forget an item if it is registered."""
+        self._items.pop(item, None)
+
+    def clear(self):
+        """Forget all items."""
+        self._items.clear()
@@ -0,0 +1,323 @@
+"""
+Headless rendering of saved drawings to PNG or SVG.
+
+Documents (JSON or binary) are read into a ShapeStore and painted straight
+from its columns with QPainter, without a window, a scene or per-shape
+graphics items. PNGs of large canvases are rendered in horizontal strips
+that are compressed and appended to the file one after another, so peak
+memory depends on the strip size rather than the canvas size; each strip
+only paints the shapes the spatial index finds in it. Several documents
+are rendered in parallel on a process pool.
+
+    python render.py drawing.json other.drwb --format png --jobs 8
+    python render.py *.json --format svg --output-dir images --scale 0.5
+"""
+
+import argparse
+import os
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import QLineF, QRectF, QSize
+from PyQt5.QtGui import QColor, QGuiApplication, QImage, QPainter, QTransform
+from PyQt5.QtSvg import QSvgGenerator
+
+from freehand import polyline_polygon
+from shapes import KIND_ELLIPSE, KIND_LINE, KIND_POLYLINE, ShapeStore, numpy
+from spatial import SpatialIndex
+from storage import iter_entries
+
+FORMATS = ("png", "svg")
+
+# Blank space around the drawing, in scene units.
+MARGIN = 10
+
+# Upper bound on the pixel memory of one PNG strip.
+MAX_STRIP_BYTES = 64 << 20
+
+BACKGROUND = QColor(255, 255, 255)
+
+_application = None
+
+
+def _ensure_application():
+    # QPainter needs a GUI application for fonts and the SVG generator;
+    # the offscreen platform provides one without a display.
+    global _application
+    if QGuiApplication.instance() is None:
+        _application = QGuiApplication(sys.argv[:1])
+
+
+def load_store(filename):
+    """Read a document into a new ShapeStore (unsupported shapes are skipped)."""
+    store = ShapeStore()
+    for entry in iter_entries(filename):
+        store.add_entry(entry)
+    return store
+
+
+def drawing_bounds(store):
+    """Scene rect covering every shape plus MARGIN (a small rect if empty)."""
+    rows = store.rows()
+    if not len(rows):
+        return QRectF(0, 0, 2 * MARGIN, 2 * MARGIN)
+    x0, y0, x1, y1 = store.bounds()
+    if numpy is not None:
+        left, top = x0[rows].min(), y0[rows].min()
+        right, bottom = x1[rows].max(), y1[rows].max()
+    else:
+        left, top = min(x0[r] for r in rows), min(y0[r] for r in rows)
+        right, bottom = max(x1[r] for r in rows), max(y1[r] for r in rows)
+    return QRectF(left, top, right - left, bottom - top).adjusted(
+        -MARGIN, -MARGIN, MARGIN, MARGIN
+    )
+
+
+class ShapePainter:
+    """Paints store rows with a QPainter, styled like the app's items."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def paint(self, painter, rows, base):
+        """Paint ``rows`` in order; ``base`` maps scene to device coordinates."""
+        store = self.store
+        kind, x, y, a, b = store.kind, store.x, store.y, store.a, store.b
+        pos_x, pos_y = store.pos_x, store.pos_y
+        rotation, scale = store.rotation, store.scale
+        style, styles, points = store.style, store.styles, store.points
+        for row in rows:
+            sx, sy, sa, sb = x[row], y[row], a[row], b[row]
+            line = kind[row] == KIND_LINE
+            if line:
+                ox, oy = (sx + sa) / 2, (sy + sb) / 2
+            else:
+                ox, oy = sx + sa / 2, sy + sb / 2
+            # Same transform as a graphics item: rotation and scale about
+            # the geometry center, then the item position.
+            transform = QTransform()
+            transform.translate(pos_x[row] + ox, pos_y[row] + oy)
+            transform.rotate(rotation[row])
+            transform.scale(scale[row], scale[row])
+            transform.translate(-ox, -oy)
+            painter.setTransform(transform * base)
+            if line:
+                painter.setPen(styles.line_pen(style[row]))
+                painter.drawLine(QLineF(sx, sy, sa, sb))
+                continue
+            if kind[row] == KIND_POLYLINE:
+                painter.setPen(styles.line_pen(style[row]))
+                painter.drawPolyline(polyline_polygon(sx, sy, points[row]))
+                continue
+            painter.setPen(styles.pen(style[row]))
+            painter.setBrush(styles.brush(style[row]))
+            if kind[row] == KIND_ELLIPSE:
+                painter.drawEllipse(QRectF(sx, sy, sa, sb))
+            else:
+                painter.drawRect(QRectF(sx, sy, sa, sb))
+
+
+def _base_transform(bounds, scale, top=0):
+    """Scene-to-device transform, ``top`` device rows down the image."""
+    return QTransform(scale, 0, 0, scale, -bounds.left() * scale, -bounds.top() * scale - top)
+
+
+def render_png(store, target, scale=1.0, max_strip_bytes=MAX_STRIP_BYTES):
+    """Render a store to a PNG file, in strips if the image is large."""
+    bounds = drawing_bounds(store)
+    width = max(1, int(bounds.width() * scale + 0.5))
+    height = max(1, int(bounds.height() * scale + 0.5))
+    strip_height = max(1, min(height, max_strip_bytes // (4 * width)))
+    shape_painter = ShapePainter(store)
+    if strip_height == height:
+        image = _render_strip(shape_painter, store.rows(), bounds, scale, 0, width, height)
+        if not image.save(target, "PNG"):
+            raise OSError(f"Could not write {target}")
+        return
+    index = SpatialIndex(store)
+    with open(target, "wb") as f:
+        writer = _PngWriter(f, width, height)
+        for top in range(0, height, strip_height):
+            rows_high = min(strip_height, height - top)
+            scene_top = bounds.top() + top / scale
+            rows = sorted(
+                index.query_rect(
+                    bounds.left(),
+                    scene_top,
+                    bounds.right(),
+                    scene_top + rows_high / scale,
+                )
+            )
+            image = _render_strip(shape_painter, rows, bounds, scale, top, width, rows_high)
+            writer.write(image.convertToFormat(QImage.Format_RGB888))
+        writer.close()
+
+
+def _render_strip(shape_painter, rows, bounds, scale, top, width, height):
+    image = QImage(width, height, QImage.Format_RGB32)
+    image.fill(BACKGROUND)
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.Antialiasing)
+    shape_painter.paint(painter, rows, _base_transform(bounds, scale, top))
+    painter.end()
+    return image
+
+
+class _PngWriter:
+    """Writes an RGB PNG scanline strip by scanline strip."""
+
+    def __init__(self, f, width, height):
+        self._file = f
+        self._width = width
+        self._compressor = zlib.compressobj()
+        f.write(b"\x89PNG\r\n\x1a\n")
+        # 8-bit RGB, default compression and filtering, no interlacing.
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(kind)
+        self._file.write(data)
+        self._file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+    def write(self, image):
+        """Append the scanlines of an RGB888 QImage as wide as the PNG."""
+        stride = image.bytesPerLine()
+        length = self._width * 3
+        bits = image.constBits()
+        bits.setsize(stride * image.height())
+        data = bits.asstring()
+        lines = bytearray()
+        for offset in range(0, len(data), stride):
+            lines += b"\0"  # filter type: none
+            lines += data[offset : offset + length]
+        compressed = self._compressor.compress(bytes(lines))
+        if compressed:
+            self._chunk(b"IDAT", compressed)
+
+    def close(self):
+        self._chunk(b"IDAT", self._compressor.flush())
+        self._chunk(b"IEND", b"")
+
+
+def render_svg(store, target, scale=1.0):
+    """Render a store to an SVG file (vector output, written as it is painted)."""
+    bounds = drawing_bounds(store)
+    width = max(1, int(bounds.width() * scale + 0.5))
+    height = max(1, int(bounds.height() * scale + 0.5))
+    generator = QSvgGenerator()
+    generator.setFileName(target)
+    generator.setSize(QSize(width, height))
+    generator.setViewBox(QRectF(0, 0, width, height))
+    painter = QPainter()
+    if not painter.begin(generator):
+        raise OSError(f"Could not write {target}")
+    painter.fillRect(QRectF(0, 0, width, height), BACKGROUND)
+    ShapePainter(store).paint(painter, store.rows(), _base_transform(bounds, scale))
+    painter.end()
+
+
+def render_file(source, target, scale=1.0, max_strip_bytes=MAX_STRIP_BYTES):
+    """
+    Render one document to ``target``; the format follows its suffix.
+
+    Returns (target, shapes rendered, seconds).
+    """
+    _ensure_application()
+    began = time.perf_counter()
+    store = load_store(source)
+    if target.lower().endswith(".svg"):
+        render_svg(store, target, scale)
+    else:
+        render_png(store, target, scale, max_strip_bytes)
+    return target, len(store), time.perf_counter() - began
+
+
+def output_path(source, fmt, output_dir=None):
+    """``source`` with its suffix replaced by ``fmt``, optionally moved."""
+    stem = os.path.splitext(os.path.basename(source))[0]
+    directory = output_dir if output_dir is not None else os.path.dirname(source)
+    return os.path.join(directory, f"{stem}.{fmt}")
+
+
+def render_many(jobs, processes=None, **options):
+    """
+    Render (source, target) pairs on a process pool.
+
+    Yields (source, result, error) as each one finishes, where result is
+    what render_file() returns and error is a message (or None).
+    """
+    if processes == 1:
+        for source, target in jobs:
+            try:
+                yield source, render_file(source, target, **options), None
+            except (OSError, ValueError, KeyError) as exc:
+                yield source, None, str(exc)
+        return
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {
+            pool.submit(render_file, source, target, **options): source
+            for source, target in jobs
+        }
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                yield source, future.result(), None
+            except (OSError, ValueError, KeyError) as exc:
+                yield source, None, str(exc)
+
+
+def main(argv=None):
+    """Command-line entry point; returns the exit status."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("files", nargs="+", help="JSON or binary drawings")
+    parser.add_argument("--format", choices=FORMATS, default="png")
+    parser.add_argument("--output-dir", help="default: next to each input")
+    parser.add_argument("--scale", type=float, default=1.0, help="pixels per scene unit")
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+        help="worker processes (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--strip-megabytes",
+        type=int,
+        default=MAX_STRIP_BYTES >> 20,
+        help="pixel memory of one PNG strip",
+    )
+    args = parser.parse_args(argv)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    jobs = [
+        (source, output_path(source, args.format, args.output_dir))
+        for source in args.files
+    ]
+    processes = args.jobs
+    if processes is None:
+        processes = min(len(jobs), os.cpu_count() or 1)
+    failed = 0
+    results = render_many(
+        jobs,
+        processes,
+        scale=args.scale,
+        max_strip_bytes=args.strip_megabytes << 20,
+    )
+    for source, result, error in results:
+        if error is not None:
+            failed += 1
+            print(f"{source}: {error}", file=sys.stderr)
+        else:
+            target, count, seconds = result
+            print(f"{source} -> {target} ({count} shapes, {seconds:.2f}s)", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,8 @@
-from PyQt5.QtCore import QPointF
+import math
+import weakref
+from array import array
+
+from PyQt5.QtCore import QPointF, Qt
 from PyQt5.QtGui import QPen, QColor, QPolygonF, QBrush
 from PyQt5.QtWidgets import (
     QGraphicsPolygonItem,
@@ -8,17 +12,711 @@ from PyQt5.QtWidgets import (
     QGraphicsItem,
 )
 
+from codec import decode_points, encode_points
+
+
+try:
+    import numpy
+except ImportError:  # numpy is optional; batch operations fall back to loops
+    numpy = None
+
+KIND_RECTANGLE = 0
+KIND_ELLIPSE = 1
+KIND_SQUARE = 2
+KIND_LINE = 3
+KIND_POLYLINE = 4
+
+# Type names used for each kind in saved documents.
+KIND_NAMES = {
+    KIND_RECTANGLE: "RectangleShape",
+    KIND_ELLIPSE: "EllipseShape",
+    KIND_SQUARE: "SquareShape",
+    KIND_LINE: "LineShape",
+    KIND_POLYLINE: "PolylineShape",
+}
+
+KIND_CODES = {name: kind for kind, name in KIND_NAMES.items()}
+
+# Stored in the group column for shapes that are not grouped.
+NO_GROUP = -(2**63)
+
+
+def _pack_color(color):
+    r, g, b = color[:3]
+    return (int(r) << 16) | (int(g) << 8) | int(b)
+
+
+def _unpack_color(value):
+    return ((value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF)
+
+
+DEFAULT_BORDER = 0xFFFFFF
+
+# Shared pen that draws nothing, for shapes too small on screen to show an
+# outline (see StyleTable.hairline_pen() for lines).
+NO_PEN = QPen(Qt.NoPen)
+DEFAULT_STROKE_WIDTH = 2.0
+DEFAULT_ALPHA = 255
+
+
+class StyleTable:
+    """
+    Interned shape styles: fill and border color, pen width and opacity.
+
+    Real drawings use a few dozen distinct styles, so shapes store the
+    index of their style instead of the values. Styles are never changed
+    or removed once added (restyling a shape points it at another entry),
+    so indices stay valid for every store sharing the table. The Qt pens
+    and brushes of each style are created once, on first use, and shared
+    by every item drawn with it.
+    """
+
+    _COLUMNS = (
+        ("fill", "I"),
+        ("border", "I"),
+        ("stroke_width", "f"),
+        ("alpha", "B"),
+    )
+
+    def __init__(self):
+        for name, code in self._COLUMNS:
+            setattr(self, name, array(code))
+        self._index = {}
+        self._pens = []
+        self._line_pens = []
+        self._hairline_pens = []
+        self._brushes = []
+
+    def __len__(self):
+        return len(self.fill)
+
+    def intern(
+        self,
+        fill,
+        border=DEFAULT_BORDER,
+        stroke_width=DEFAULT_STROKE_WIDTH,
+        alpha=DEFAULT_ALPHA,
+    ):
+        """Return the index of the style with these (packed) values."""
+        key = (fill, border, stroke_width, alpha)
+        index = self._index.get(key)
+        if index is None:
+            index = self._index[key] = len(self.fill)
+            self.fill.append(fill)
+            self.border.append(border)
+            self.stroke_width.append(stroke_width)
+            self.alpha.append(alpha)
+            self._pens.append(None)
+            self._line_pens.append(None)
+            self._hairline_pens.append(None)
+            self._brushes.append(None)
+        return index
+
+    def for_colors(self, fill_color, border_color):
+        """Index of the default style with these (r, g, b) colors."""
+        return self.intern(_pack_color(fill_color), _pack_color(border_color))
+
+    def values(self, index):
+        """(fill, border, stroke_width, alpha) of a style."""
+        return (
+            self.fill[index],
+            self.border[index],
+            self.stroke_width[index],
+            self.alpha[index],
+        )
+
+    def colors(self):
+        """Distinct (fill, border) colors of the styles, as (r, g, b) pairs."""
+        pairs = dict.fromkeys(zip(self.fill, self.border))
+        return [(_unpack_color(fill), _unpack_color(border)) for fill, border in pairs]
+
+    def restyled(self, index, **changes):
+        """Index of style ``index`` with some values replaced."""
+        values = dict(zip(("fill", "border", "stroke_width", "alpha"), self.values(index)))
+        values.update(changes)
+        return self.intern(**values)
+
+    def pen(self, index):
+        """Outline pen of a style (border color)."""
+        pen = self._pens[index]
+        if pen is None:
+            pen = self._pens[index] = QPen(
+                QColor.fromRgb(self.border[index]), self.stroke_width[index]
+            )
+        return pen
+
+    def line_pen(self, index):
+        """Pen for lines, which are drawn in their fill color."""
+        pen = self._line_pens[index]
+        if pen is None:
+            pen = self._line_pens[index] = QPen(
+                QColor.fromRgb(self.fill[index]), self.stroke_width[index]
+            )
+        return pen
+
+    def hairline_pen(self, index):
+        """
+        One-pixel cosmetic pen in a style's fill color, for lines drawn
+        only a few pixels long.
+        """
+        pen = self._hairline_pens[index]
+        if pen is None:
+            pen = self._hairline_pens[index] = QPen(QColor.fromRgb(self.fill[index]), 0)
+            pen.setCosmetic(True)
+        return pen
+
+    def brush(self, index):
+        brush = self._brushes[index]
+        if brush is None:
+            brush = self._brushes[index] = QBrush(QColor.fromRgb(self.fill[index]))
+        return brush
+
+
+default_styles = StyleTable()
+
+
+class ShapeStore:
+    """
+    Columnar storage for shape data.
+
+    Every shape is a row index into typed arrays, so the model costs a few
+    dozen bytes per shape instead of a Python object with a ``__dict__``.
+    Geometry is ``x``/``y`` plus ``a``/``b`` (width/height, or x2/y2 for
+    lines); ``pos_x``/``pos_y``, ``rotation`` and ``scale`` mirror the
+    transform of the shape's graphics item. Rows of removed shapes are
+    reused, so a view must not be used after its shape has been released.
+
+    Polylines use ``x``/``y``/``a``/``b`` for their bounding box; their
+    vertices are in ``points``, which maps the row to an ``array("f")`` of
+    interleaved x, y offsets from (x, y). Those arrays are never changed in
+    place (resizing replaces them), so copies of the store can share them.
+
+    Colors, pen width and opacity are interned in ``styles`` (shared by
+    every store unless another table is given) and each row keeps the
+    index of its style.
+
+    ``spatial`` is the SpatialIndex attached to the store, if any; it is
+    told about every row whose bounds change.
+    """
+
+    _COLUMNS = (
+        ("kind", "B"),
+        ("x", "d"),
+        ("y", "d"),
+        ("a", "d"),
+        ("b", "d"),
+        ("pos_x", "d"),
+        ("pos_y", "d"),
+        ("rotation", "d"),
+        ("scale", "d"),
+        ("style", "I"),
+        ("group", "q"),
+        ("selected", "B"),
+    )
+
+    def __init__(self, styles=None):
+        self.styles = default_styles if styles is None else styles
+        self.spatial = None
+        self.clear()
+
+    def __len__(self):
+        return len(self.kind) - len(self._free)
+
+    def allocate(self, kind, x, y, a, b, fill):
+        """Add a row for a new shape and return its index."""
+        values = (
+            kind, x, y, a, b, 0.0, 0.0, 0.0, 1.0,
+            self.styles.intern(_pack_color(fill)), NO_GROUP, 0,
+        )
+        if self._free:
+            index = self._free.pop()
+            for column, value in zip(self._arrays, values):
+                column[index] = value
+        else:
+            for column, value in zip(self._arrays, values):
+                column.append(value)
+            index = len(self.kind) - 1
+        if self.spatial is not None:
+            self.spatial.invalidate_row(index)
+        return index
+
+    def copy_row(self, source, index):
+        """Copy row ``index`` of another store into a new row here."""
+        new_index = self.allocate(KIND_RECTANGLE, 0, 0, 0, 0, (0, 0, 0))
+        for column, source_column in zip(self._arrays, source._arrays):
+            column[new_index] = source_column[index]
+        if source.styles is not self.styles:
+            self.style[new_index] = self._styleFrom(source, source.style[index])
+        if index in source.points:
+            self.points[new_index] = source.points[index]
+        return new_index
+
+    def _styleFrom(self, source, style):
+        """Index here of style ``style`` of another store's table."""
+        return self.styles.intern(*source.styles.values(style))
+
+    def release(self, index):
+        """Free a row so a later shape can reuse it."""
+        self.group[index] = NO_GROUP
+        self.points.pop(index, None)
+        self._free.append(index)
+        if self.spatial is not None:
+            self.spatial.discard(index)
+
+    def clear(self):
+        """Drop every row."""
+        self._arrays = []
+        for name, code in self._COLUMNS:
+            column = array(code)
+            setattr(self, name, column)
+            self._arrays.append(column)
+        self._free = []
+        self.points = {}
+        if self.spatial is not None:
+            self.spatial.reset()
+
+    def rows(self):
+        """Indices of the rows in use (a NumPy array when NumPy is installed)."""
+        if numpy is not None:
+            in_use = numpy.ones(len(self.kind), dtype=bool)
+            in_use[self._free] = False
+            return numpy.flatnonzero(in_use)
+        free = set(self._free)
+        return [row for row in range(len(self.kind)) if row not in free]
+
+    def _moved(self, indices):
+        if self.spatial is not None:
+            self.spatial.invalidate(indices)
+
+    def copy(self):
+        """Return an independent copy of every row, e.g. as a snapshot to save."""
+        other = ShapeStore(self.styles)
+        other._arrays = []
+        for (name, code), column in zip(self._COLUMNS, self._arrays):
+            duplicate = array(code, column)
+            setattr(other, name, duplicate)
+            other._arrays.append(duplicate)
+        other._free = list(self._free)
+        other.points = dict(self.points)
+        return other
+
+    def entry(self, index):
+        """
+        Return row ``index`` as a saved entry (JSON schema dict).
+
+        The item position is folded into the coordinates, so "x"/"y" are
+        where the shape's geometry sits in the scene.
+        """
+        kind = self.kind[index]
+        pos_x, pos_y = self.pos_x[index], self.pos_y[index]
+        group_id = self.group[index]
+        style = self.style[index]
+        entry = {
+            "type": KIND_NAMES[kind],
+            "x": self.x[index] + pos_x,
+            "y": self.y[index] + pos_y,
+            "rotation": self.rotation[index],
+            "scale_x": self.scale[index],
+            "fill_color": _unpack_color(self.styles.fill[style]),
+            "border_color": _unpack_color(self.styles.border[style]),
+            "group_id": None if group_id == NO_GROUP else group_id,
+        }
+        if kind == KIND_LINE:
+            entry["x2"] = self.a[index] + pos_x
+            entry["y2"] = self.b[index] + pos_y
+        elif kind == KIND_SQUARE:
+            entry["width"] = self.a[index]
+        else:
+            entry["width"] = self.a[index]
+            entry["height"] = self.b[index]
+        if kind == KIND_POLYLINE:
+            entry["points"] = encode_points(self.points[index])
+        return entry
+
+    def add_entry(self, entry):
+        """
+        Add a row for a saved entry (the inverse of entry()) and return its
+        index, or None if the entry is not a shape this store can hold.
+        """
+        kind = KIND_CODES.get(entry["type"])
+        if kind is None:
+            return None
+        if kind == KIND_LINE:
+            a, b = entry["x2"], entry["y2"]
+        else:
+            a = entry["width"]
+            b = entry.get("height", a)
+        index = self.allocate(kind, entry["x"], entry["y"], a, b, (0, 0, 0))
+        self.style[index] = self.styles.for_colors(entry["fill_color"], entry["border_color"])
+        group_id = entry.get("group_id")
+        self.group[index] = NO_GROUP if group_id is None else group_id
+        self.rotation[index] = entry["rotation"]
+        self.scale[index] = entry["scale_x"]
+        if kind == KIND_POLYLINE:
+            self.points[index] = decode_points(entry["points"])
+        return index
+
+    def set_transform(self, index, pos_x, pos_y, rotation, scale):
+        """Set the item transform of one shape."""
+        self.pos_x[index] = pos_x
+        self.pos_y[index] = pos_y
+        self.rotation[index] = rotation
+        self.scale[index] = scale
+        self._moved((index,))
+
+    def adopt(self, shape):
+        """Move a shape view (and its row) into this store."""
+        if shape._store is self:
+            return shape
+        old_store, old_index = shape._store, shape._index
+        shape._index = self.copy_row(old_store, old_index)
+        shape._store = self
+        old_store.release(old_index)
+        return shape
+
+    def adopt_many(self, shapes):
+        """
+        Move many shape views (and their rows) into this store at once.
+
+        Rows are copied a column at a time and appended, so this is much
+        cheaper than calling adopt() per shape for large batches.
+        """
+        by_store = {}
+        for shape in shapes:
+            if shape._store is not self:
+                by_store.setdefault(id(shape._store), []).append(shape)
+        for moving in by_store.values():
+            source = moving[0]._store
+            indices = [shape._index for shape in moving]
+            start = len(self.kind)
+            if numpy is not None:
+                idx = numpy.asarray(indices, dtype=numpy.intp)
+                for (name, _), column in zip(self._COLUMNS, self._arrays):
+                    column.frombytes(source._vector(name)[idx].tobytes())
+            else:
+                for column, source_column in zip(self._arrays, source._arrays):
+                    column.extend(source_column[i] for i in indices)
+            if source.styles is not self.styles:
+                style = self.style
+                for row in range(start, len(style)):
+                    style[row] = self._styleFrom(source, style[row])
+            for offset, shape in enumerate(moving):
+                shape._store = self
+                shape._index = start + offset
+                if shape.KIND == KIND_POLYLINE:
+                    self.points[start + offset] = source.points[indices[offset]]
+            self._moved(range(start, start + len(moving)))
+            for index in indices:
+                source.release(index)
+
+    def _vector(self, name):
+        column = getattr(self, name)
+        return numpy.frombuffer(column, dtype=column.typecode)
+
+    def translate(self, indices, dx, dy):
+        """Move the given shapes by (dx, dy)."""
+        if not indices:
+            return
+        self._moved(indices)
+        if numpy is not None:
+            idx = numpy.asarray(indices, dtype=numpy.intp)
+            self._vector("pos_x")[idx] += dx
+            self._vector("pos_y")[idx] += dy
+            return
+        pos_x, pos_y = self.pos_x, self.pos_y
+        for i in indices:
+            pos_x[i] += dx
+            pos_y[i] += dy
+
+    def rotate(self, indices, angle, pivot=None):
+        """
+        Add ``angle`` degrees to the rotation of the given shapes. With a
+        ``pivot`` (x, y) their centers also turn about it, so the shapes
+        rotate together as one.
+        """
+        if not indices:
+            return
+        self._moved(indices)
+        if pivot is not None:
+            self._orbit(indices, pivot, angle=angle)
+        if numpy is not None:
+            idx = numpy.asarray(indices, dtype=numpy.intp)
+            self._vector("rotation")[idx] += angle
+            return
+        rotation = self.rotation
+        for i in indices:
+            rotation[i] += angle
+
+    def _orbit(self, indices, pivot, angle=0.0, factor=1.0):
+        """
+        Move the given shapes so their centers are rotated by ``angle`` and
+        scaled by ``factor`` about ``pivot``.
+        """
+        px, py = pivot
+        radians = math.radians(angle)
+        cos, sin = math.cos(radians) * factor, math.sin(radians) * factor
+        if numpy is not None:
+            idx = numpy.asarray(indices, dtype=numpy.intp)
+            x, y = self._vector("x")[idx], self._vector("y")[idx]
+            a, b = self._vector("a")[idx], self._vector("b")[idx]
+            line = self._vector("kind")[idx] == KIND_LINE
+            pos_x, pos_y = self._vector("pos_x"), self._vector("pos_y")
+            dx = pos_x[idx] + numpy.where(line, (x + a) / 2, x + a / 2) - px
+            dy = pos_y[idx] + numpy.where(line, (y + b) / 2, y + b / 2) - py
+            pos_x[idx] += dx * cos - dy * sin - dx
+            pos_y[idx] += dx * sin + dy * cos - dy
+            return
+        x, y, a, b, kind = self.x, self.y, self.a, self.b, self.kind
+        pos_x, pos_y = self.pos_x, self.pos_y
+        for i in indices:
+            if kind[i] == KIND_LINE:
+                cx, cy = (x[i] + a[i]) / 2, (y[i] + b[i]) / 2
+            else:
+                cx, cy = x[i] + a[i] / 2, y[i] + b[i] / 2
+            dx, dy = pos_x[i] + cx - px, pos_y[i] + cy - py
+            pos_x[i] += dx * cos - dy * sin - dx
+            pos_y[i] += dx * sin + dy * cos - dy
+
+    def resize(self, indices, factor, pivot=None):
+        """
+        Scale the geometry of the given shapes about their centers. With a
+        ``pivot`` (x, y) the distances of their centers from it are scaled
+        too, so the shapes scale together as one.
+        """
+        if not indices:
+            return
+        self._moved(indices)
+        if pivot is not None:
+            self._orbit(indices, pivot, factor=factor)
+        if self.points:
+            self._resizePoints(indices, factor)
+        if numpy is not None:
+            idx = numpy.asarray(indices, dtype=numpy.intp)
+            x, y = self._vector("x"), self._vector("y")
+            a, b = self._vector("a"), self._vector("b")
+            line = self._vector("kind")[idx] == KIND_LINE
+            xi, yi, ai, bi = x[idx], y[idx], a[idx], b[idx]
+            cx = numpy.where(line, (xi + ai) / 2, xi + ai / 2)
+            cy = numpy.where(line, (yi + bi) / 2, yi + bi / 2)
+            x[idx] = cx + (xi - cx) * factor
+            y[idx] = cy + (yi - cy) * factor
+            a[idx] = numpy.where(line, cx + (ai - cx) * factor, ai * factor)
+            b[idx] = numpy.where(line, cy + (bi - cy) * factor, bi * factor)
+            return
+        x, y, a, b, kind = self.x, self.y, self.a, self.b, self.kind
+        for i in indices:
+            if kind[i] == KIND_LINE:
+                cx, cy = (x[i] + a[i]) / 2, (y[i] + b[i]) / 2
+                a[i] = cx + (a[i] - cx) * factor
+                b[i] = cy + (b[i] - cy) * factor
+            else:
+                cx, cy = x[i] + a[i] / 2, y[i] + b[i] / 2
+                a[i] *= factor
+                b[i] *= factor
+            x[i] = cx + (x[i] - cx) * factor
+            y[i] = cy + (y[i] - cy) * factor
+
+    def _resizePoints(self, indices, factor):
+        points = self.points
+        for i in indices:
+            offsets = points.get(i)
+            if offsets is None:
+                continue
+            if numpy is not None:
+                scaled = numpy.frombuffer(offsets, dtype=numpy.float32) * factor
+                points[i] = array("f", scaled.astype(numpy.float32).tobytes())
+            else:
+                points[i] = array("f", [value * factor for value in offsets])
+
+    def bounds(self):
+        """
+        Scene-space bounding boxes of every row, as (x0, y0, x1, y1).
+
+        Boxes include position, rotation and scale (about the geometry
+        center, like the graphics items) and half the pen width. They are
+        NumPy arrays when NumPy is installed, lists otherwise; rows that
+        have been released hold stale values.
+        """
+        if numpy is not None:
+            x, y = self._vector("x"), self._vector("y")
+            a, b = self._vector("a"), self._vector("b")
+            line = self._vector("kind") == KIND_LINE
+            width = numpy.where(line, numpy.abs(a - x), a)
+            height = numpy.where(line, numpy.abs(b - y), b)
+            cx = self._vector("pos_x") + numpy.where(line, (x + a) / 2, x + a / 2)
+            cy = self._vector("pos_y") + numpy.where(line, (y + b) / 2, y + b / 2)
+            scale = numpy.abs(self._vector("scale"))
+            radians = numpy.radians(self._vector("rotation"))
+            cos, sin = numpy.abs(numpy.cos(radians)), numpy.abs(numpy.sin(radians))
+            widths = numpy.frombuffer(self.styles.stroke_width, dtype=numpy.float32)
+            pad = widths[self._vector("style")] / 2
+            half_w = (width / 2 + pad) * scale
+            half_h = (height / 2 + pad) * scale
+            extent_x = half_w * cos + half_h * sin
+            extent_y = half_w * sin + half_h * cos
+            return cx - extent_x, cy - extent_y, cx + extent_x, cy + extent_y
+        x0, y0, x1, y1 = [], [], [], []
+        for i in range(len(self.kind)):
+            x0_i, y0_i, x1_i, y1_i = self.row_bounds(i)
+            x0.append(x0_i)
+            y0.append(y0_i)
+            x1.append(x1_i)
+            y1.append(y1_i)
+        return x0, y0, x1, y1
+
+    def row_bounds(self, index):
+        """Scene-space bounding box of one row, as in bounds()."""
+        x, y, a, b = self.x[index], self.y[index], self.a[index], self.b[index]
+        if self.kind[index] == KIND_LINE:
+            width, height = abs(a - x), abs(b - y)
+            cx, cy = (x + a) / 2, (y + b) / 2
+        else:
+            width, height = a, b
+            cx, cy = x + a / 2, y + b / 2
+        cx += self.pos_x[index]
+        cy += self.pos_y[index]
+        scale = abs(self.scale[index])
+        radians = math.radians(self.rotation[index])
+        cos, sin = abs(math.cos(radians)), abs(math.sin(radians))
+        pad = self.styles.stroke_width[self.style[index]] / 2
+        half_w = (width / 2 + pad) * scale
+        half_h = (height / 2 + pad) * scale
+        extent_x = half_w * cos + half_h * sin
+        extent_y = half_w * sin + half_h * cos
+        return cx - extent_x, cy - extent_y, cx + extent_x, cy + extent_y
+
+    def restyle(self, indices, **changes):
+        """
+        Give the given shapes their current style with some values replaced
+        (see StyleTable.restyled); each distinct old style is looked up once.
+        """
+        if not indices:
+            return
+        if "stroke_width" in changes:
+            self._moved(indices)
+        style, restyled = self.style, {}
+        for i in indices:
+            old = style[i]
+            new = restyled.get(old)
+            if new is None:
+                new = restyled[old] = self.styles.restyled(old, **changes)
+            style[i] = new
+
+    def set_fill(self, indices, color):
+        """Set the fill color of the given shapes."""
+        self.restyle(indices, fill=_pack_color(color))
+
+    def fills(self, indices):
+        """Packed 0xRRGGBB fill colors of the given shapes."""
+        fill, style = self.styles.fill, self.style
+        return array("I", [fill[style[i]] for i in indices])
+
+    def set_fills(self, indices, fills):
+        """Set each shape's fill to the matching packed 0xRRGGBB value."""
+        style, restyled = self.style, {}
+        for i, packed in zip(indices, fills):
+            key = (style[i], packed)
+            new = restyled.get(key)
+            if new is None:
+                new = restyled[key] = self.styles.restyled(style[i], fill=packed)
+            style[i] = new
+
+
+default_store = ShapeStore()
+
+
+# Columns that affect a shape's bounding box.
+_GEOMETRY_COLUMNS = frozenset(("x", "y", "a", "b", "pos_x", "pos_y", "rotation", "scale"))
+
+
+def _column_property(name, doc):
+    def fget(self):
+        return getattr(self._store, name)[self._index]
+
+    def fset(self, value):
+        getattr(self._store, name)[self._index] = value
+
+    def fset_geometry(self, value):
+        store = self._store
+        getattr(store, name)[self._index] = value
+        if store.spatial is not None:
+            store.spatial.invalidate_row(self._index)
+
+    if name in _GEOMETRY_COLUMNS:
+        return property(fget, fset_geometry, doc=doc)
+    return property(fget, fset, doc=doc)
+
+
+def _style_property(name, doc, color=False):
+    def fget(self):
+        store = self._store
+        value = getattr(store.styles, name)[store.style[self._index]]
+        return _unpack_color(value) if color else value
+
+    def fset(self, value):
+        self._store.restyle((self._index,), **{name: _pack_color(value) if color else value})
+
+    return property(fget, fset, doc=doc)
+
 
 class ShapeBase:
     """
     Base class for all shapes.
 
-    Contains shared attributes like selection state and group ID.
+    A shape is a thin view onto one row of a ShapeStore (the module's
+    ``default_store`` unless another is given); all of its attributes,
+    including selection state and group ID, live in the store's columns.
     """
 
-    def __init__(self):
-        self.selected = False
-        self.group_id = None
+    __slots__ = ("_store", "_index")
+
+    KIND = None
+
+    def __init__(self, x, y, a, b, fill, store=None):
+        self._store = default_store if store is None else store
+        self._index = self._store.allocate(self.KIND, x, y, a, b, fill)
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def shape(self):
+        """The shape itself, so a bare shape can be a Document member."""
+        return self
+
+    x = _column_property("x", "Left edge (or first x for lines).")
+    y = _column_property("y", "Top edge (or first y for lines).")
+    pos_x = _column_property("pos_x", "Item position, x.")
+    pos_y = _column_property("pos_y", "Item position, y.")
+    rotation = _column_property("rotation", "Rotation in degrees.")
+    scale = _column_property("scale", "Item scale factor.")
+    style = _column_property("style", "Index of the shape's entry in its store's StyleTable.")
+    alpha = _style_property("alpha", "Opacity, 0-255.")
+    stroke_width = _style_property("stroke_width", "Pen width.")
+    fill_color = _style_property("fill", "Fill color as an (r, g, b) tuple.", color=True)
+    border_color = _style_property("border", "Border color as an (r, g, b) tuple.", color=True)
+
+    @property
+    def selected(self):
+        return bool(self._store.selected[self._index])
+
+    @selected.setter
+    def selected(self, value):
+        self._store.selected[self._index] = bool(value)
+
+    @property
+    def group_id(self):
+        group = self._store.group[self._index]
+        return None if group == NO_GROUP else group
+
+    @group_id.setter
+    def group_id(self, value):
+        self._store.group[self._index] = NO_GROUP if value is None else value
 
 
 import math
@@ -65,7 +763,10 @@ class PolygonWithLines(QGraphicsItemGroup):
                 line_item.setPen(QPen(QColor(0, 0, 0)))
                 self.addToGroup(line_item)
                 self.lines.append(line_item)
-                line_item.shape = self
+                # A weak reference: the group already owns its lines, and a
+                # strong one back would keep the group and its lines alive
+                # in a reference cycle after it is removed.
+                line_item.shape = weakref.proxy(self)
 
         # Enable interaction for the group (selection and movement)
         self.setFlags(
@@ -122,16 +823,15 @@ class RectangleShape(ShapeBase):
     A rectangle shape with position, dimensions, and style attributes.
     """
 
-    def __init__(self, x, y, w, h, fill=(255, 255, 255)):
-        super().__init__()
-        self.x = float(x)
-        self.y = float(y)
-        self.width = float(w)
-        self.height = float(h)
-        self.fill_color = fill
-        self.border_color = (255, 255, 255)
-        self.stroke_width = 2
-        self.alpha = 255
+    __slots__ = ()
+
+    KIND = KIND_RECTANGLE
+
+    def __init__(self, x, y, w, h, fill=(255, 255, 255), store=None):
+        super().__init__(x, y, w, h, fill, store)
+
+    width = _column_property("a", "Width.")
+    height = _column_property("b", "Height.")
 
 
 class EllipseShape(ShapeBase):
@@ -139,16 +839,15 @@ class EllipseShape(ShapeBase):
     An ellipse shape defined by bounding box dimensions and styling.
     """
 
-    def __init__(self, x, y, w, h, fill=(255, 255, 255)):
-        super().__init__()
-        self.x = float(x)
-        self.y = float(y)
-        self.width = float(w)
-        self.height = float(h)
-        self.fill_color = fill
-        self.border_color = (255, 255, 255)
-        self.stroke_width = 2
-        self.alpha = 255
+    __slots__ = ()
+
+    KIND = KIND_ELLIPSE
+
+    def __init__(self, x, y, w, h, fill=(255, 255, 255), store=None):
+        super().__init__(x, y, w, h, fill, store)
+
+    width = _column_property("a", "Width.")
+    height = _column_property("b", "Height.")
 
 
 class SquareShape(RectangleShape):
@@ -157,8 +856,12 @@ class SquareShape(RectangleShape):
     but ensures equal width and height.
     """
 
-    def __init__(self, x, y, size, fill=(255, 255, 255)):
-        super().__init__(x, y, size, size, fill)
+    __slots__ = ()
+
+    KIND = KIND_SQUARE
+
+    def __init__(self, x, y, size, fill=(255, 255, 255), store=None):
+        super().__init__(x, y, size, size, fill, store)
 
 
 class LineShape(ShapeBase):
@@ -166,13 +869,51 @@ class LineShape(ShapeBase):
     A line defined by two endpoints and color/stroke settings.
     """
 
-    def __init__(self, x1, y1, x2, y2, fill=(255, 255, 255)):
-        super().__init__()
-        self.x = float(x1)
-        self.y = float(y1)
-        self.x2 = float(x2)
-        self.y2 = float(y2)
-        self.fill_color = fill
-        self.border_color = (255, 255, 255)
-        self.stroke_width = 2
-        self.alpha = 255
+    __slots__ = ()
+
+    KIND = KIND_LINE
+
+    def __init__(self, x1, y1, x2, y2, fill=(255, 255, 255), store=None):
+        super().__init__(x1, y1, x2, y2, fill, store)
+
+    x2 = _column_property("a", "Second endpoint, x.")
+    y2 = _column_property("b", "Second endpoint, y.")
+
+
+class PolylineShape(ShapeBase):
+    """
+    An open polyline, such as a freehand stroke, drawn in its fill color.
+
+    ``points`` are interleaved x, y pairs in scene coordinates; they are
+    stored packed, relative to the top-left corner of their bounding box.
+    """
+
+    __slots__ = ()
+
+    KIND = KIND_POLYLINE
+
+    def __init__(self, points, fill=(0, 0, 0), store=None):
+        xs, ys = points[0::2], points[1::2]
+        x, y = min(xs), min(ys)
+        super().__init__(x, y, max(xs) - x, max(ys) - y, fill, store)
+        offsets = array("f", points)
+        for i in range(0, len(offsets), 2):
+            offsets[i] -= x
+            offsets[i + 1] -= y
+        self._store.points[self._index] = offsets
+
+    @classmethod
+    def packed(cls, x, y, width, height, offsets, fill=(0, 0, 0), store=None):
+        """A polyline from its bounding box and packed offsets (as saved)."""
+        shape = cls.__new__(cls)
+        ShapeBase.__init__(shape, x, y, width, height, fill, store)
+        shape._store.points[shape._index] = offsets
+        return shape
+
+    width = _column_property("a", "Bounding box width.")
+    height = _column_property("b", "Bounding box height.")
+
+    @property
+    def points(self):
+        """Packed ``array("f")`` of x, y offsets from (x, y); do not modify."""
+        return self._store.points[self._index]
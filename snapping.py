@@ -0,0 +1,344 @@
+"""
+Snapping of dragged shapes to a grid and to other shapes.
+
+SnapIndex keeps, for each axis, the edges and centers of every shape's
+scene-space bounding box (see ``ShapeStore.bounds``) in one sorted array,
+next to an array of the rows they belong to. Finding what a dragged box
+would snap to is then a binary search per edge and center of the box,
+so a drag step costs O(log n) however large the drawing is.
+
+The index follows the store's SpatialIndex: rows whose bounds change are
+marked dirty and re-inserted (a binary search and an array insertion
+each) the next time the index is queried. Large batches of changes
+rebuild the arrays with one sort, vectorized when NumPy is installed.
+The shapes being dragged are excluded from the index for the length of
+the drag, so they never snap to themselves.
+"""
+
+import math
+from array import array
+from bisect import bisect_left
+
+from shapes import numpy
+from spatial import SpatialIndex
+
+# How close (in device pixels) a dragged edge or center has to come to a
+# guide or grid line to snap to it.
+SNAP_PIXELS = 6
+
+# Spacing of the snapping grid, in scene units.
+GRID_SIZE = 20
+
+# Rebuild the sorted arrays instead of updating rows one by one once more
+# than this fraction of the rows has changed.
+REBUILD_FRACTION = 0.05
+
+# Rows that are always updated one by one, however small the index.
+MIN_REBUILD_ROWS = 64
+
+# Keys per chunk of a sorted axis (chunks split at twice this size).
+CHUNK_SIZE = 512
+
+
+def _array(code, values):
+    # NumPy arrays are copied as raw memory rather than value by value.
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        return array(code, values.tobytes())
+    return array(code, values)
+
+
+def _keys(x0, x1):
+    # Snap keys of one axis of a box: both edges and the center.
+    return (x0, (x0 + x1) / 2, x1)
+
+
+class _Axis:
+    """
+    Sorted snap keys of one axis and the row of each key.
+
+    Keys are kept in chunks of about CHUNK_SIZE (each a pair of arrays
+    holding keys and rows) plus a list of each chunk's largest key, so an
+    insertion or removal shifts one small chunk rather than every key.
+    """
+
+    __slots__ = ("chunks", "maxes")
+
+    def __init__(self, values=(), rows=()):
+        self.chunks = []
+        self.maxes = []
+        for start in range(0, len(values), CHUNK_SIZE):
+            chunk = (
+                _array("d", values[start : start + CHUNK_SIZE]),
+                _array("q", rows[start : start + CHUNK_SIZE]),
+            )
+            self.chunks.append(chunk)
+            self.maxes.append(chunk[0][-1])
+
+    def insert(self, row, keys):
+        chunks, maxes = self.chunks, self.maxes
+        for value in keys:
+            if not chunks:
+                chunks.append((array("d", [value]), array("q", [row])))
+                maxes.append(value)
+                continue
+            k = min(bisect_left(maxes, value), len(maxes) - 1)
+            values, rows = chunks[k]
+            i = bisect_left(values, value)
+            values.insert(i, value)
+            rows.insert(i, row)
+            maxes[k] = values[-1]
+            if len(values) > 2 * CHUNK_SIZE:
+                chunks.insert(k + 1, (values[CHUNK_SIZE:], rows[CHUNK_SIZE:]))
+                maxes.insert(k + 1, values[-1])
+                del values[CHUNK_SIZE:]
+                del rows[CHUNK_SIZE:]
+                maxes[k] = values[-1]
+
+    def remove(self, row, keys):
+        chunks, maxes = self.chunks, self.maxes
+        for value in keys:
+            # Equal keys may run on into the following chunks.
+            k = bisect_left(maxes, value)
+            while True:
+                values, rows = chunks[k]
+                i = bisect_left(values, value)
+                while i < len(values) and rows[i] != row:
+                    i += 1
+                if i < len(values):
+                    break
+                k += 1
+            del values[i]
+            del rows[i]
+            if values:
+                maxes[k] = values[-1]
+            else:
+                del chunks[k]
+                del maxes[k]
+
+    def nearest(self, value, tolerance):
+        """(key, row) closest to ``value`` within ``tolerance``, or None."""
+        chunks, maxes = self.chunks, self.maxes
+        k = bisect_left(maxes, value)
+        # The first key >= value and the one before it.
+        candidates = []
+        i = 0
+        if k < len(chunks):
+            values, rows = chunks[k]
+            i = bisect_left(values, value)
+            candidates.append((values[i], rows[i]))
+        if i:
+            candidates.append((values[i - 1], rows[i - 1]))
+        elif k:
+            values, rows = chunks[k - 1]
+            candidates.append((values[-1], rows[-1]))
+        best = None
+        for key, row in candidates:
+            distance = abs(key - value)
+            if distance <= tolerance and (best is None or distance < best[0]):
+                best = (distance, key, row)
+        if best is None:
+            return None
+        return best[1:]
+
+
+class SnapIndex:
+    """
+    Sorted per-axis indexes of the edges and centers of a store's shapes.
+
+    Creating an index makes it follow the store's SpatialIndex (which is
+    created if the store has none); call ``detach()`` to stop. A
+    SpatialIndex created here is detached from the store with it.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._owns_spatial = store.spatial is None
+        self.spatial = store.spatial or SpatialIndex(store)
+        self.spatial.listeners.append(self)
+        self._excluded = set()
+        self._dirty = set()
+        self.reset()
+        self.invalidate(store.rows())
+
+    def detach(self):
+        """Stop following the store's changes."""
+        self.spatial.listeners.remove(self)
+        if self._owns_spatial and not self.spatial.listeners:
+            self.spatial.detach()
+
+    def reset(self):
+        """Forget every row (the store has been cleared)."""
+        self.x = _Axis()
+        self.y = _Axis()
+        # Bounds each row was indexed with (by row; ``_indexed`` flags the
+        # rows in the axes), so its keys can be found once it has changed.
+        self._bounds = tuple(array("d") for _ in range(4))
+        self._indexed = bytearray()
+        self._count = 0
+        self._dirty.clear()
+        self._excluded.clear()
+
+    def invalidate(self, rows):
+        """Mark rows whose bounds changed (or that were added)."""
+        self._dirty.update(rows)
+
+    def invalidate_row(self, row):
+        self._dirty.add(row)
+
+    def discard(self, row):
+        """Drop a released row."""
+        self._dirty.discard(row)
+        self._excluded.discard(row)
+        self._remove(row)
+
+    def exclude(self, rows):
+        """Leave rows out of snapping (the shapes being dragged)."""
+        self._excluded.update(rows)
+        self._dirty.update(rows)
+
+    def include(self, rows):
+        """Bring excluded rows back, with their current bounds."""
+        self._excluded.difference_update(rows)
+        self._dirty.update(rows)
+
+    def __len__(self):
+        self._flush()
+        return self._count
+
+    def snap(self, box, tolerance):
+        """
+        Snap a box (x0, y0, x1, y1) to the nearest shape edges or centers.
+
+        Returns (dx, dy, guides): the offset that lines the box up and, for
+        each axis that snapped, a guide ("x" or "y", coordinate, row of the
+        shape it lines up with). Axes with nothing within ``tolerance``
+        scene units get a zero offset and no guide.
+        """
+        self._flush()
+        x0, y0, x1, y1 = box
+        dx, guide_x = self._snapAxis(self.x, _keys(x0, x1), tolerance)
+        dy, guide_y = self._snapAxis(self.y, _keys(y0, y1), tolerance)
+        guides = []
+        if guide_x is not None:
+            guides.append(("x",) + guide_x)
+        if guide_y is not None:
+            guides.append(("y",) + guide_y)
+        return dx, dy, guides
+
+    @staticmethod
+    def _snapAxis(axis, keys, tolerance):
+        best = None
+        for key in keys:
+            found = axis.nearest(key, tolerance)
+            if found is not None:
+                offset = found[0] - key
+                if best is None or abs(offset) < abs(best[0]):
+                    best = (offset, found)
+        if best is None:
+            return 0.0, None
+        return best
+
+    def _remove(self, row):
+        if row < len(self._indexed) and self._indexed[row]:
+            x0, y0, x1, y1 = (column[row] for column in self._bounds)
+            self.x.remove(row, _keys(x0, x1))
+            self.y.remove(row, _keys(y0, y1))
+            self._indexed[row] = 0
+            self._count -= 1
+
+    def _insert(self, row, x0, y0, x1, y1):
+        if not math.isfinite(x0 + y0 + x1 + y1):
+            return  # degenerate geometry is never snapped to
+        indexed = self._indexed
+        if row >= len(indexed):
+            grow = row + 1 - len(indexed)
+            indexed.extend(bytes(grow))
+            for column in self._bounds:
+                column.extend([0.0] * grow)
+        for column, value in zip(self._bounds, (x0, y0, x1, y1)):
+            column[row] = value
+        indexed[row] = 1
+        self._count += 1
+        self.x.insert(row, _keys(x0, x1))
+        self.y.insert(row, _keys(y0, y1))
+
+    def _flush(self):
+        dirty = self._dirty
+        if not dirty:
+            return
+        if len(dirty) > max(REBUILD_FRACTION * self._count, MIN_REBUILD_ROWS):
+            self.rebuild()
+            return
+        row_bounds = self.store.row_bounds
+        excluded = self._excluded
+        for row in dirty:
+            self._remove(row)
+            if row not in excluded:
+                self._insert(row, *row_bounds(row))
+        dirty.clear()
+
+    def rebuild(self):
+        """Rebuild both axes from every row of the store."""
+        self._dirty.clear()
+        store = self.store
+        size = len(store.kind)
+        rows = store.rows()
+        if self._excluded:
+            rows = [row for row in rows if row not in self._excluded]
+        bounds = store.bounds()
+        if numpy is None:
+            self._bounds = tuple(array("d", column) for column in bounds)
+            x0, y0, x1, y1 = bounds
+            rows = [
+                row
+                for row in rows
+                if math.isfinite(x0[row] + y0[row] + x1[row] + y1[row])
+            ]
+            entries_x, entries_y = [], []
+            for row in rows:
+                entries_x.extend((value, row) for value in _keys(x0[row], x1[row]))
+                entries_y.extend((value, row) for value in _keys(y0[row], y1[row]))
+            entries_x.sort()
+            entries_y.sort()
+            self.x = _Axis([value for value, _ in entries_x], [row for _, row in entries_x])
+            self.y = _Axis([value for value, _ in entries_y], [row for _, row in entries_y])
+            indexed = bytearray(size)
+            for row in rows:
+                indexed[row] = 1
+        else:
+            self._bounds = tuple(array("d", column.tobytes()) for column in bounds)
+            x0, y0, x1, y1 = bounds
+            rows = numpy.asarray(rows, dtype=numpy.int64)
+            rows = rows[numpy.isfinite(x0[rows] + y0[rows] + x1[rows] + y1[rows])]
+            self.x = self._sortedAxis(rows, x0[rows], x1[rows])
+            self.y = self._sortedAxis(rows, y0[rows], y1[rows])
+            flags = numpy.zeros(size, dtype=numpy.uint8)
+            flags[rows] = 1
+            indexed = bytearray(flags.tobytes())
+        self._indexed = indexed
+        self._count = len(rows)
+
+    @staticmethod
+    def _sortedAxis(rows, low, high):
+        values = numpy.concatenate((low, (low + high) / 2, high))
+        owners = numpy.concatenate((rows, rows, rows))
+        order = numpy.argsort(values, kind="stable")
+        return _Axis(values[order], owners[order])
+
+
+def snap_to_grid(box, grid, tolerance):
+    """
+    Offset (dx, dy) that puts the nearest edge or center of a box on grid
+    lines ``grid`` scene units apart, per axis; zero where no edge or
+    center is within ``tolerance`` of a grid line.
+    """
+    x0, y0, x1, y1 = box
+    offsets = []
+    for keys in (_keys(x0, x1), _keys(y0, y1)):
+        best = None
+        for key in keys:
+            offset = round(key / grid) * grid - key
+            if abs(offset) <= tolerance and (best is None or abs(offset) < abs(best)):
+                best = offset
+        offsets.append(0.0 if best is None else best)
+    return tuple(offsets)
@@ -0,0 +1,413 @@
+"""
+Spatial index over the shapes of a ShapeStore.
+
+SpatialIndex answers "which shapes are at this point / in this rect" and
+"which shape is nearest to this point" from the model alone, without a
+scene or a window. It is a loose quadtree over each row's scene-space
+bounding box (position, rotation and scale included, see
+``ShapeStore.bounds``): a shape lives in the deepest node whose cell
+contains its center and is at least as large as the shape, and a node's
+loose bounds (its cell grown by half a cell on every side) contain
+everything stored in it.
+
+The store reports changed rows to the index it is attached to, and the
+index re-inserts them the next time it is queried, so moving, rotating or
+scaling shapes costs O(changed shapes). Large batches of changes (such as
+loading a document) rebuild the tree in one vectorized pass when NumPy is
+installed.
+
+Other indexes over the same rows (such as the snapping index) add
+themselves to ``listeners`` and are told about the same changes.
+"""
+
+import math
+from array import array
+
+from shapes import KIND_LINE, KIND_POLYLINE, numpy
+
+# Rows a leaf holds before it is split.
+NODE_CAPACITY = 64
+
+# Cells are not split below this half-size (scene units).
+MIN_HALF_SIZE = 1.0
+
+# Depth limit of the vectorized rebuild (Z-order codes use 2 bits a level).
+MAX_DEPTH = 24
+
+# Rebuild the whole tree instead of updating rows one by one once more
+# than this fraction of the rows has changed.
+REBUILD_FRACTION = 0.25
+
+
+class _Node:
+    __slots__ = ("cx", "cy", "half", "rows", "children")
+
+    def __init__(self, cx, cy, half):
+        self.cx = cx
+        self.cy = cy
+        self.half = half
+        self.rows = []
+        self.children = None
+
+    def child_for(self, x, y):
+        return self.children[(x >= self.cx) + 2 * (y >= self.cy)]
+
+    def split(self):
+        quarter = self.half / 2
+        self.children = [
+            _Node(self.cx + dx * quarter, self.cy + dy * quarter, quarter)
+            for dy in (-1, 1)
+            for dx in (-1, 1)
+        ]
+
+
+class SpatialIndex:
+    """
+    Loose quadtree over the bounding boxes of a store's rows.
+
+    Creating an index attaches it to the store, which keeps it up to date
+    until ``detach()``. Queries return row indices.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.listeners = []
+        self._dirty = set()
+        self._reset()
+        self.invalidate(store.rows())
+        store.spatial = self
+
+    def detach(self):
+        """Stop the store from reporting its changes to this index."""
+        if self.store.spatial is self:
+            self.store.spatial = None
+
+    def __len__(self):
+        self._flush()
+        return self._count
+
+    def reset(self):
+        """Forget every row (the store has been cleared)."""
+        self._reset()
+        for listener in self.listeners:
+            listener.reset()
+
+    def _reset(self):
+        self._root = None
+        self._node_of = []
+        self._count = 0
+        self._x0, self._y0 = array("d"), array("d")
+        self._x1, self._y1 = array("d"), array("d")
+        self._extent = None
+        self._dirty.clear()
+
+    def invalidate(self, rows):
+        """Mark rows whose bounds changed (or that were added)."""
+        self._dirty.update(rows)
+        for listener in self.listeners:
+            listener.invalidate(rows)
+
+    def invalidate_row(self, row):
+        self._dirty.add(row)
+        for listener in self.listeners:
+            listener.invalidate_row(row)
+
+    def discard(self, row):
+        """Drop a released row."""
+        self._dirty.discard(row)
+        self._remove(row)
+        for listener in self.listeners:
+            listener.discard(row)
+
+    def extent(self):
+        """
+        Box (x0, y0, x1, y1) covering every shape indexed since the last
+        rebuild, or None if there are none. Like a graphics scene's rect,
+        it grows but does not shrink as shapes move or are removed.
+        """
+        self._flush()
+        return self._extent
+
+    def query_rect(self, x0, y0, x1, y1):
+        """Rows whose bounding boxes intersect the rect."""
+        self._flush()
+        result = []
+        if self._root is None:
+            return result
+        bx0, by0, bx1, by1 = self._x0, self._y0, self._x1, self._y1
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            reach = 2 * node.half
+            if (
+                node.cx - reach > x1
+                or node.cx + reach < x0
+                or node.cy - reach > y1
+                or node.cy + reach < y0
+            ):
+                continue
+            for row in node.rows:
+                if bx1[row] >= x0 and bx0[row] <= x1 and by1[row] >= y0 and by0[row] <= y1:
+                    result.append(row)
+            if node.children is not None:
+                stack.extend(node.children)
+        return result
+
+    def query_point(self, x, y, tolerance=0.0):
+        """
+        Rows of the shapes under a point, within ``tolerance`` scene units.
+
+        Boxes are only used to find candidates: each one is tested against
+        its shape's outline in its own rotated and scaled frame, so a thin
+        diagonal line (or a polyline) is only hit near the line itself.
+        Ellipses are hit tested as their rectangles.
+        """
+        candidates = self.query_rect(x - tolerance, y - tolerance, x + tolerance, y + tolerance)
+        return [row for row in candidates if self.distance(row, x, y) <= tolerance]
+
+    def nearest(self, x, y, max_distance):
+        """
+        Row of the shape closest to a point, or None if none is within
+        ``max_distance``. Distances are measured as in query_point().
+        """
+        best, best_distance = None, max_distance
+        for row in self.query_rect(x - max_distance, y - max_distance, x + max_distance, y + max_distance):
+            distance = self.distance(row, x, y)
+            if distance <= best_distance:
+                best, best_distance = row, distance
+        return best
+
+    def distance(self, row, x, y):
+        """Distance from a point to a shape's outline (0 inside it)."""
+        store = self.store
+        sx, sy, a, b = store.x[row], store.y[row], store.a[row], store.b[row]
+        line = store.kind[row] == KIND_LINE
+        if line:
+            cx, cy = (sx + a) / 2, (sy + b) / 2
+        else:
+            cx, cy = sx + a / 2, sy + b / 2
+        # Map the point into the shape's local frame: undo the position,
+        # then rotate and scale about the geometry center.
+        scale = store.scale[row] or 1.0
+        radians = math.radians(store.rotation[row])
+        cos, sin = math.cos(radians), math.sin(radians)
+        dx = x - store.pos_x[row] - cx
+        dy = y - store.pos_y[row] - cy
+        lx = (dx * cos + dy * sin) / scale
+        ly = (-dx * sin + dy * cos) / scale
+        pad = store.styles.stroke_width[store.style[row]] / 2
+        if line:
+            local = _segment_distance(lx, ly, sx - cx, sy - cy, a - cx, b - cy)
+        elif store.kind[row] == KIND_POLYLINE:
+            # Vertices are offsets from (sx, sy).
+            local = _polyline_distance(lx + cx - sx, ly + cy - sy, store.points[row])
+        else:
+            outside_x = max(abs(lx) - a / 2, 0.0)
+            outside_y = max(abs(ly) - b / 2, 0.0)
+            local = math.hypot(outside_x, outside_y)
+        return max(local - pad, 0.0) * abs(scale)
+
+    def _flush(self):
+        dirty = self._dirty
+        if not dirty:
+            return
+        if len(dirty) > REBUILD_FRACTION * max(self._count, 1) and len(dirty) > NODE_CAPACITY:
+            self.rebuild()
+            return
+        row_bounds = self.store.row_bounds
+        for row in dirty:
+            self._remove(row)
+            self._insert(row, *row_bounds(row))
+        dirty.clear()
+
+    def rebuild(self):
+        """Rebuild the tree from every row of the store."""
+        self._reset()
+        rows = self.store.rows()
+        if not len(rows):
+            return
+        x0, y0, x1, y1 = self.store.bounds()
+        if numpy is None:
+            for row in rows:
+                self._insert(row, x0[row], y0[row], x1[row], y1[row])
+            return
+        self._node_of = [None] * len(x0)
+        self._x0, self._y0 = array("d", x0.tobytes()), array("d", y0.tobytes())
+        self._x1, self._y1 = array("d", x1.tobytes()), array("d", y1.tobytes())
+        x0, y0, x1, y1 = x0[rows], y0[rows], x1[rows], y1[rows]
+        mx, my = (x0 + x1) / 2, (y0 + y1) / 2
+        ext = numpy.maximum(x1 - x0, y1 - y0) / 2
+        if not numpy.isfinite(ext).all() or not numpy.isfinite(mx + my).all():
+            for row in rows.tolist():
+                self._insert(row, *self.store.row_bounds(row))
+            return
+        self._extent = (float(x0.min()), float(y0.min()), float(x1.max()), float(y1.max()))
+        left, right = float(mx.min()), float(mx.max())
+        top, bottom = float(my.min()), float(my.max())
+        half = max((right - left) / 2, (bottom - top) / 2, float(ext.max()), MIN_HALF_SIZE)
+        cx, cy = (left + right) / 2, (top + bottom) / 2
+        self._root = _Node(cx, cy, half)
+        self._count = len(rows)
+
+        # Sort the rows along a Z-order curve of their centers' cells at the
+        # deepest level, so every node's rows form one contiguous range and
+        # children are found by binary search instead of by copying.
+        depth = min(MAX_DEPTH, max(0, int(math.log2(half / MIN_HALF_SIZE))))
+        cells = 1 << depth
+        step = cells / (2 * half)
+        cell_x = numpy.clip(((mx - (cx - half)) * step).astype(numpy.int64), 0, cells - 1)
+        cell_y = numpy.clip(((my - (cy - half)) * step).astype(numpy.int64), 0, cells - 1)
+        code = _spread(cell_x) | (_spread(cell_y) << numpy.uint64(1))
+        # Deepest level whose cells are at least as large as each shape.
+        with numpy.errstate(divide="ignore"):
+            limit = numpy.floor(numpy.log2(half / ext))
+        limit = numpy.clip(numpy.nan_to_num(limit, posinf=depth), 0, depth).astype(numpy.int64)
+        limit -= ext > half / numpy.exp2(limit)
+        order = numpy.argsort(code, kind="stable")
+        self._fill(self._root, 0, depth, rows[order], code[order], limit[order])
+
+    def _fill(self, node, level, depth, rows, code, limit):
+        """Place rows (sorted by Z-order code) in ``node`` and below."""
+        active = limit >= level
+        count = int(active.sum())
+        if count <= NODE_CAPACITY or level == depth:
+            keep = rows[active]
+        else:
+            keep = rows[limit == level]
+            node.split()
+            shift = numpy.uint64(2 * (depth - level - 1))
+            quadrant = (code[0] >> shift >> numpy.uint64(2)) << numpy.uint64(2)
+            starts = (quadrant + numpy.arange(1, 4, dtype=numpy.uint64)) << shift
+            bounds = [0, *numpy.searchsorted(code, starts).tolist(), len(code)]
+            for index, child in enumerate(node.children):
+                lo, hi = bounds[index], bounds[index + 1]
+                if lo < hi:
+                    self._fill(child, level + 1, depth, rows[lo:hi], code[lo:hi], limit[lo:hi])
+        keep = keep.tolist()
+        node.rows.extend(keep)
+        node_of = self._node_of
+        for row in keep:
+            node_of[row] = node
+
+    def _insert(self, row, x0, y0, x1, y1):
+        node_of = self._node_of
+        if row >= len(node_of):
+            grow = row + 1 - len(node_of)
+            node_of.extend([None] * grow)
+            for column in (self._x0, self._y0, self._x1, self._y1):
+                column.extend([0.0] * grow)
+        self._x0[row], self._y0[row], self._x1[row], self._y1[row] = x0, y0, x1, y1
+        if self._extent is None:
+            self._extent = (x0, y0, x1, y1)
+        else:
+            ex0, ey0, ex1, ey1 = self._extent
+            if x0 < ex0 or y0 < ey0 or x1 > ex1 or y1 > ey1:
+                self._extent = (min(x0, ex0), min(y0, ey0), max(x1, ex1), max(y1, ey1))
+        mx, my = (x0 + x1) / 2, (y0 + y1) / 2
+        ext = max(x1 - x0, y1 - y0) / 2
+        if not math.isfinite(mx + my + ext):
+            # Degenerate geometry: kept at the root, never matched by queries.
+            if self._root is None:
+                self._root = _Node(0.0, 0.0, MIN_HALF_SIZE)
+            mx = my = ext = math.inf
+        elif self._root is None:
+            self._root = _Node(mx, my, max(ext, MIN_HALF_SIZE))
+        while ext != math.inf and not self._fitsRoot(mx, my, ext):
+            self._growRoot(mx, my)
+        node = self._root
+        while node.children is not None and ext <= node.half / 2:
+            node = node.child_for(mx, my)
+        node.rows.append(row)
+        node_of[row] = node
+        self._count += 1
+        if node.children is None and len(node.rows) > NODE_CAPACITY and node.half > MIN_HALF_SIZE:
+            self._split(node)
+
+    def _fitsRoot(self, mx, my, ext):
+        root = self._root
+        return (
+            ext <= root.half
+            and abs(mx - root.cx) <= root.half
+            and abs(my - root.cy) <= root.half
+        )
+
+    def _growRoot(self, mx, my):
+        # Double the root cell towards the point; the old root becomes one
+        # of the new root's quadrants.
+        old = self._root
+        cx = old.cx + (old.half if mx >= old.cx else -old.half)
+        cy = old.cy + (old.half if my >= old.cy else -old.half)
+        root = _Node(cx, cy, 2 * old.half)
+        root.split()
+        root.children[(old.cx >= cx) + 2 * (old.cy >= cy)] = old
+        self._root = root
+
+    def _split(self, node):
+        node.split()
+        child_half = node.half / 2
+        bx0, by0, bx1, by1 = self._x0, self._y0, self._x1, self._y1
+        node_of = self._node_of
+        stay = []
+        for row in node.rows:
+            if max(bx1[row] - bx0[row], by1[row] - by0[row]) / 2 <= child_half:
+                child = node.child_for((bx0[row] + bx1[row]) / 2, (by0[row] + by1[row]) / 2)
+                child.rows.append(row)
+                node_of[row] = child
+            else:
+                stay.append(row)
+        node.rows = stay
+        for child in node.children:
+            if len(child.rows) > NODE_CAPACITY and child.half > MIN_HALF_SIZE:
+                self._split(child)
+
+    def _remove(self, row):
+        node_of = self._node_of
+        if row < len(node_of) and node_of[row] is not None:
+            node_of[row].rows.remove(row)
+            node_of[row] = None
+            self._count -= 1
+
+
+def _segment_distance(px, py, ax, ay, bx, by):
+    """Distance from point p to the segment a-b."""
+    dx, dy = bx - ax, by - ay
+    length = dx * dx + dy * dy
+    if length == 0:
+        return math.hypot(px - ax, py - ay)
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length))
+    return math.hypot(px - ax - t * dx, py - ay - t * dy)
+
+
+def _polyline_distance(px, py, offsets):
+    """Distance from point p to a polyline of packed x, y values."""
+    if len(offsets) < 4:
+        return math.hypot(px - offsets[0], py - offsets[1])
+    if numpy is None:
+        return min(
+            _segment_distance(px, py, *offsets[i : i + 4])
+            for i in range(0, len(offsets) - 2, 2)
+        )
+    points = numpy.frombuffer(offsets, dtype=numpy.float32).reshape(-1, 2)
+    start, end = points[:-1].astype(numpy.float64), points[1:].astype(numpy.float64)
+    delta = end - start
+    length = (delta * delta).sum(axis=1)
+    relative = numpy.array((px, py)) - start
+    t = numpy.clip(
+        (relative * delta).sum(axis=1) / numpy.where(length == 0, 1.0, length), 0.0, 1.0
+    )
+    away = relative - t[:, None] * delta
+    return float(numpy.sqrt((away * away).sum(axis=1).min()))
+
+
+def _spread(values):
+    """Interleave zero bits into (up to 32-bit) integers, for Z-order codes."""
+    v = values.astype(numpy.uint64)
+    for shift, mask in (
+        (16, 0x0000FFFF0000FFFF),
+        (8, 0x00FF00FF00FF00FF),
+        (4, 0x0F0F0F0F0F0F0F0F),
+        (2, 0x3333333333333333),
+        (1, 0x5555555555555555),
+    ):
+        v = (v | (v << numpy.uint64(shift))) & numpy.uint64(mask)
+    return v
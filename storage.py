@@ -0,0 +1,713 @@
+"""
+On-disk document formats.
+
+JSON documents hold a style table and the list of shape entries; each
+entry names its style by index instead of repeating its colors:
+
+    {"version": 2,
+     "styles": [{"fill_color": [r, g, b], "border_color": [r, g, b]}, ...],
+     "shapes": [{"type": "RectangleShape", "x": ..., "style": 0}, ...]}
+
+Files written before the style table (a plain list of entries with
+their colors inline) are still read. Drawings can also be stored in a
+compact binary format (``*.drwb``) that holds the same entries as
+fixed-width packed columns. Binary files are read through
+``mmap``: each column is a typed ``memoryview`` over the file, so nothing is
+parsed per field and entries are only materialized when iterated.
+
+Polylines keep their vertices packed: an entry's "points" is base64 text
+of little-endian float32 x, y offsets from the entry's "x", "y", or, in
+entries read from a binary document, an ``array("f")`` of them (see
+codec.py). Binary
+documents that contain polylines are version 2, which adds a column of
+running vertex counts and a block of the packed vertices after the other
+columns; documents without polylines are still written as version 1.
+
+Groups can be nested. An entry of a shape in a nested group lists the
+group's ancestors, innermost first, under "group_parents"; on disk the
+parent of each nested group is stored once instead, as a "groups" table
+of [group, parent] pairs in JSON and as a block of such pairs after the
+points in binary version 3. Older readers ignore the JSON table and see
+flat groups.
+
+For drawings too large to hold in memory twice, there is a streaming
+text format (``*.ndjson``, or gzip-compressed ``*.ndjson.gz``): a header
+line with the format version and the styles known up front, then one
+entry per line. Styles first used further down are declared on a line of
+their own before the entry that needs them, and nested groups are given
+inline by each entry's "group_parents":
+
+    {"format": "drawing-ndjson", "version": 1, "styles": [...]}
+    {"type": "RectangleShape", "x": ..., "style": 0}
+    {"style": {"fill_color": [r, g, b], "border_color": [r, g, b]}}
+    {"type": "EllipseShape", "x": ..., "style": 1}
+
+It is written and read one entry at a time, so memory use does not grow
+with the drawing. iter_entries() also parses JSON documents
+incrementally, so convert() turns even a large indented JSON file into
+either of the other formats in a single pass.
+
+All formats carry the same entry dicts, so converting between them is
+lossless for every shape type the binary format supports.
+"""
+
+import gzip
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+
+from codec import decode_points, encode_points, points_bytes
+
+BINARY_SUFFIX = ".drwb"
+NDJSON_SUFFIXES = (".ndjson", ".ndjson.gz")
+
+MAGIC = b"DRWB"
+VERSION = 3
+
+# Version of the JSON document layout (files without one are plain lists).
+JSON_VERSION = 2
+
+# First-line tag and version of streaming (NDJSON) documents.
+NDJSON_FORMAT = "drawing-ndjson"
+NDJSON_VERSION = 1
+
+# Characters read at a time when parsing a JSON document incrementally.
+_READ_SIZE = 1 << 16
+
+_WHITESPACE = re.compile(r"[ \t\r\n]*")
+_SEPARATOR = re.compile(r"[ \t\r\n]*([,\]])[ \t\r\n]*")
+
+# Half the default stroke width, added around shapes in entry_bounds().
+_STROKE_PAD = 1.0
+
+# magic, version, reserved, shape count, palette size, reserved
+_HEADER = struct.Struct("<4sHHQII")
+
+# Type code -> (type name, names of the two size columns)
+SHAPE_TYPES = {
+    0: ("RectangleShape", ("width", "height")),
+    1: ("EllipseShape", ("width", "height")),
+    2: ("SquareShape", ("width", "height")),
+    3: ("LineShape", ("x2", "y2")),
+    4: ("PolylineShape", ("width", "height")),
+}
+TYPE_CODES = {name: code for code, (name, _) in SHAPE_TYPES.items()}
+POLYLINE_CODE = TYPE_CODES["PolylineShape"]
+
+# Stored in place of a group ID for shapes that are not grouped.
+NO_GROUP = -(2**63)
+
+# (column name, array typecode) in file order. Each column starts on an
+# 8-byte boundary so it can be cast straight from the mapped file.
+_COLUMNS = (
+    ("x", "d"),
+    ("y", "d"),
+    ("a", "d"),
+    ("b", "d"),
+    ("rotation", "d"),
+    ("scale", "d"),
+    ("group", "q"),
+    ("fill", "I"),
+    ("border", "I"),
+    ("type", "B"),
+)
+
+
+def _padded(size):
+    return (size + 7) & ~7
+
+
+def _pack_color(color):
+    r, g, b = (int(c) for c in color)
+    if not all(0 <= c <= 255 for c in (r, g, b)):
+        raise ValueError(f"Color out of range: {color!r}")
+    return (r << 16) | (g << 8) | b
+
+
+def _unpack_color(value):
+    return [(value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF]
+
+
+def _links(entry, links):
+    # Record the parent of every group on an entry's "group_parents" path.
+    chain = entry.get("group_parents")
+    if chain:
+        child = entry["group_id"]
+        for parent in chain:
+            links[child] = parent
+            child = parent
+
+
+class _Ancestors:
+    """Ancestor lists of groups, built from a {group: parent} table."""
+
+    def __init__(self, links):
+        self._links = links
+        self._chains = {}
+
+    def __call__(self, group_id):
+        chain = self._chains.get(group_id)
+        if chain is None:
+            chain = []
+            parent = self._links.get(group_id)
+            while parent is not None and len(chain) <= len(self._links):
+                chain.append(parent)
+                parent = self._links.get(parent)
+            self._chains[group_id] = chain
+        return chain
+
+
+def write_binary(filename, entries):
+    """Write shape entries (JSON schema dicts) to a binary document."""
+    columns = {name: array(code) for name, code in _COLUMNS}
+    palette = {}
+    # Little-endian float32 vertices of every polyline, and the running
+    # count of values after each shape.
+    points = bytearray()
+    point_ends = array("Q")
+    links = {}
+
+    def color_index(color):
+        packed = _pack_color(color)
+        return palette.setdefault(packed, len(palette))
+
+    for entry in entries:
+        code = TYPE_CODES.get(entry["type"])
+        if code is None:
+            raise ValueError(
+                f"{entry['type']} cannot be stored in the binary format"
+            )
+        first, second = SHAPE_TYPES[code][1]
+        group_id = entry.get("group_id")
+        columns["type"].append(code)
+        columns["x"].append(entry["x"])
+        columns["y"].append(entry["y"])
+        columns["a"].append(entry[first])
+        # Squares saved by older versions only carry a width.
+        columns["b"].append(entry.get(second, entry[first]))
+        columns["rotation"].append(entry["rotation"])
+        columns["scale"].append(entry["scale_x"])
+        columns["fill"].append(color_index(entry["fill_color"]))
+        columns["border"].append(color_index(entry["border_color"]))
+        columns["group"].append(NO_GROUP if group_id is None else group_id)
+        if code == POLYLINE_CODE:
+            points += points_bytes(entry["points"])
+        point_ends.append(len(points) // 4)
+        _links(entry, links)
+
+    # Group count, then (group, parent) pairs.
+    link_block = array("q", [len(links)])
+    for pair in links.items():
+        link_block.extend(pair)
+    if sys.byteorder != "little":
+        for column in columns.values():
+            column.byteswap()
+        point_ends.byteswap()
+        link_block.byteswap()
+
+    count = len(columns["type"])
+    version = 3 if links else 2 if points else 1
+    with open(filename, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, version, 0, count, len(palette), 0))
+        f.write(array("I", palette).tobytes())
+        if len(palette) % 2:
+            f.write(b"\0" * 4)
+        for name, _ in _COLUMNS:
+            data = columns[name].tobytes()
+            f.write(data)
+            f.write(b"\0" * (_padded(len(data)) - len(data)))
+        blocks = (point_ends.tobytes(), points) if version >= 2 else ()
+        if links:
+            blocks += (link_block.tobytes(),)
+        for data in blocks:
+            f.write(data)
+            f.write(b"\0" * (_padded(len(data)) - len(data)))
+
+
+class BinaryDocument:
+    """
+    A binary document opened through ``mmap``.
+
+    Iterating yields entry dicts in the same schema as the JSON format.
+    Use as a context manager, or call ``close()`` when done.
+    """
+
+    def __init__(self, filename):
+        self._file = open(filename, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped.
+            self._file.close()
+            raise ValueError(f"{filename} is not a binary drawing")
+        self._views = []
+        try:
+            self._read_layout(filename)
+        except Exception:
+            self.close()
+            raise
+
+    def _read_layout(self, filename):
+        if len(self._map) < _HEADER.size:
+            raise ValueError(f"{filename} is not a binary drawing")
+        magic, version, _, count, palette_size, _ = _HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a binary drawing")
+        if version > VERSION:
+            raise ValueError(f"Unsupported binary drawing version {version}")
+
+        self._count = count
+        offset = _HEADER.size
+        self.palette = self._column(offset, "I", palette_size)
+        offset += _padded(4 * palette_size)
+        self.columns = {}
+        for name, code in _COLUMNS:
+            size = array(code).itemsize
+            self.columns[name] = self._column(offset, code, count)
+            offset += _padded(size * count)
+        self._point_ends = self._points = None
+        if version >= 2:
+            if offset + 8 * count > len(self._map):
+                raise ValueError(f"{filename} is truncated")
+            self._point_ends = self._column(offset, "Q", count)
+            offset += _padded(8 * count)
+            values = self._point_ends[-1] if count else 0
+            if offset + 4 * values > len(self._map):
+                raise ValueError(f"{filename} is truncated")
+            self._points = self._column(offset, "f", values)
+            offset += _padded(4 * values)
+        self._links = {}
+        if version >= 3:
+            if offset + 8 > len(self._map):
+                raise ValueError(f"{filename} is truncated")
+            pairs = self._column(offset, "q", 1)[0]
+            if offset + 8 + 16 * pairs > len(self._map):
+                raise ValueError(f"{filename} is truncated")
+            block = self._column(offset + 8, "q", 2 * pairs)
+            self._links = dict(zip(block[0::2], block[1::2]))
+            offset += 8 + 16 * pairs
+        if offset > len(self._map):
+            raise ValueError(f"{filename} is truncated")
+
+    def _column(self, offset, code, count):
+        size = array(code).itemsize * count
+        if sys.byteorder != "little":
+            column = array(code, self._map[offset : offset + size])
+            column.byteswap()
+            return column
+        view = memoryview(self._map)[offset : offset + size].cast(code)
+        self._views.append(view)
+        return view
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        cols = self.columns
+        palette = [_unpack_color(value) for value in self.palette]
+        point_ends, points = self._point_ends, self._points
+        ancestors = _Ancestors(self._links) if self._links else None
+        for i in range(self._count):
+            code = cols["type"][i]
+            name, (first, second) = SHAPE_TYPES[code]
+            group_id = cols["group"][i]
+            entry = {
+                "type": name,
+                "x": cols["x"][i],
+                "y": cols["y"][i],
+                "rotation": cols["rotation"][i],
+                "scale_x": cols["scale"][i],
+                "fill_color": list(palette[cols["fill"][i]]),
+                "border_color": list(palette[cols["border"][i]]),
+                "group_id": None if group_id == NO_GROUP else group_id,
+                first: cols["a"][i],
+                second: cols["b"][i],
+            }
+            if code == POLYLINE_CODE:
+                start = point_ends[i - 1] if i else 0
+                entry["points"] = decode_points(points[start : point_ends[i]])
+            if ancestors is not None and group_id in self._links:
+                entry["group_parents"] = ancestors(group_id)
+            yield entry
+
+    def close(self):
+        """Release the column views and unmap the file."""
+        for view in self._views:
+            view.release()
+        self._views.clear()
+        self.columns = {}
+        self.palette = ()
+        self._point_ends = self._points = None
+        self._links = {}
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def is_binary(filename):
+    """Return True if the filename uses the binary document suffix."""
+    return filename.lower().endswith(BINARY_SUFFIX)
+
+
+def is_ndjson(filename):
+    """Return True if the filename uses a streaming (NDJSON) suffix."""
+    return filename.lower().endswith(NDJSON_SUFFIXES)
+
+
+def _open_text(filename, mode, compressed=None):
+    if compressed is None:
+        compressed = filename.lower().endswith(".gz")
+    if compressed:
+        return gzip.open(filename, mode + "t", encoding="utf-8", compresslevel=6)
+    return open(filename, mode, encoding="utf-8")
+
+
+def write_ndjson(filename, entries, styles=(), compressed=None):
+    """
+    Write shape entries as a streaming document, one line at a time.
+
+    ``styles`` are (fill_color, border_color) pairs put in the header;
+    other colors are declared as they are first met. The document is
+    gzip-compressed if ``compressed`` is set or, by default, if the
+    filename ends in ".gz".
+    """
+    index = {}
+    table = []
+    for fill, border in styles:
+        key = (tuple(fill), tuple(border))
+        if key not in index:
+            index[key] = len(table)
+            table.append({"fill_color": list(fill), "border_color": list(border)})
+    dumps = json.JSONEncoder(separators=(",", ":")).encode
+    with _open_text(filename, "w", compressed) as f:
+        header = {"format": NDJSON_FORMAT, "version": NDJSON_VERSION, "styles": table}
+        f.write(dumps(header) + "\n")
+        for entry in entries:
+            entry = dict(entry)
+            if "points" in entry:
+                entry["points"] = encode_points(entry["points"])
+            fill = entry.pop("fill_color")
+            border = entry.pop("border_color")
+            key = (tuple(fill), tuple(border))
+            style = index.get(key)
+            if style is None:
+                style = index[key] = len(index)
+                declared = {"fill_color": list(fill), "border_color": list(border)}
+                f.write(dumps({"style": declared}) + "\n")
+            entry["style"] = style
+            f.write(dumps(entry) + "\n")
+
+
+def iter_ndjson(f):
+    """Yield the shape entries of a streaming document open as text."""
+    header = json.loads(f.readline() or "null")
+    if not isinstance(header, dict) or header.get("format") != NDJSON_FORMAT:
+        raise ValueError("Not a streaming drawing")
+    if header["version"] > NDJSON_VERSION:
+        raise ValueError(f"Unsupported drawing version {header['version']}")
+    styles = header["styles"]
+    for line in f:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if "type" in record:
+            style = styles[record.pop("style")]
+            record["fill_color"] = style["fill_color"]
+            record["border_color"] = style["border_color"]
+            yield record
+        elif "style" in record:
+            styles.append(record["style"])
+
+
+class _JsonStream:
+    """Incremental reader of JSON values from a text file."""
+
+    def __init__(self, f):
+        self._file = f
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        # The decoder's scanner: like raw_decode(), without its wrapping.
+        self._scan = json.JSONDecoder().scan_once
+
+    def _fill(self):
+        # Drop what has been consumed and read the next block.
+        chunk = self._file.read(_READ_SIZE)
+        self._buffer = self._buffer[self._pos :] + chunk
+        self._pos = 0
+        self._eof = not chunk
+        return bool(chunk)
+
+    def peek(self):
+        """Next non-whitespace character ("" at the end of the file)."""
+        while True:
+            buffer = self._buffer
+            pos = self._pos = _WHITESPACE.match(buffer, self._pos).end()
+            if pos < len(buffer):
+                return buffer[pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} in JSON document")
+        self._pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._scan(self._buffer, self._pos)
+            except (StopIteration, json.JSONDecodeError):
+                if self._eof or not self._fill():
+                    raise ValueError("Malformed or truncated JSON document")
+                continue
+            # A number cut off at the end of the buffer would parse short.
+            if end == len(self._buffer) and not self._eof and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def items(self):
+        """Yield the elements of the array that starts here, one at a time."""
+        self.expect("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+        scan = self._scan
+        while True:
+            # Decode the element and step over the separator after it in
+            # one go, unless the buffer ends first.
+            buffer = self._buffer
+            try:
+                value, end = scan(buffer, self._pos)
+                separator = _SEPARATOR.match(buffer, end)
+            except (StopIteration, json.JSONDecodeError):
+                separator = None
+            if separator is None or separator.end() == len(buffer):
+                value = self.value()
+                last = self.peek() == "]"
+                self.expect("]" if last else ",")
+                if not last:
+                    self.peek()
+            else:
+                self._pos = separator.end()
+                last = separator.group(1) == "]"
+            yield value
+            if last:
+                return
+
+
+def iter_json(f):
+    """
+    Yield the shape entries of a JSON document, parsing it incrementally.
+
+    The "styles" and "groups" of a document must come before its
+    "shapes", as they do in every file this module writes; a ValueError is
+    raised otherwise, since the shapes have been yielded by then.
+    """
+    stream = _JsonStream(f)
+    if stream.peek() == "[":
+        yield from stream.items()
+        return
+    stream.expect("{")
+    styles = None
+    links = {}
+    ancestors = _Ancestors(links)
+    shapes = False
+    while stream.peek() != "}":
+        key = stream.value()
+        stream.expect(":")
+        if key != "shapes":
+            value = stream.value()
+            if key == "version" and value > JSON_VERSION:
+                raise ValueError(f"Unsupported drawing version {value}")
+            if key == "styles":
+                styles = value
+            elif key == "groups":
+                if shapes and value:
+                    raise ValueError('"groups" must come before "shapes"')
+                links.update(value)
+        else:
+            shapes = True
+            if styles is None:
+                raise ValueError('"styles" must come before "shapes"')
+            for entry in stream.items():
+                style = styles[entry.pop("style")]
+                entry["fill_color"] = style["fill_color"]
+                entry["border_color"] = style["border_color"]
+                if entry.get("group_id") in links:
+                    entry["group_parents"] = ancestors(entry["group_id"])
+                yield entry
+        if stream.peek() == ",":
+            stream.expect(",")
+
+
+def iter_entries(filename):
+    """
+    Yield the entries of a document of any format one by one, without
+    reading the whole file first.
+    """
+    if is_binary(filename):
+        with BinaryDocument(filename) as doc:
+            yield from doc
+    elif is_ndjson(filename):
+        with _open_text(filename, "r") as f:
+            yield from iter_ndjson(f)
+    else:
+        with open(filename, "r") as f:
+            yield from iter_json(f)
+
+
+def entry_bounds(entry):
+    """
+    Scene-space bounding box (x0, y0, x1, y1) of a saved entry, including
+    its rotation and scale, or None if the entry type is unknown.
+    """
+    shape_type = entry["type"]
+    if shape_type == "PolygonShape":
+        xs = [x for x, _ in entry["vertices"]]
+        ys = [y for _, y in entry["vertices"]]
+        return min(xs), min(ys), max(xs), max(ys)
+    x, y = entry["x"], entry["y"]
+    if shape_type == "LineShape":
+        width, height = abs(entry["x2"] - x), abs(entry["y2"] - y)
+        cx, cy = (x + entry["x2"]) / 2, (y + entry["y2"]) / 2
+    elif shape_type in TYPE_CODES:
+        width = entry["width"]
+        height = entry.get("height", width)
+        cx, cy = x + width / 2, y + height / 2
+    else:
+        return None
+    scale = abs(entry["scale_x"])
+    radians = math.radians(entry["rotation"])
+    cos, sin = abs(math.cos(radians)), abs(math.sin(radians))
+    half_w = (width / 2 + _STROKE_PAD) * scale
+    half_h = (height / 2 + _STROKE_PAD) * scale
+    extent_x = half_w * cos + half_h * sin
+    extent_y = half_w * sin + half_h * cos
+    return cx - extent_x, cy - extent_y, cx + extent_x, cy + extent_y
+
+
+def styled_document(entries):
+    """
+    The JSON document for shape entries: their distinct colors are moved
+    into a style table that the entries refer to.
+    """
+    styles = []
+    index = {}
+    shapes = []
+    links = {}
+    for entry in entries:
+        entry = dict(entry)
+        if "points" in entry:
+            entry["points"] = encode_points(entry["points"])
+        _links(entry, links)
+        entry.pop("group_parents", None)
+        fill = entry.pop("fill_color")
+        border = entry.pop("border_color")
+        key = (tuple(fill), tuple(border))
+        style = index.get(key)
+        if style is None:
+            style = index[key] = len(styles)
+            styles.append({"fill_color": list(fill), "border_color": list(border)})
+        entry["style"] = style
+        shapes.append(entry)
+    document = {"version": JSON_VERSION, "styles": styles}
+    if links:
+        # Ahead of the shapes, so iter_json() has them when it needs them.
+        document["groups"] = [list(pair) for pair in links.items()]
+    document["shapes"] = shapes
+    return document
+
+
+def json_entries(data):
+    """
+    The shape entries of a parsed JSON document, with colors inline.
+
+    Entries sharing a style share its color lists.
+    """
+    if isinstance(data, list):
+        return data
+    if data.get("version", 0) > JSON_VERSION:
+        raise ValueError(f"Unsupported drawing version {data['version']}")
+    styles = data["styles"]
+    shapes = data["shapes"]
+    links = dict(data.get("groups", ()))
+    ancestors = _Ancestors(links)
+    for entry in shapes:
+        style = styles[entry.pop("style")]
+        entry["fill_color"] = style["fill_color"]
+        entry["border_color"] = style["border_color"]
+        if entry.get("group_id") in links:
+            entry["group_parents"] = ancestors(entry["group_id"])
+    return shapes
+
+
+def read_entries(filename):
+    """Return all entries of a JSON or binary document as a list."""
+    if is_binary(filename):
+        with BinaryDocument(filename) as doc:
+            return list(doc)
+    if is_ndjson(filename):
+        return list(iter_entries(filename))
+    with open(filename, "r") as f:
+        return json_entries(json.load(f))
+
+
+def write_entries(filename, entries, styles=()):
+    """
+    Write entries as JSON, binary or NDJSON depending on the filename
+    suffix. ``styles`` seeds the header of an NDJSON document (see
+    write_ndjson()); the other formats collect their colors themselves.
+
+    The document is written to a temporary file next to the target and
+    moved over it once it is complete and synced, so a crash while saving
+    leaves the previous version intact.
+    """
+    temp = filename + ".tmp"
+    try:
+        if is_binary(filename):
+            write_binary(temp, entries)
+        elif is_ndjson(filename):
+            write_ndjson(temp, entries, styles, filename.lower().endswith(".gz"))
+        else:
+            with open(temp, "w") as f:
+                json.dump(styled_document(entries), f, indent=2)
+        with open(temp, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(temp, filename)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+def convert(source, target):
+    """
+    Convert a document between the JSON, binary and NDJSON formats in a
+    single pass, reading the source one entry at a time.
+    """
+    write_entries(target, iter_entries(source))
+
+
+def main():
+    """Command-line entry point: ``python storage.py SOURCE TARGET``."""
+    if len(sys.argv) != 3:
+        sys.exit(f"usage: {sys.argv[0]} SOURCE TARGET")
+    convert(sys.argv[1], sys.argv[2])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,487 @@
+"""
+Background document I/O for the drawing app.
+
+SaveTask and LoadTask run serialization and parsing on a QThread so the
+window stays responsive while large drawings are written or read. A save
+works from a copy of the shape store taken when it starts, so the drawing
+can keep being edited while it runs. Loaded entries are handed back to the
+GUI thread, where EntryLoader adds them to the scene in time-sliced chunks
+so the view repaints between them. A streaming (NDJSON) document is not
+read into a list at all: the worker decodes it in batches and hands them
+to EntryLoader through a bounded EntryStream as it goes, so only a few
+batches are held at a time. OpenTask also works out which entries fall in
+the first screenful, so they can be added before the rest.
+
+Every task reports ``progress(done, total)`` (a total of 0 means the
+amount of work is not known yet) and can be cancelled.
+"""
+
+import json
+import queue
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+from collections import namedtuple
+from collections.abc import Sized
+
+from PyQt5 import sip
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal
+from PyQt5.QtWidgets import QGraphicsScene
+
+from storage import (
+    BinaryDocument,
+    entry_bounds,
+    is_binary,
+    is_ndjson,
+    iter_entries,
+    json_entries,
+    write_entries,
+)
+
+# Entries handled between progress reports and cancellation checks.
+PROGRESS_STEP = 5000
+
+# Time spent adding loaded items before returning to the event loop.
+CHUNK_SECONDS = 0.03
+
+# Entries per batch of a streamed load, and batches decoded ahead of the
+# loader at most.
+STREAM_BATCH = 1000
+STREAM_BATCHES = 8
+
+# How long the loader waits (ms) before looking for more streamed entries
+# when the worker has none ready.
+STREAM_WAIT_MS = 5
+
+# Yielded by an EntryStream that has no entries ready yet.
+_WAITING = object()
+
+# Put in an EntryStream's queue after its last batch.
+_END = object()
+
+
+class Cancelled(Exception):
+    """Raised inside a task when it has been cancelled."""
+
+
+class _TaskType(type(QThread), ABCMeta):
+    """Metaclass of DocumentTask: a Qt class with abstract methods."""
+
+
+class DocumentTask(QThread, metaclass=_TaskType):
+    """
+    A cancellable background job that reports progress.
+
+    Exactly one of ``succeeded``, ``failed`` or ``cancelled`` is emitted
+    when it ends, whatever ``work()`` raises.
+    """
+
+    progress = pyqtSignal(int, int)
+    succeeded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, filename, parent=None):
+        super().__init__(parent)
+        self.filename = filename
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """Ask the task to stop at the next progress check."""
+        self._cancel.set()
+
+    def isCancelled(self):
+        return self._cancel.is_set()
+
+    def run(self):
+        try:
+            result = self.work()
+        except Cancelled:
+            self.cancelled.emit()
+        except Exception as exc:  # a malformed document can raise anything
+            self.failed.emit(str(exc) or type(exc).__name__)
+        else:
+            self.succeeded.emit(result)
+
+    @abstractmethod
+    def work(self):
+        """Do the job on the worker thread and return its result."""
+
+    def _tracked(self, iterable, total):
+        """Yield from ``iterable``, reporting progress and honouring cancel."""
+        for done, value in enumerate(iterable):
+            if done % PROGRESS_STEP == 0:
+                if self._cancel.is_set():
+                    raise Cancelled()
+                self.progress.emit(done, total)
+            yield value
+        self.progress.emit(total, total)
+
+
+class SaveTask(DocumentTask):
+    """
+    Write a snapshot of the drawing: a store copy plus the row order, and
+    the ancestors of each nested group ({group ID: [parent, ...]}).
+    """
+
+    def __init__(self, filename, store, rows, parent=None, parents=None):
+        super().__init__(filename, parent)
+        self.store = store
+        self.rows = rows
+        self.parents = parents or {}
+        # Taken here: the style table may grow while the task runs.
+        self.styles = store.styles.colors()
+
+    def _entry(self, row):
+        entry = self.store.entry(row)
+        parents = self.parents.get(entry["group_id"])
+        if parents:
+            entry["group_parents"] = parents
+        return entry
+
+    def work(self):
+        entries = (self._entry(row) for row in self.rows)
+        # Cancelling aborts write_entries before it replaces the file.
+        write_entries(
+            self.filename, self._tracked(entries, len(self.rows)), self.styles
+        )
+        return self.filename
+
+
+class EntryStream:
+    """
+    Entries decoded on a LoadTask's worker thread, passed to the GUI thread
+    in batches through a bounded queue.
+
+    Iterating (on the GUI thread) never blocks: it yields the entries, or
+    ``_WAITING`` while the worker has none ready, and raises the error (or
+    Cancelled) that ended the task early. ``close()`` stops the worker.
+    """
+
+    def __init__(self, task):
+        self._task = task
+        self._queue = queue.Queue(STREAM_BATCHES)
+        self._closed = threading.Event()
+
+    def put(self, batch):
+        """Queue a batch (worker thread); waits while the queue is full."""
+        while not self._closed.is_set() and not self._task.isCancelled():
+            try:
+                self._queue.put(batch, timeout=0.05)
+                return
+            except queue.Full:
+                pass
+        raise Cancelled()
+
+    def finish(self, error=None):
+        """End the stream (worker thread), with the error that ended it."""
+        while not self._closed.is_set():
+            if error is None and self._task.isCancelled():
+                error = Cancelled()
+            try:
+                self._queue.put(_END if error is None else error, timeout=0.05)
+                return
+            except queue.Full:
+                if error is not None:
+                    # The load is over; make room even if nothing reads.
+                    self._drain()
+
+    def _drain(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def __iter__(self):
+        while True:
+            try:
+                batch = self._queue.get_nowait()
+            except queue.Empty:
+                yield _WAITING
+                continue
+            if batch is _END:
+                return
+            if isinstance(batch, Exception):
+                raise batch
+            yield from batch
+
+    def close(self):
+        """Stop reading: cancel the worker and wait for it to end."""
+        self._closed.set()
+        # A task that has been deleted has finished.
+        if not sip.isdeleted(self._task):
+            self._task.cancel()
+            self._task.wait()
+
+
+class LoadTask(DocumentTask):
+    """
+    Read and parse a document into a list of entries.
+
+    A streaming (NDJSON) document is handed over as an EntryStream instead:
+    ``streaming`` is emitted with it as soon as the task starts, and the
+    worker then decodes the entries into it batch by batch. Its errors and
+    cancellation reach the loader through the stream, so the task's own
+    end signals can be ignored once it has streamed.
+    """
+
+    streaming = pyqtSignal(object)
+
+    def work(self):
+        if is_ndjson(self.filename):
+            stream = EntryStream(self)
+            self.streaming.emit(stream)
+            self._produce(stream)
+            return stream
+        return self._read()
+
+    def _produce(self, stream):
+        """Decode the document's entries into ``stream``."""
+        try:
+            batch = []
+            # The entry count is not known until the end.
+            for entry in self._tracked(iter_entries(self.filename), 0):
+                batch.append(entry)
+                if len(batch) == STREAM_BATCH:
+                    stream.put(batch)
+                    batch = []
+            stream.put(batch)
+        except Exception as exc:  # Cancelled too: the loader must stop
+            stream.finish(exc)
+            raise
+        stream.finish()
+
+    def _read(self):
+        """All entries of the document, as a list."""
+        if is_binary(self.filename):
+            with BinaryDocument(self.filename) as doc:
+                return list(self._tracked(doc, len(doc)))
+        self.progress.emit(0, 0)
+        with open(self.filename, "r") as f:
+            data = json.load(f)
+        if self._cancel.is_set():
+            raise Cancelled()
+        return json_entries(data)
+
+
+# Result of an OpenTask: the entries (a list or an EntryStream), the
+# drawing's bounding box (x0, y0, x1, y1, or None if empty) and the
+# (position, entry) pairs of the entries in the first screenful.
+Opening = namedtuple("Opening", "entries bounds first")
+
+
+class OpenTask(LoadTask):
+    """
+    Read a document that is being opened, and find its first screenful.
+
+    The view starts at the top-left corner of the drawing, so the first
+    screenful is a ``width`` x ``height`` scene rect placed there.
+
+    A streaming (NDJSON) document is read twice: once to find its bounds
+    and first screenful, keeping only the entries that may be in it, and
+    then streamed as by LoadTask, with ``streaming`` emitting the Opening.
+    """
+
+    def __init__(self, filename, width, height, parent=None):
+        super().__init__(filename, parent)
+        self.width = width
+        self.height = height
+
+    def work(self):
+        if is_ndjson(self.filename):
+            bounds, first = self._scan()
+            opening = Opening(EntryStream(self), bounds, first)
+            self.streaming.emit(opening)
+            self._produce(opening.entries)
+            return opening
+        entries = self._read()
+        boxes = [entry_bounds(entry) for entry in self._tracked(entries, len(entries))]
+        known = [box for box in boxes if box is not None]
+        if not known:
+            return Opening(entries, None, [])
+        left = min(box[0] for box in known)
+        top = min(box[1] for box in known)
+        bounds = (left, top, max(box[2] for box in known), max(box[3] for box in known))
+        right, bottom = left + self.width, top + self.height
+        first = [
+            (position, entries[position])
+            for position, box in enumerate(boxes)
+            if box is not None and box[0] <= right and box[1] <= bottom
+        ]
+        return Opening(entries, bounds, first)
+
+    def _scan(self):
+        """
+        Bounds and first screenful of a streaming document, in one pass
+        that keeps only the entries that can still be in the first
+        screenful (the corner only moves up and left as it is read).
+        """
+        left = top = right = bottom = None
+        candidates = []
+        limit = STREAM_BATCH
+        entries = iter_entries(self.filename)
+        for position, entry in enumerate(self._tracked(entries, 0)):
+            box = entry_bounds(entry)
+            if box is None:
+                continue
+            if left is None:
+                left, top, right, bottom = box
+            else:
+                left, top = min(left, box[0]), min(top, box[1])
+                right, bottom = max(right, box[2]), max(bottom, box[3])
+            if box[0] <= left + self.width and box[1] <= top + self.height:
+                candidates.append((position, box, entry))
+                if len(candidates) > limit:
+                    candidates = self._inScreen(candidates, left, top)
+                    limit = 2 * len(candidates) + STREAM_BATCH
+        if left is None:
+            return None, []
+        first = self._inScreen(candidates, left, top)
+        return (left, top, right, bottom), [(pos, entry) for pos, _, entry in first]
+
+    def _inScreen(self, candidates, left, top):
+        right, bottom = left + self.width, top + self.height
+        return [c for c in candidates if c[1][0] <= right and c[1][1] <= bottom]
+
+
+class EntryLoader(QObject):
+    """
+    Add loaded entries to an app on the GUI thread in time-sliced chunks.
+
+    The scene index is switched off until every entry has been added (or
+    the load is cancelled, which removes the items added so far).
+
+    ``entries`` is a list, or an EntryStream that is read as the chunks
+    are added (progress then has a total of 0, as the count is not known).
+
+    The (position, entry) pairs in ``first`` are all added in the first
+    chunk, and ``firstAdded`` is emitted after that chunk whether or not
+    there were any (so before ``finished`` even if it was the only one).
+    The rest follow in document order; when the loader gets to an
+    early entry its item is moved to the top of the stacking order, so
+    the drawing ends up stacked (and ``added`` ordered) as in the file.
+    """
+
+    progress = pyqtSignal(int, int)
+    firstAdded = pyqtSignal()
+    finished = pyqtSignal(list)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, app, entries, parent=None, first=()):
+        super().__init__(parent)
+        self.app = app
+        self.total = len(entries) if isinstance(entries, Sized) else 0
+        self.added = []
+        self._source = entries
+        self._entries = iter(entries)
+        self._position = 0
+        self._first = list(first)
+        self._early = {}
+        self._first_pending = True
+        self._index_method = None
+        self._timer = QTimer(self)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._step)
+
+    def start(self):
+        scene = self.app.scene
+        self._index_method = scene.itemIndexMethod()
+        scene.setItemIndexMethod(QGraphicsScene.NoIndex)
+        self._timer.start()
+
+    def cancel(self):
+        if not self._timer.isActive():
+            return
+        self._abort()
+        self.cancelled.emit()
+
+    def _abort(self):
+        """Stop and remove the items added so far."""
+        self._timer.stop()
+        self._close()
+        app = self.app
+        # Items that were removed meanwhile (Clear All) are already released.
+        added = [item for item in self.added if item in app.items]
+        early = [item for item in self._early.values() if item in app.items]
+        app._detachItems(added + early)
+        self.added = []
+        self._early = {}
+        self._restoreIndex()
+
+    def _step(self):
+        try:
+            self._addChunk()
+        except Cancelled:
+            # The worker streaming the entries was cancelled.
+            self._abort()
+            self.cancelled.emit()
+        except Exception as exc:  # a malformed entry can raise anything
+            self._abort()
+            self.failed.emit(str(exc) or type(exc).__name__)
+
+    def _addChunk(self):
+        if self._first:
+            self._addFirst()
+            return
+        deadline = time.perf_counter() + CHUNK_SECONDS
+        self._timer.setInterval(0)
+        app = self.app
+        item_from_entry = app._itemFromEntry
+        added, early = self.added, self._early
+        count = 0
+        for entry in self._entries:
+            if entry is _WAITING:
+                # Give the worker time to decode more.
+                self._timer.setInterval(STREAM_WAIT_MS)
+                self.progress.emit(len(added) + len(early), self.total)
+                self._firstDone()
+                return
+            position = self._position
+            self._position += 1
+            count += 1
+            if position in early:
+                item = early.pop(position)
+                if item in app.items:
+                    app._restackItem(item)
+                    added.append(item)
+                continue
+            item = item_from_entry(entry)
+            if item is not None:
+                added.append(item)
+            if count % 64 == 0 and time.perf_counter() > deadline:
+                self.progress.emit(len(added) + len(early), self.total)
+                self._firstDone()
+                return
+        self._timer.stop()
+        self._close()
+        self._restoreIndex()
+        self.progress.emit(self.total, self.total)
+        self._firstDone()
+        self.finished.emit(added)
+
+    def _addFirst(self):
+        item_from_entry = self.app._itemFromEntry
+        for position, entry in self._first:
+            item = item_from_entry(entry)
+            if item is not None:
+                self._early[position] = item
+        self._first = []
+        self.progress.emit(len(self._early), self.total)
+        self._firstDone()
+
+    def _firstDone(self):
+        if self._first_pending:
+            self._first_pending = False
+            self.firstAdded.emit()
+
+    def _close(self):
+        # Let a streamed document close its file.
+        close = getattr(self._source, "close", None)
+        if close is not None:
+            close()
+        self._source = ()
+
+    def _restoreIndex(self):
+        self.app.scene.setItemIndexMethod(self._index_method)
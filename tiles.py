@@ -0,0 +1,155 @@
+"""
+Tiled raster cache of a scene.
+
+Used by DragGraphicsView while the user drags a selection: everything that
+is not being moved is rendered once into fixed-size device-pixel tiles,
+which are then blitted as the view's background so each frame only has to
+draw the moving items. Tiles are rendered lazily and dropped individually
+when the part of the scene they cover changes.
+
+The moving items stay visible (and selected) in the scene; they are only
+left out of the tiles. Tiles they overlap are painted item by item, and
+every other tile is rendered by the scene in one call.
+"""
+
+from PyQt5.QtCore import QRect, QRectF, Qt
+from PyQt5.QtGui import QPainter, QPixmap, QTransform
+from PyQt5.QtWidgets import QStyle, QStyleOptionGraphicsItem
+
+# Tile edge length in device pixels.
+TILE_SIZE = 256
+
+
+class TileCache:
+    """Lazily rendered tiles of a scene at one view transform."""
+
+    def __init__(self, scene, tile_size=TILE_SIZE):
+        self.scene = scene
+        self.tile_size = tile_size
+        self.render_hints = QPainter.Antialiasing
+        self._tiles = {}
+        self._transform = QTransform()
+        self._inverse = QTransform()
+        self._excluded = set()
+        self.frozen = False
+        scene.changed.connect(self.invalidateRects)
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def setTransform(self, transform):
+        """Use a new scene-to-device transform, dropping tiles if it changed."""
+        if transform != self._transform:
+            self._transform = QTransform(transform)
+            self._inverse, _ = transform.inverted()
+            self._tiles.clear()
+
+    def clear(self):
+        """Drop every tile."""
+        self._tiles.clear()
+
+    def invalidate(self, scene_rect):
+        """Drop the tiles covering a scene rectangle."""
+        if not self._tiles:
+            return
+        cols, rows = self._ranges(scene_rect)
+        if len(cols) * len(rows) > len(self._tiles):
+            # Large change: cheaper to test the tiles we actually have.
+            for key in [k for k in self._tiles if k[0] in cols and k[1] in rows]:
+                del self._tiles[key]
+            return
+        for row in rows:
+            for col in cols:
+                self._tiles.pop((col, row), None)
+
+    def exclude(self, items):
+        """
+        Leave ``items`` (top-level graphics items) and their children out of
+        the tiles rendered from now on; an empty list includes everything.
+        """
+        self._excluded = set(items)
+
+    def invalidateRects(self, rects):
+        """
+        Slot for QGraphicsScene.changed. Ignored while ``frozen``: the
+        excluded items moving does not change the tiles, and the view
+        invalidates what they covered once they are drawn in the tiles again.
+        """
+        if self.frozen:
+            return
+        for rect in rects:
+            self.invalidate(rect)
+
+    def _ranges(self, scene_rect):
+        """Column and row ranges of the tiles covering a scene rectangle."""
+        # Pad by a pixel so antialiased edges are covered as well.
+        device = self._transform.mapRect(scene_rect).adjusted(-1, -1, 1, 1)
+        size = self.tile_size
+        cols = range(int(device.left() // size), int(device.right() // size) + 1)
+        rows = range(int(device.top() // size), int(device.bottom() // size) + 1)
+        return cols, rows
+
+    def _keys(self, scene_rect):
+        cols, rows = self._ranges(scene_rect)
+        for row in rows:
+            for col in cols:
+                yield col, row
+
+    def tileRect(self, key):
+        """Scene rectangle covered by the tile with the given key."""
+        col, row = key
+        size = self.tile_size
+        return self._inverse.mapRect(QRectF(col * size, row * size, size, size))
+
+    def tiles(self, scene_rect):
+        """Yield (scene rect, pixmap) for the tiles covering ``scene_rect``."""
+        for key in self._keys(scene_rect):
+            pixmap = self._tiles.get(key)
+            if pixmap is None:
+                pixmap = self._tiles[key] = self._render(key)
+            yield self.tileRect(key), pixmap
+
+    def _render(self, key):
+        size = self.tile_size
+        pixmap = QPixmap(size, size)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        painter.setRenderHints(self.render_hints)
+        rect = self.tileRect(key)
+        if self._overlapsExcluded(rect):
+            col, row = key
+            self._paintItems(
+                painter,
+                rect,
+                self._transform * QTransform.fromTranslate(-col * size, -row * size),
+            )
+        else:
+            self.scene.render(painter, QRectF(0, 0, size, size), rect, Qt.IgnoreAspectRatio)
+        painter.end()
+        return pixmap
+
+    def _overlapsExcluded(self, rect):
+        return any(item.sceneBoundingRect().intersects(rect) for item in self._excluded)
+
+    def _paintItems(self, painter, rect, transform):
+        """Paint the scene items in ``rect`` except the excluded ones, bottom first."""
+        excluded = self._excluded
+        option = QStyleOptionGraphicsItem()
+        for item in self.scene.items(rect, Qt.IntersectsItemBoundingRect, Qt.AscendingOrder):
+            if item.topLevelItem() in excluded:
+                continue
+            option.state = QStyle.State_Enabled
+            if item.isSelected():
+                option.state |= QStyle.State_Selected
+            option.exposedRect = item.boundingRect()
+            painter.save()
+            painter.setTransform(item.sceneTransform() * transform)
+            painter.setOpacity(item.effectiveOpacity())
+            item.paint(painter, option, None)
+            painter.restore()
+
+    def draw(self, painter, scene_rect):
+        """Draw the cached tiles covering ``scene_rect`` with ``painter``."""
+        source = QRect(0, 0, self.tile_size, self.tile_size)
+        for rect, pixmap in self.tiles(scene_rect):
+            painter.drawPixmap(rect, pixmap, QRectF(source))
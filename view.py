@@ -1,54 +1,617 @@
-from PyQt5.QtWidgets import QGraphicsView, QGraphicsItem
-from PyQt5.QtGui import QPainter
+import time
+
+from PyQt5.QtWidgets import (
+    QGraphicsView,
+    QGraphicsItem,
+    QGraphicsPathItem,
+    QStyle,
+    QStyleOptionGraphicsItem,
+)
+from PyQt5.QtGui import QPainter, QPainterPath, QColor, QFont, QPen
+from PyQt5.QtCore import QPointF, QRect, QTimer, Qt, pyqtSignal
+
+from freehand import SIMPLIFY_PIXELS, STROKE_COLOR, StrokeRecorder, extend_path
+from profiling import Instrumentation
+from shapes import DEFAULT_STROKE_WIDTH, ShapeBase
+from snapping import GRID_SIZE, SNAP_PIXELS, snap_to_grid
+from tiles import TileCache
+from virtual import VirtualItem, graphics_item, style_item
+
+# Target time of one drag frame, the mouse-move event and the repaint it
+# causes (one 60 Hz frame), measured on a 100k-item scene by
+# benchmarks/bench_drag.py.
+DRAG_FRAME_BUDGET_MS = 16.7
+
+# Render hints used when the view is idle and zoomed in far enough.
+FULL_QUALITY_HINTS = QPainter.Antialiasing | QPainter.SmoothPixmapTransform
+
+# Below this level of detail (device pixels per scene unit) shapes are only
+# a few pixels wide, so the view renders without antialiasing.
+ANTIALIAS_MIN_LOD = 0.5
+
+# Shapes whose larger side is drawn shorter than this many device pixels
+# lose their outline (lines become hairlines) once the view is idle.
+TINY_ITEM_PIXELS = 3
+
+# Time spent restyling items per slice of that pass (see _applyItemDetail).
+DETAIL_SLICE_MS = 10
+
+# Antialiasing is dropped while the user drags or zooms and restored once
+# the view has been idle for this long.
+QUALITY_RESTORE_MS = 150
+
+# Zoom factor per wheel notch (Ctrl + wheel).
+ZOOM_STEP = 1.15
+
+# Area in the top-left corner of the viewport used by the stats overlay.
+OVERLAY_RECT = QRect(4, 4, 220, 54)
+
+# Color of the alignment guides shown while a drag is snapped.
+GUIDE_COLOR = QColor(255, 0, 160)
 
 
 class DragGraphicsView(QGraphicsView):
     """
     A QGraphicsView that supports dragging groups of items together.
+
+    Only the members of the clicked item's group are captured when a drag
+    starts, so mouse events cost O(group size) rather than O(scene size).
+
+    With ``cachedInteraction`` on (the default), the rest of the scene is
+    drawn from a tiled raster cache while a drag is in progress, and only
+    the dragged items are painted live, so frame cost depends on the size
+    of the selection rather than the scene.
+
+    Every drag step emits ``itemsMoved(items, dx, dy)`` with the offset
+    since the previous step. ``items`` is the same list object for all
+    steps of one drag, so listeners can tell drags apart.
+
+    When a ``virtualizer`` is set, the scene only holds graphics items for
+    the shapes near the viewport; selection and drags work on the
+    virtualizer's items, which include shapes that are off-screen.
+
+    Drags can snap to a grid (``snapToGrid``) and, when a ``snapIndex``
+    (see snapping.SnapIndex) is set, to the edges and centers of other
+    shapes. The dragged items' bounding box is taken once when the drag
+    starts; each step moves it by the mouse offset, looks up the nearest
+    lines within SNAP_PIXELS and adjusts the offset, and the lines it
+    snapped to are drawn as guides.
+
+    In freehand mode, dragging with the left button draws a stroke
+    instead; it is simplified as it is drawn (to SIMPLIFY_PIXELS at the
+    current zoom) and emitted as ``strokeFinished(points)`` when the
+    button is released.
     """
 
-    def __init__(self, scene, parent=None):
+    itemsMoved = pyqtSignal(object, float, float)
+    strokeFinished = pyqtSignal(object)
+
+    def __init__(self, scene, parent=None, groups=None, instrumentation=None):
         super().__init__(scene, parent)
-        self.setRenderHints(QPainter.Antialiasing | QPainter.SmoothPixmapTransform)
+        self.setRenderHints(FULL_QUALITY_HINTS)
         self.setDragMode(QGraphicsView.RubberBandDrag)
+        self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
+        self.groups = groups
+        self.virtualizer = None
+        self.instrumentation = instrumentation or Instrumentation()
         self._drag_group_id = None
-        self._drag_start_positions = {}
+        self._drag_start_positions = []
+        self._drag_items = []
+        self._drag_delta = QPointF()
         self._drag_origin = None
+        self._drag_item = None
+        self._drag_moved = False
+        self.cachedInteraction = True
+        self._live_items = []
+        self._tile_cache = None
+        self._items_painted_at = None
+        self.snapIndex = None
+        self.snapToGrid = False
+        self.gridSize = GRID_SIZE
+        self._snap_box = None
+        self._snap_rows = []
+        self._guides = []
+        self.freehand = False
+        self._stroke = None
+        self._stroke_item = None
+        self._stroke_final = None
+        self._quality_timer = QTimer(self)
+        self._quality_timer.setSingleShot(True)
+        self._quality_timer.setInterval(QUALITY_RESTORE_MS)
+        self._quality_timer.timeout.connect(self._restoreQuality)
+        self._detail_key = None
+        self._detail_limit = 0.0
+        self._detail_items = None
+        self._detail_timer = QTimer(self)
+        self._detail_timer.setInterval(0)
+        self._detail_timer.timeout.connect(self._continueItemDetail)
+        # Shapes scrolled into view get their level of detail once idle.
+        for bar in (self.horizontalScrollBar(), self.verticalScrollBar()):
+            bar.valueChanged.connect(self._scrolled)
+        self._overlay_timer = QTimer(self)
+        self._overlay_timer.setInterval(250)
+        self._overlay_timer.timeout.connect(
+            lambda: self.viewport().update(OVERLAY_RECT)
+        )
+
+    def levelOfDetail(self):
+        """Device pixels per scene unit at the current zoom."""
+        return QStyleOptionGraphicsItem.levelOfDetailFromTransform(self.transform())
+
+    def _idleRenderHints(self):
+        if self.levelOfDetail() < ANTIALIAS_MIN_LOD:
+            return QPainter.RenderHints()
+        return FULL_QUALITY_HINTS
+
+    def _beginMotion(self):
+        """Drop to fast rendering until the view has been idle a moment."""
+        if self.renderHints() & QPainter.Antialiasing:
+            self.setRenderHints(QPainter.RenderHints())
+        self._quality_timer.start()
+
+    def _restoreQuality(self):
+        if self._drag_origin is not None and self._drag_moved:
+            # Still dragging; check again after the next idle interval.
+            self._quality_timer.start()
+            return
+        hints = self._idleRenderHints()
+        if self.renderHints() != hints:
+            self.setRenderHints(hints)
+            self.viewport().update()
+        self._applyItemDetail()
+
+    def _applyItemDetail(self):
+        """
+        Draw the visible shapes that are only a few pixels wide on screen
+        without an outline (lines as hairlines), and the others in full.
+
+        The visible items are restyled in slices of DETAIL_SLICE_MS between
+        events, so a zoomed-out view of a large drawing stays responsive.
+        Nothing is done if the zoom and the visible area are unchanged.
+        """
+        visible = self.mapToScene(self.viewport().rect()).boundingRect()
+        key = (self.levelOfDetail(), visible)
+        if key == self._detail_key:
+            return
+        self._detail_key = key
+        self._detail_limit = TINY_ITEM_PIXELS / key[0]
+        self._detail_items = iter(
+            self.scene().items(visible, Qt.IntersectsItemBoundingRect)
+        )
+        self._detail_timer.start()
+
+    def _continueItemDetail(self):
+        if self._detail_items is None:
+            self._detail_timer.stop()
+            return
+        limit = self._detail_limit
+        deadline = time.perf_counter() + DETAIL_SLICE_MS / 1000
+        for count, item in enumerate(self._detail_items):
+            shape = getattr(item, "shape", None)
+            if isinstance(shape, ShapeBase):
+                rect = item.sceneBoundingRect()
+                simplified = max(rect.width(), rect.height()) < limit
+                if simplified != getattr(item, "simplified", False):
+                    style_item(item, shape, simplified)
+            if count % 256 == 255 and time.perf_counter() >= deadline:
+                return
+        self._detail_items = None
+        self._detail_timer.stop()
+
+    def wheelEvent(self, event):
+        """Zoom around the cursor with Ctrl + wheel; scroll otherwise."""
+        self._beginMotion()
+        if event.modifiers() & Qt.ControlModifier:
+            notches = event.angleDelta().y() / 120
+            factor = ZOOM_STEP**notches
+            self.scale(factor, factor)
+            self._viewportChanged()
+            event.accept()
+            return
+        super().wheelEvent(event)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._viewportChanged()
+
+    def _scrolled(self, _value):
+        # A method rather than a lambda: Qt drops the connection with the
+        # view, so scroll bars changing during teardown do not reach it.
+        self._quality_timer.start()
+
+    def _viewportChanged(self):
+        # Scrolling is picked up through the scroll bars.
+        if self.virtualizer is not None:
+            self.virtualizer.scheduleRefresh()
+
+    def setFreehand(self, enabled):
+        """Switch between drawing strokes and selecting/dragging shapes."""
+        self.freehand = enabled
+        if enabled:
+            self.setDragMode(QGraphicsView.NoDrag)
+            self.viewport().setCursor(Qt.CrossCursor)
+        else:
+            self.setDragMode(QGraphicsView.RubberBandDrag)
+            self.viewport().unsetCursor()
+
+    def _beginStroke(self, pos):
+        self._stroke = StrokeRecorder(SIMPLIFY_PIXELS / self.levelOfDetail())
+        self._stroke.add(pos.x(), pos.y())
+        # Path through the stroke's final points; the preview is this plus
+        # the tail.
+        self._stroke_final = QPainterPath()
+        self._stroke_item = QGraphicsPathItem()
+        self._stroke_item.setPen(QPen(QColor(*STROKE_COLOR), DEFAULT_STROKE_WIDTH))
+        self.scene().addItem(self._stroke_item)
+
+    def _continueStroke(self, pos):
+        stroke = self._stroke
+        final = len(stroke.final)
+        if not stroke.add(pos.x(), pos.y()):
+            return
+        if len(stroke.final) == final:
+            path = self._stroke_item.path()
+            if path.elementCount():
+                path.lineTo(stroke.tail[-2], stroke.tail[-1])
+            else:
+                # A path of a single moveTo() is stored as an empty one.
+                extend_path(path, stroke.tail)
+        else:
+            # The tail was simplified: move what became final onto the final
+            # path and redraw only the (now short) tail after it.
+            extend_path(self._stroke_final, stroke.final[final:])
+            path = extend_path(QPainterPath(self._stroke_final), stroke.tail)
+        self._stroke_item.setPath(path)
+
+    def _endStroke(self):
+        points = self._stroke.finish()
+        self.scene().removeItem(self._stroke_item)
+        self._stroke = self._stroke_item = self._stroke_final = None
+        if len(points) >= 4:
+            self.strokeFinished.emit(points)
+
+    def selectedItems(self):
+        """The selected items, including off-screen ones when virtualized."""
+        if self.virtualizer is not None:
+            return self.virtualizer.selectedItems()
+        return self.scene().selectedItems()
+
+    def setStatsOverlayVisible(self, visible):
+        """Show or hide the FPS / frame time / item count overlay."""
+        if visible:
+            self.instrumentation.enabled = True
+            self._overlay_timer.start()
+        else:
+            self._overlay_timer.stop()
+        self.viewport().update()
+
+    def isStatsOverlayVisible(self):
+        return self._overlay_timer.isActive()
+
+    def paintEvent(self, event):
+        """Paint the view, recording the frame time when instrumented."""
+        if not self.instrumentation.enabled:
+            self._paint(event)
+            return
+        began = time.perf_counter()
+        self._paint(event)
+        elapsed = time.perf_counter() - began
+        self.instrumentation.record("paint_event", elapsed)
+        self.instrumentation.frame(elapsed)
+
+    def _paint(self, event):
+        if self._live_items:
+            self._paintCachedFrame(event)
+        else:
+            super().paintEvent(event)
+
+    def _paintCachedFrame(self, event):
+        """Draw the cached static tiles, then the dragged items on top."""
+        painter = QPainter(self.viewport())
+        painter.setRenderHints(self.renderHints())
+        view_transform = self.viewportTransform()
+        painter.setTransform(view_transform)
+        exposed = self.mapToScene(event.rect()).boundingRect()
+        self._tile_cache.draw(painter, exposed)
+
+        option = QStyleOptionGraphicsItem()
+        for item in self._live_items:
+            option.state = QStyle.State_Enabled
+            if item.isSelected():
+                option.state |= QStyle.State_Selected
+            option.exposedRect = item.boundingRect()
+            painter.save()
+            painter.setTransform(item.sceneTransform() * view_transform)
+            item.paint(painter, option, self.viewport())
+            painter.restore()
+        if self._guides:
+            self._drawGuides(painter, exposed)
+
+        if self.isStatsOverlayVisible():
+            self._drawStatsOverlay(painter)
+        painter.end()
+
+    def drawBackground(self, painter, rect):
+        super().drawBackground(painter, rect)
+        if self.instrumentation.enabled:
+            self._items_painted_at = time.perf_counter()
+
+    def drawForeground(self, painter, rect):
+        """Record scene item drawing time and draw the stats overlay."""
+        if self._items_painted_at is not None:
+            self.instrumentation.record(
+                "scene_repaint", time.perf_counter() - self._items_painted_at
+            )
+            self._items_painted_at = None
+        super().drawForeground(painter, rect)
+        if self._guides:
+            self._drawGuides(painter, rect)
+        if self.isStatsOverlayVisible():
+            self._drawStatsOverlay(painter)
+
+    def _drawStatsOverlay(self, painter):
+        stats = self.instrumentation
+        lines = [
+            f"FPS: {stats.fps():.0f}",
+            f"Last frame: {stats.last_frame_ms():.1f} ms",
+        ]
+        for name, func in stats.gauges.items():
+            lines.append(f"{name}: {func()}")
+        painter.save()
+        painter.resetTransform()
+        painter.setRenderHint(QPainter.Antialiasing, False)
+        painter.fillRect(OVERLAY_RECT, QColor(0, 0, 0, 160))
+        painter.setPen(QColor(255, 255, 255))
+        painter.setFont(QFont("monospace", 8))
+        painter.drawText(
+            OVERLAY_RECT.adjusted(6, 4, -6, -4), Qt.AlignLeft, "\n".join(lines)
+        )
+        painter.restore()
 
     def mousePressEvent(self, event):
-        """Record initial drag positions and determine group ID."""
-        self._drag_start_positions.clear()
-        self._drag_origin = self.mapToScene(event.pos())
-        for item in self.scene().items():
-            if hasattr(item, "shape"):  # Ensure the item has a shape attribute
-                self._drag_start_positions[item] = item.pos()
+        """Record initial drag positions of the clicked item's group."""
+        if self.freehand and event.button() == Qt.LeftButton:
+            self._beginStroke(self.mapToScene(event.pos()))
+            return
+        with self.instrumentation.measure("mouse_press"):
+            self._drag_start_positions = []
+            self._drag_items = []
+            self._drag_delta = QPointF()
+            self._drag_origin = self.mapToScene(event.pos())
+            self._drag_moved = False
 
-        clicked_item = self.itemAt(event.pos())
-        if clicked_item and hasattr(clicked_item, "shape"):
-            shape = clicked_item.shape
-            if hasattr(shape, "group_id"):  # Check if group_id exists
-                self._drag_group_id = shape.group_id
+            clicked_item = self.itemAt(event.pos())
+            if self.virtualizer is not None:
+                clicked_item = getattr(clicked_item, "proxy", clicked_item)
+                if not event.modifiers() & Qt.ControlModifier and (
+                    clicked_item is None or not clicked_item.isSelected()
+                ):
+                    # The scene only deselects the items it holds.
+                    self.virtualizer.clearSelection()
+            self._drag_item = clicked_item
+            shape = getattr(clicked_item, "shape", None)
+            if (
+                shape is not None
+                and shape.group_id is not None
+                and self.groups is not None
+            ):
+                # Dragging a nested group's member moves its whole
+                # top-level group.
+                root = self.groups.root(shape.group_id)
+                self._drag_group_id = root
+                self._drag_start_positions = [
+                    (item, item.pos()) for item in self.groups.members(root)
+                ]
+                self._drag_items = [item for item, _ in self._drag_start_positions]
+                self.instrumentation.touched(len(self._drag_start_positions))
 
-        super().mousePressEvent(event)
+            super().mousePressEvent(event)
 
     def mouseMoveEvent(self, event):
-        """Apply movement to grouped items in real-time."""
+        """Move the dragged group as one unit by a single offset."""
+        if self._stroke is not None:
+            self._continueStroke(self.mapToScene(event.pos()))
+            return
         if not self._drag_origin:
             return
-        current_pos = self.mapToScene(event.pos())
-        delta = current_pos - self._drag_origin
-        if self._drag_group_id is not None:
-            for item, start_pos in self._drag_start_positions.items():
-                if (
-                    hasattr(item, "shape")
-                    and item.shape.group_id == self._drag_group_id
-                ):
+        with self.instrumentation.measure("mouse_move"):
+            self._drag_moved = True
+            self._beginMotion()
+            if self._drag_item is not None and not self._drag_start_positions:
+                self._drag_start_positions = [
+                    (item, item.pos())
+                    for item in self.selectedItems()
+                    if item.flags() & QGraphicsItem.ItemIsMovable
+                ]
+                self._drag_items = [item for item, _ in self._drag_start_positions]
+            if self._drag_start_positions:
+                if self.virtualizer is not None:
+                    # Keep the dragged items' graphics items in place.
+                    self.virtualizer.setSuspended(True)
+                if self.cachedInteraction and not self._live_items:
+                    self._beginCachedInteraction(self._drag_items)
+                delta = self.mapToScene(event.pos()) - self._drag_origin
+                if self.snapToGrid or self.snapIndex is not None:
+                    delta = self._snapped(delta)
+                for item, start_pos in self._drag_start_positions:
                     item.setPos(start_pos + delta)
-        super().mouseMoveEvent(event)
+                if self._live_items:
+                    # The cached frame is painted whole.
+                    self.viewport().update()
+                step = delta - self._drag_delta
+                self._drag_delta = delta
+                self.itemsMoved.emit(self._drag_items, step.x(), step.y())
+                self.instrumentation.touched(len(self._drag_start_positions))
+                # The group is already in place; letting Qt move the selection
+                # as well would touch the clicked item a second time.
+                return
+            super().mouseMoveEvent(event)
 
     def mouseReleaseEvent(self, event):
-        """Clear internal drag state after releasing the mouse."""
-        self._drag_group_id = None
-        self._drag_start_positions.clear()
-        self._drag_origin = None
-        super().mouseReleaseEvent(event)
+        """Write moved positions back to the shapes and clear drag state."""
+        if self._stroke is not None:
+            self._endStroke()
+            return
+        with self.instrumentation.measure("mouse_release"):
+            if self._live_items:
+                self._endCachedInteraction()
+            if self._drag_moved and self._drag_items:
+                delta = self._drag_delta
+                self._storePositions(self._drag_items, delta.x(), delta.y())
+                self._endSnap()
+                if self.groups is not None:
+                    if self._drag_group_id is not None:
+                        # The whole group moved by one offset, so its
+                        # cached bounds move with it.
+                        self.groups.shift(self._drag_group_id, delta.x(), delta.y())
+                    else:
+                        self.groups.invalidate(self._drag_items)
+                self.instrumentation.touched(len(self._drag_items))
+            clicked_item = self._drag_item
+            clicked_only = (
+                self.virtualizer is not None
+                and clicked_item is not None
+                and not self._drag_moved
+                and not event.modifiers() & Qt.ControlModifier
+            )
+            self._drag_group_id = None
+            self._drag_start_positions = []
+            self._drag_items = []
+            self._drag_delta = QPointF()
+            self._drag_origin = None
+            self._drag_item = None
+            self._drag_moved = False
+            super().mouseReleaseEvent(event)
+            if self.virtualizer is not None:
+                self.virtualizer.setSuspended(False)
+            if clicked_only and clicked_item.isSelected():
+                # Like the scene does for the items it holds, a plain click
+                # leaves only the clicked item selected.
+                for item in self.virtualizer.selectedItems():
+                    if item is not clicked_item:
+                        item.setSelected(False)
+
+    def _beginSnap(self):
+        """Take the dragged items' bounding box and leave them out of snapping."""
+        box = None
+        if self._drag_group_id is not None and self.groups is not None:
+            # Cached by the group registry.
+            box = self.groups.bounds(self._drag_group_id)
+        measure = box is None
+        rows = []
+        for item in self._drag_items:
+            shape = getattr(item, "shape", None)
+            if isinstance(shape, ShapeBase):
+                rows.append(shape.index)
+                if measure:
+                    box = _union(box, shape.store.row_bounds(shape.index))
+            else:
+                rect = item.sceneBoundingRect()
+                box = _union(box, (rect.left(), rect.top(), rect.right(), rect.bottom()))
+        self._snap_box = box
+        if self.snapIndex is not None:
+            self.snapIndex.exclude(rows)
+            self._snap_rows = rows
+
+    def _snapped(self, delta):
+        """Drag offset adjusted so the dragged box snaps to a guide or grid line."""
+        if self._snap_box is None:
+            self._beginSnap()
+            if self._snap_box is None:
+                return delta
+        x0, y0, x1, y1 = self._snap_box
+        dx, dy = delta.x(), delta.y()
+        box = (x0 + dx, y0 + dy, x1 + dx, y1 + dy)
+        tolerance = SNAP_PIXELS / self.levelOfDetail()
+        snap_x = snap_y = 0.0
+        guides = []
+        if self.snapIndex is not None:
+            snap_x, snap_y, guides = self.snapIndex.snap(box, tolerance)
+        if self.snapToGrid:
+            grid_x, grid_y = snap_to_grid(box, self.gridSize, tolerance)
+            axes = {guide[0] for guide in guides}
+            if "x" not in axes:
+                snap_x = grid_x
+            if "y" not in axes:
+                snap_y = grid_y
+        guides = [(axis, value) for axis, value, _ in guides]
+        if guides != self._guides:
+            self._guides = guides
+            self.viewport().update()
+        return QPointF(dx + snap_x, dy + snap_y)
+
+    def _endSnap(self):
+        if self.snapIndex is not None and self._snap_rows:
+            self.snapIndex.include(self._snap_rows)
+        self._snap_box = None
+        self._snap_rows = []
+        if self._guides:
+            self._guides = []
+            self.viewport().update()
+
+    def _drawGuides(self, painter, rect):
+        """Draw the current alignment guides across ``rect`` (scene coordinates)."""
+        pen = QPen(GUIDE_COLOR, 0)
+        pen.setCosmetic(True)
+        painter.save()
+        painter.setPen(pen)
+        for axis, value in self._guides:
+            if axis == "x":
+                painter.drawLine(QPointF(value, rect.top()), QPointF(value, rect.bottom()))
+            else:
+                painter.drawLine(QPointF(rect.left(), value), QPointF(rect.right(), value))
+        painter.restore()
+
+    def _beginCachedInteraction(self, items):
+        """Start drawing ``items`` live over a cached image of the rest."""
+        scene = self.scene()
+        if self._tile_cache is None or self._tile_cache.scene is not scene:
+            self._tile_cache = TileCache(scene)
+        self._tile_cache.setTransform(self.transform())
+        self._tile_cache.render_hints = self._idleRenderHints()
+        items = [item for item in map(graphics_item, items) if item is not None]
+        # The items stay visible (hiding them would deselect them) but are
+        # left out of the tiles; the view paints them on top.
+        self._tile_cache.exclude(items)
+        self._tile_cache.frozen = True
+        for item in items:
+            self._tile_cache.invalidate(item.sceneBoundingRect())
+        self._live_items = items
+
+    def _endCachedInteraction(self):
+        """Hand the dragged items back to the scene for normal painting."""
+        cache = self._tile_cache
+        cache.exclude(())
+        cache.frozen = False
+        for item in self._live_items:
+            # Tiles rendered during the drag lack the items where they are now.
+            cache.invalidate(item.sceneBoundingRect())
+        self._live_items = []
+        self.viewport().update()
+
+    def _storePositions(self, items, dx, dy):
+        """
+        Move the dragged items' model rows by the drag offset (dx, dy), with
+        one batch translate per store.
+        """
+        rows = {}
+        for item in items:
+            if isinstance(item, VirtualItem):
+                continue  # its setPos() already wrote the model
+            shape = getattr(item, "shape", None)
+            if isinstance(shape, ShapeBase):
+                rows.setdefault(shape.store, []).append(shape.index)
+        for store, indices in rows.items():
+            store.translate(indices, dx, dy)
+
+
+def _union(box, other):
+    """Bounding box (x0, y0, x1, y1) of two boxes; ``box`` may be None."""
+    if box is None:
+        return other
+    return (
+        min(box[0], other[0]),
+        min(box[1], other[1]),
+        max(box[2], other[2]),
+        max(box[3], other[3]),
+    )
@@ -0,0 +1,382 @@
+"""
+Viewport virtualization for very large drawings.
+
+In virtualized mode the app does not give every shape its own graphics
+item. Each shape gets a lightweight VirtualItem that reads and writes the
+shape model (which stays authoritative) and offers the small part of the
+QGraphicsItem API the app uses. A Virtualizer attached to the view keeps
+real graphics items only for shapes inside the visible rect plus a margin;
+they come from per-kind pools and are reused as the view pans and zooms.
+
+Selection lives in the model too, so shapes that are off-screen can stay
+selected and take part in group, color, rotate, scale and drag operations.
+"""
+
+from PyQt5.QtCore import QObject, QPointF, QRectF, QTimer
+from PyQt5.QtWidgets import (
+    QGraphicsEllipseItem,
+    QGraphicsItem,
+    QGraphicsLineItem,
+    QGraphicsPathItem,
+    QGraphicsRectItem,
+)
+
+from freehand import shape_path
+from shapes import KIND_ELLIPSE, KIND_LINE, KIND_POLYLINE, NO_PEN
+from spatial import SpatialIndex
+
+# Extra area kept materialized around the visible rect, as a fraction of
+# the viewport size on each side.
+MARGIN = 0.5
+
+ITEM_FLAGS = (
+    QGraphicsItem.ItemIsSelectable
+    | QGraphicsItem.ItemIsMovable
+    | QGraphicsItem.ItemIsFocusable
+)
+
+
+def graphics_item(item):
+    """The live graphics item behind an app item (None if not materialized)."""
+    if isinstance(item, VirtualItem):
+        return item.live
+    return item
+
+
+def style_item(item, shape, simplified=False):
+    """
+    Give a graphics item the shared pen and brush of its shape's style.
+
+    ``simplified`` items (ones only a few pixels wide on screen) are drawn
+    as a flat fill without an outline, or as a hairline for lines; the
+    item's ``simplified`` attribute records which pen it got.
+    """
+    styles, style = shape.store.styles, shape.style
+    item.simplified = simplified
+    if isinstance(item, (QGraphicsLineItem, QGraphicsPathItem)):
+        # Lines and polylines are drawn in their fill color.
+        if simplified:
+            item.setPen(styles.hairline_pen(style))
+        else:
+            item.setPen(styles.line_pen(style))
+    else:
+        item.setBrush(styles.brush(style))
+        item.setPen(NO_PEN if simplified else styles.pen(style))
+
+
+def geometry_rect(shape):
+    """Local bounding rect of a shape's geometry (no pen, no transform)."""
+    if shape.KIND == KIND_LINE:
+        return QRectF(QPointF(shape.x, shape.y), QPointF(shape.x2, shape.y2)).normalized()
+    return QRectF(shape.x, shape.y, shape.width, shape.height)
+
+
+class VirtualItem:
+    """
+    Stand-in graphics item backed by the shape model.
+
+    Setters update the model and, when the shape is on screen, its live
+    graphics item. ``__dict__`` is only allocated if extra attributes are
+    set (for example journal IDs).
+    """
+
+    __slots__ = ("shape", "live", "virtualizer", "__dict__")
+
+    def __init__(self, shape, virtualizer):
+        self.shape = shape
+        self.live = None
+        self.virtualizer = virtualizer
+
+    def _changed(self):
+        if self.live is None:
+            # May have moved into view.
+            self.virtualizer.scheduleRefresh()
+
+    def pos(self):
+        return QPointF(self.shape.pos_x, self.shape.pos_y)
+
+    def setPos(self, x, y=None):
+        if y is None:
+            x, y = x.x(), x.y()
+        self.shape.pos_x = x
+        self.shape.pos_y = y
+        if self.live is not None:
+            self.live.setPos(x, y)
+        self._changed()
+
+    def rotation(self):
+        return self.shape.rotation
+
+    def setRotation(self, angle):
+        self.shape.rotation = angle
+        if self.live is not None:
+            self.live.setRotation(angle)
+        self._changed()
+
+    def scale(self):
+        return self.shape.scale
+
+    def setScale(self, factor):
+        self.shape.scale = factor
+        if self.live is not None:
+            self.live.setScale(factor)
+        self._changed()
+
+    def boundingRect(self):
+        pad = self.shape.stroke_width / 2
+        return geometry_rect(self.shape).adjusted(-pad, -pad, pad, pad)
+
+    def sceneBoundingRect(self):
+        if self.live is not None:
+            return self.live.sceneBoundingRect()
+        x0, y0, x1, y1 = self.shape.store.row_bounds(self.shape.index)
+        return QRectF(x0, y0, x1 - x0, y1 - y0)
+
+    def setTransformOriginPoint(self, point):
+        if self.live is not None:
+            self.live.setTransformOriginPoint(point)
+
+    def updateGeometry(self):
+        """Refresh the live item after the shape's geometry changed."""
+        if self.live is not None:
+            self.virtualizer.configure(self.live, self.shape)
+        self._changed()
+
+    def updateStyle(self):
+        """Refresh the live item after the shape's colors changed."""
+        if self.live is not None:
+            style_item(self.live, self.shape)
+
+    def flags(self):
+        return ITEM_FLAGS
+
+    def isSelected(self):
+        return self.shape.selected
+
+    def setSelected(self, selected):
+        self.virtualizer.select(self, selected)
+
+    def isVisible(self):
+        return self.live is not None and self.live.isVisible()
+
+    def setVisible(self, visible):
+        if self.live is not None:
+            self.live.setVisible(visible)
+
+
+class Virtualizer(QObject):
+    """
+    Keeps graphics items only for the shapes near a view's visible area.
+
+    The store's spatial index finds the shapes whose bounding boxes
+    intersect the visible rect plus a margin. Items that leave it go back
+    to a pool and are reused for shapes that enter it.
+    """
+
+    def __init__(self, view, store, margin=MARGIN):
+        super().__init__(view)
+        self.view = view
+        self.scene = view.scene()
+        self.store = store
+        self.index = store.spatial or SpatialIndex(store)
+        self.margin = margin
+        self._suspended = False
+        self._stale = False
+        self._by_row = []
+        self._live = {}
+        self._selected = {}
+        self._pools = {}
+        self._syncing = False
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self.refresh)
+        view.horizontalScrollBar().valueChanged.connect(self.scheduleRefresh)
+        view.verticalScrollBar().valueChanged.connect(self.scheduleRefresh)
+        self.scene.selectionChanged.connect(self._syncSelection)
+
+    def __len__(self):
+        """Number of materialized shapes."""
+        return len(self._live)
+
+    def createItem(self, shape):
+        return VirtualItem(shape, self)
+
+    def add(self, item):
+        """Start tracking an item; it is materialized on the next refresh."""
+        index = item.shape.index
+        if index >= len(self._by_row):
+            self._by_row.extend([None] * (index + 1 - len(self._by_row)))
+        self._by_row[index] = item
+        if item.shape.selected:
+            self._selected[item] = None
+        self.scheduleRefresh()
+
+    def remove(self, item):
+        """
+        Stop tracking an item, recycling its live graphics item.
+
+        Must be called while the item's shape still owns its row.
+        """
+        if item.live is not None:
+            self._recycle(item)
+        index = item.shape.index
+        if index < len(self._by_row) and self._by_row[index] is item:
+            self._by_row[index] = None
+        if item in self._selected:
+            self.select(item, False)
+
+    def clear(self):
+        for item in list(self._live):
+            self._recycle(item)
+        self._by_row = []
+        self._selected.clear()
+
+    def setSuspended(self, suspended):
+        """
+        Hold the set of live items still (for example during a drag, while
+        the view paints some of them itself); refreshes requested meanwhile
+        run once it is resumed.
+        """
+        self._suspended = suspended
+        if not suspended and self._stale:
+            self._stale = False
+            self.scheduleRefresh()
+
+    def scheduleRefresh(self):
+        if self._suspended:
+            self._stale = True
+        elif not self._timer.isActive():
+            self._timer.start()
+
+    def visibleRect(self):
+        """Scene rect that is kept materialized: the viewport plus margin."""
+        rect = self.view.mapToScene(self.view.viewport().rect()).boundingRect()
+        dx = rect.width() * self.margin
+        dy = rect.height() * self.margin
+        return rect.adjusted(-dx, -dy, dx, dy)
+
+    def refresh(self):
+        """Materialize the shapes near the view and recycle the rest."""
+        if self._suspended:
+            self._stale = True
+            return
+        rect = self.visibleRect()
+        wanted = self._itemsIn(rect)
+        for item in [item for item in self._live if item not in wanted]:
+            self._recycle(item)
+        for item in wanted:
+            if item.live is None:
+                self._materialize(item)
+
+    def _itemsIn(self, rect):
+        by_row = self._by_row
+        if not by_row:
+            return {}
+        self._growSceneRect()
+        rows = self.index.query_rect(rect.left(), rect.top(), rect.right(), rect.bottom())
+        wanted = {}
+        count = len(by_row)
+        for row in rows:
+            item = by_row[row] if row < count else None
+            if item is not None:
+                wanted[item] = None
+        return wanted
+
+    def _growSceneRect(self):
+        # The scene only holds live items, so it would not know how far the
+        # drawing extends; keep its rect covering every shape.
+        extent = self.index.extent()
+        if extent is None:
+            return
+        x0, y0, x1, y1 = extent
+        bounds = QRectF(QPointF(x0, y0), QPointF(x1, y1))
+        rect = self.scene.sceneRect()
+        if not rect.contains(bounds):
+            self.scene.setSceneRect(rect.united(bounds))
+
+    def configure(self, live, shape):
+        """Set a live item's geometry and transform from its shape."""
+        if isinstance(live, QGraphicsLineItem):
+            live.setLine(shape.x, shape.y, shape.x2, shape.y2)
+        elif isinstance(live, QGraphicsPathItem):
+            live.setPath(shape_path(shape))
+        else:
+            live.setRect(shape.x, shape.y, shape.width, shape.height)
+        live.setTransformOriginPoint(live.boundingRect().center())
+        live.setPos(shape.pos_x, shape.pos_y)
+        live.setRotation(shape.rotation)
+        live.setScale(shape.scale)
+
+    def _materialize(self, item):
+        shape = item.shape
+        pool = self._pools.setdefault(shape.KIND, [])
+        if pool:
+            live = pool.pop()
+            live.setVisible(True)
+        else:
+            if shape.KIND == KIND_LINE:
+                live = QGraphicsLineItem()
+            elif shape.KIND == KIND_ELLIPSE:
+                live = QGraphicsEllipseItem()
+            elif shape.KIND == KIND_POLYLINE:
+                live = QGraphicsPathItem()
+            else:
+                live = QGraphicsRectItem()
+            live.setFlags(ITEM_FLAGS)
+            self.scene.addItem(live)
+        live.shape = shape
+        live.proxy = item
+        self.configure(live, shape)
+        style_item(live, shape)
+        item.live = live
+        self._live[item] = None
+        if shape.selected:
+            self._syncing = True
+            live.setSelected(True)
+            self._syncing = False
+
+    def _recycle(self, item):
+        live = item.live
+        item.live = None
+        del self._live[item]
+        live.proxy = None
+        live.shape = None
+        self._syncing = True
+        live.setSelected(False)
+        self._syncing = False
+        live.setVisible(False)
+        self._pools.setdefault(item.shape.KIND, []).append(live)
+
+    def select(self, item, selected):
+        """Set an item's selection state in the model (and on screen)."""
+        item.shape.selected = selected
+        if selected:
+            self._selected[item] = None
+        else:
+            self._selected.pop(item, None)
+        if item.live is not None and item.live.isSelected() != selected:
+            self._syncing = True
+            item.live.setSelected(selected)
+            self._syncing = False
+
+    def selectedItems(self):
+        return list(self._selected)
+
+    def clearSelection(self):
+        """Deselect every shape, on screen or not."""
+        for item in list(self._selected):
+            self.select(item, False)
+
+    def _syncSelection(self):
+        """Copy selection changes made through the scene into the model."""
+        if self._syncing:
+            return
+        for item in self._live:
+            selected = item.live.isSelected()
+            if selected != item.shape.selected:
+                item.shape.selected = selected
+                if selected:
+                    self._selected[item] = None
+                else:
+                    self._selected.pop(item, None)